@@ -0,0 +1,409 @@
+"""
+    Copyright 2025 Oleh Sharuda <oleh.sharuda@gmail.com>
+
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+ """
+
+from tools import *
+import database
+from database import BooKeeperDB
+from logger import Logger
+from processors import image_pipeline
+from processors.image_pipeline import read_images
+from processors.proc_base import BookInfo, BookFileType, RenderSettings
+from processors.proc_djvu import Djvu_PROC
+from processors.proc_pdf import Pdf_PROC
+import concurrent.futures
+import difflib
+import hashlib
+import glob
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import time
+
+
+OPT_SHELL = '--shell'
+OPT_OCR = '--ocr'
+OPT_RENDER = '--render'
+OPT_LANG = '--lang'
+OPT_DB = '--db'
+OPT_DB_STORAGE = '--db-storage'
+
+
+def help(exit_code: int, message=None):
+    if message:
+        print(f"{message}\n\n")
+    print(f"""Program usage:
+benchmark.py <command> [arguments]
+Where command is one of the following:
+{OPT_SHELL} [calls] : Per call overhead of run_shell_adv() compared to the former polling implementation.
+{OPT_OCR} <pages dir> [language] : OCR time and accuracy of preprocessing pipelines compared to the former convert chain.
+    Pages are image files in the directory, reference text of the page (if any) is in the file with the same name
+    and .txt extension.
+{OPT_RENDER} <book> [pages] [language] : OCR time per page of pdf or djvu book rendered with different settings.
+{OPT_LANG} <pages dir> [language] : OCR time and accuracy with all configured languages compared to languages of the
+    script detected per page. Reference text of the page (if any) is in .txt file, expected language in .lang file.
+{OPT_DB} [files] [unbatched files] : Files per second written to the database of synthetic library (1000000 files by
+    default) with commit per change (the first 10000 files by default) compared to batched commits.
+{OPT_DB_STORAGE} [files] [library files] [checkpoint interval] : Database open, write and close time of the library
+    (100000 files by default) with 10000 new files (by default) on disk with the former rollback journal, on disk with WAL
+    and tuned pragmas, and on RAM drive with checkpoints (10 seconds by default).
+""")
+
+    quit(exit_code)
+
+
+def check_params():
+    if len(sys.argv) < 2:
+        help(1, message="Wrong number of arguments.")
+
+    available_options = {OPT_SHELL, OPT_OCR, OPT_RENDER, OPT_LANG, OPT_DB, OPT_DB_STORAGE}
+    if sys.argv[1] not in available_options:
+        help(1, message="Bad command.")
+
+
+def get_int_arg(n: int, default: int) -> int:
+    if len(sys.argv) > n:
+        return int(sys.argv[n])
+    return default
+
+
+def print_row(name: str, total: float, n: int, unit: str = 'call'):
+    print(f'{name:<40} {total:10.3f} s total {1000.0 * total / n:10.3f} ms/{unit}')
+
+
+#region SHELL
+def read_stdout_lines_polling(proc: subprocess.Popen) -> str:
+    result = str()
+    for line in iter(proc.stdout.readline, b''):
+        l = line.rstrip().decode("UTF-8", errors='replace')
+        result += l + os.linesep
+    return result
+
+
+def run_shell_polling(params: list) -> tuple:
+    """
+    Former implementation of run_shell_adv() (polling, 0.5 s wait timeout), kept for comparison.
+    """
+    stdout_accum = ""
+    proc = subprocess.Popen(params,
+        stderr=subprocess.STDOUT, stdout=subprocess.PIPE, stdin=subprocess.PIPE,
+        close_fds=True,
+        preexec_fn=os.setpgrp)
+    proc.stdin.close()
+    set_nonblock_io(proc.stdout)
+
+    while proc.poll() is None:
+        stdout_accum += read_stdout_lines_polling(proc)
+        try:
+            proc.wait(timeout=0.5)
+        except subprocess.TimeoutExpired:
+            pass
+
+    stdout_accum += read_stdout_lines_polling(proc)
+    return (proc.returncode==0, proc.returncode, stdout_accum)
+
+
+def benchmark_shell():
+    n = get_int_arg(2, 20)
+    commands = [('true', ['true']),
+                ('echo', ['echo', 'benchmark']),
+                ('sleep 0.1', ['sleep', '0.1'])]
+
+    print(f'{n} calls per command')
+    for name, params in commands:
+        t = time.perf_counter()
+        for i in range(n):
+            run_shell_polling(params)
+        print_row(f'{name} (polling)', time.perf_counter() - t, n)
+
+        t = time.perf_counter()
+        for i in range(n):
+            run_shell_adv(params, print_stdout=False)
+        print_row(f'{name} (event driven)', time.perf_counter() - t, n)
+#endregion
+
+
+#region OCR
+def get_text_accuracy(reference: str, text: str) -> float:
+    return difflib.SequenceMatcher(None, reference.lower().split(), text.lower().split(), autojunk=False).ratio()
+
+
+def benchmark_ocr():
+    if len(sys.argv) < 3:
+        help(1, message=f"{OPT_OCR} requires pages directory.")
+
+    pages_dir = sys.argv[2]
+    lang = sys.argv[3] if len(sys.argv) > 3 else 'eng'
+    pages = sorted(filter(lambda f: not f.endswith('.txt'), glob.glob(os.path.join(pages_dir, '*'))))
+    if not pages:
+        help(1, message=f"No page images in {pages_dir}.")
+
+    pipelines = [('convert chain', [image_pipeline.CONVERT_PIPELINE]),
+                 ('no preprocessing', []),
+                 (' + '.join(image_pipeline.DEFAULT_OCR_STAGES), image_pipeline.DEFAULT_OCR_STAGES),
+                 (' + '.join(image_pipeline.DEFAULT_OCR_STAGES + ['deskew']), image_pipeline.DEFAULT_OCR_STAGES + ['deskew'])]
+
+    print(f'{len(pages)} pages, language: {lang}')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        Logger(log_file=os.path.join(temp_dir, 'benchmark.log'), level='error')
+        proc = Pdf_PROC(temp_dir, lang, True, None, None)
+        for name, stages in pipelines:
+            image_pipeline.configure_ocr_pipeline(stages)
+            accuracy = list()
+            t = time.perf_counter()
+            for page in pages:
+                text = proc.ocr_text(page)
+                reference_name = os.path.splitext(page)[0] + '.txt'
+                if os.path.isfile(reference_name):
+                    accuracy.append(get_text_accuracy(read_text_file(reference_name), text))
+            print_row(name, time.perf_counter() - t, len(pages), 'page')
+            if accuracy:
+                print(f'{"":<40} accuracy {100.0 * sum(accuracy) / len(accuracy):6.2f} % ({len(accuracy)} pages with reference text)')
+#endregion
+
+
+#region RENDER
+def benchmark_render():
+    if len(sys.argv) < 3:
+        help(1, message=f"{OPT_RENDER} requires book file name.")
+
+    file_name = os.path.abspath(sys.argv[2])
+    n = get_int_arg(3, 4)
+    lang = sys.argv[4] if len(sys.argv) > 4 else 'eng'
+    settings = [RenderSettings(dpi, color, 0) for dpi in (100, 150, 200, 300) for color in ('color', 'gray', 'mono')]
+    settings.append(RenderSettings(150, 'gray', 0, 300))
+    settings.append(RenderSettings(300, 'gray', 2000))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        Logger(log_file=os.path.join(temp_dir, 'benchmark.log'), level='error')
+        if file_name.lower().endswith('.pdf'):
+            proc = Pdf_PROC(temp_dir, lang, True, None, None)
+        else:
+            proc = Djvu_PROC(temp_dir, lang, True, None, None)
+
+        page_num = proc.get_page_count(file_name)
+        pages = list(range(min(n, page_num)))
+        print(f'{len(pages)} pages of {page_num}, language: {lang}')
+        for s in settings:
+            proc.render_settings = s
+            t = time.perf_counter()
+            text = proc.get_pages_with_ocr_batch(file_name, pages, page_num)
+            print_row(str(s), time.perf_counter() - t, len(pages), 'page')
+            print(f'{"":<40} {sum(map(len, text))} characters recognized')
+#endregion
+
+
+#region LANG
+def benchmark_lang():
+    if len(sys.argv) < 3:
+        help(1, message=f"{OPT_LANG} requires pages directory.")
+
+    pages_dir = sys.argv[2]
+    lang = sys.argv[3] if len(sys.argv) > 3 else 'eng+rus'
+    pages = sorted(filter(lambda f: os.path.splitext(f)[1] not in {'.txt', '.lang'}, glob.glob(os.path.join(pages_dir, '*'))))
+    if not pages:
+        help(1, message=f"No page images in {pages_dir}.")
+
+    print(f'{len(pages)} pages, language: {lang}')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        Logger(log_file=os.path.join(temp_dir, 'benchmark.log'), level='error')
+        proc = Pdf_PROC(temp_dir, lang, True, None, None)
+        total_time = {'all languages': 0.0, 'detected script': 0.0}
+        accuracy = {'all languages': list(), 'detected script': list()}
+        detected_right = list()
+        for page in pages:
+            image = read_images(page)[0]
+            image_data = image_pipeline.ocr_pipeline.process_pages([image])
+            reference_name = os.path.splitext(page)[0] + '.txt'
+            label_name = os.path.splitext(page)[0] + '.lang'
+
+            t = time.perf_counter()
+            text = proc.run_tesseract_tsv(image_data, 1)[0][0]
+            total_time['all languages'] += time.perf_counter() - t
+            texts = {'all languages': text}
+
+            t = time.perf_counter()
+            page_lang = proc.detect_page_languages([image])[0]
+            text = proc.run_tesseract_tsv(image_data, 1, page_lang)[0][0]
+            total_time['detected script'] += time.perf_counter() - t
+            texts['detected script'] = text
+
+            if os.path.isfile(reference_name):
+                reference = read_text_file(reference_name)
+                for name, text in texts.items():
+                    accuracy[name].append(get_text_accuracy(reference, text))
+            if os.path.isfile(label_name):
+                detected_right.append(read_text_file(label_name).strip() == page_lang)
+
+        for name in total_time.keys():
+            print_row(name, total_time[name], len(pages), 'page')
+            if accuracy[name]:
+                print(f'{"":<40} accuracy {100.0 * sum(accuracy[name]) / len(accuracy[name]):6.2f} % ({len(accuracy[name])} pages with reference text)')
+        saved = total_time['all languages'] - total_time['detected script']
+        print(f'{"":<40} {1000.0 * saved / len(pages):10.3f} ms/page saved by script detection')
+        if detected_right:
+            print(f'{"":<40} script detection {100.0 * sum(detected_right) / len(detected_right):6.2f} % right ({len(detected_right)} labelled pages)')
+#endregion
+
+
+#region DB
+# Synthetic library: directories of 100 files, 80 books (every 10th is a duplicate of another book) and 20 other files.
+DB_DIRECTORY_FILES = 100
+DB_DIRECTORY_BOOKS = 80
+
+
+def write_synthetic_directory(db: BooKeeperDB, n: int, bulk: bool):
+    """
+    Writes n-th directory of the synthetic library, other files are written in bulk if bulk is True.
+    """
+    path = f'/library/{n // 1000}/{n}'
+    for i in range(DB_DIRECTORY_BOOKS):
+        file_name = f'{path}/book_{i}.pdf'
+        book_id = n * DB_DIRECTORY_BOOKS + i
+        if i % 10 == 9:
+            book_id -= 1
+        file_hash = hashlib.md5(str(book_id).encode()).hexdigest()
+        db.set_file_stat(file_name, 1, n * DB_DIRECTORY_FILES + i, 1000 + book_id, 0, file_hash)
+        if db.is_processed_book(file_hash):
+            db.add_existing_book(file_name, file_hash, '')
+        else:
+            db.add_new_book(BookInfo(BookFileType.PDF, file_name, False, 10, 1000 + book_id, f"Book's text {book_id}",
+                                     file_hash), '')
+
+    others = [(f'{path}/file_{i}.txt', i, None) for i in range(DB_DIRECTORY_FILES - DB_DIRECTORY_BOOKS)]
+    if bulk:
+        db.add_other_files(others)
+    else:
+        for lfn, size, crc in others:
+            db.add_get_other_file(lfn, size, None, crc)
+
+
+def benchmark_db():
+    files = get_int_arg(2, 1000000)
+    unbatched_files = min(get_int_arg(3, 10000), files)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        Logger(log_file=os.path.join(temp_dir, 'benchmark.log'), level='error')
+        db = BooKeeperDB(db_file_name=os.path.join(temp_dir, 'benchmark.db'), ram_drive_db='', override_db=True)
+        directories = files // DB_DIRECTORY_FILES
+        unbatched_directories = unbatched_files // DB_DIRECTORY_FILES
+
+        t = time.perf_counter()
+        for n in range(unbatched_directories):
+            write_synthetic_directory(db, n, False)
+        unbatched_time = time.perf_counter() - t
+
+        # Batched files are written to the larger database, so their rate is not overestimated.
+        t = time.perf_counter()
+        db.begin_batch()
+        for n in range(unbatched_directories, directories):
+            write_synthetic_directory(db, n, True)
+            db.flush()
+        db.end_batch()
+        batched_time = time.perf_counter() - t
+        db.finalize()
+
+        rows = [('commit per change', unbatched_time, unbatched_directories * DB_DIRECTORY_FILES),
+                ('commit per directory', batched_time, (directories - unbatched_directories) * DB_DIRECTORY_FILES)]
+        for name, total, n in rows:
+            if n:
+                print(f'{name:<40} {total:10.3f} s total {n / total if total else 0.0:10.0f} files/s ({n} files)')
+
+
+def run_in_process(fn: Callable, *args):
+    """
+    Runs function in a separate (forked) process, so it opens its own database instance (database is a singleton).
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as executor:
+        return executor.submit(fn, *args).result()
+
+
+def run_db_storage(db_file_name: str, ram_drive_db: str, pragmas: dict, checkpoint_interval: float,
+                   first_directory: int, directories: int) -> tuple[float, float, float, int]:
+    """
+    Writes directories of the synthetic library to the database, see run_in_process().
+    Returns: tuple (open time, write time, close time, number of checkpoints).
+    """
+    database.configure_db(pragmas, checkpoint_interval)
+    t = time.perf_counter()
+    db = BooKeeperDB(db_file_name=db_file_name, ram_drive_db=ram_drive_db, override_db=False)
+    open_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    db.begin_batch()
+    for n in range(first_directory, first_directory + directories):
+        write_synthetic_directory(db, n, True)
+        db.flush()
+    db.end_batch()
+    write_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    checkpoints = db.checkpoints
+    db.finalize()
+    return open_time, write_time, time.perf_counter() - t, checkpoints
+
+
+def benchmark_db_storage():
+    files = get_int_arg(2, 10000)
+    library_files = get_int_arg(3, 100000)
+    checkpoint_interval = float(sys.argv[4]) if len(sys.argv) > 4 else 10.0
+    directories = files // DB_DIRECTORY_FILES
+    library_directories = library_files // DB_DIRECTORY_FILES
+    ram_drive = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    modes = [('disk, rollback journal', {'journal_mode': 'delete', 'synchronous': 'full', 'cache_size': -2000,
+                                         'mmap_size': 0, 'temp_store': 'default'}, False),
+             ('disk, wal + tuned pragmas', dict(database.db_pragmas), False),
+             ('ram drive, backup checkpoints', dict(database.db_pragmas), True)]
+
+    print(f'{library_directories * DB_DIRECTORY_FILES} files in library, '
+          f'{directories * DB_DIRECTORY_FILES} files written, RAM drive: {ram_drive}')
+    with tempfile.TemporaryDirectory() as temp_dir, tempfile.TemporaryDirectory(dir=ram_drive) as ram_dir:
+        Logger(log_file=os.path.join(temp_dir, 'benchmark.log'), level='error')
+        library_db = os.path.join(temp_dir, 'library.db')
+        db_file_name = os.path.join(temp_dir, 'benchmark.db')
+        run_in_process(run_db_storage, library_db, '', dict(), 0, 0, library_directories)
+
+        for name, pragmas, use_ram_drive in modes:
+            for fn in database.get_db_files(db_file_name):
+                if os.path.isfile(fn):
+                    os.unlink(fn)
+            shutil.copy(library_db, db_file_name)
+            ram_drive_db = os.path.join(ram_dir, 'ram.db') if use_ram_drive else ''
+            open_time, write_time, close_time, checkpoints = run_in_process(
+                run_db_storage, db_file_name, ram_drive_db, pragmas, checkpoint_interval, library_directories, directories)
+            n = directories * DB_DIRECTORY_FILES
+            print(f'{name:<40} open {open_time:8.3f} s, write {write_time:8.3f} s '
+                  f'({n / write_time if write_time else 0.0:8.0f} files/s), close {close_time:8.3f} s, '
+                  f'{checkpoints} checkpoints')
+#endregion
+
+
+if __name__ == "__main__":
+    check_params()
+    cmd = sys.argv[1]
+
+    if cmd==OPT_SHELL:
+        benchmark_shell()
+    elif cmd==OPT_OCR:
+        benchmark_ocr()
+    elif cmd==OPT_RENDER:
+        benchmark_render()
+    elif cmd==OPT_LANG:
+        benchmark_lang()
+    elif cmd==OPT_DB:
+        benchmark_db()
+    elif cmd==OPT_DB_STORAGE:
+        benchmark_db_storage()
@@ -0,0 +1,5 @@
+#!/bin/bash
+SCRIPT_PATH=$(dirname "$(realpath $0)")
+pushd $SCRIPT_PATH > /dev/null
+./.venv/bin/python benchmark.py "$@"
+popd > /dev/null
@@ -17,6 +17,7 @@
 
 import json
 import os
+from processors.image_pipeline import DEFAULT_OCR_STAGES
 
 
 class BooKeeperConfig:
@@ -37,6 +38,25 @@ class BooKeeperConfig:
                 self.export_path = result['export_path']
                 self.use_ram_drive_for_db = result['use_ram_drive_for_db']
                 self.ram_drive_db = os.path.join(self.ram_drive_path, 'ram.db') if self.use_ram_drive_for_db else ''
+                self.hash_workers = int(result.get('hash_workers', 2))
+                self.hash_buffer_size = int(result.get('hash_buffer_size', 1024 * 1024))
+                self.hash_use_mmap = bool(result.get('hash_use_mmap', 0))
+                self.scratch_path = result.get('scratch_path', '')
+                self.ram_drive_reserve = int(result.get('ram_drive_reserve', 64 * 1024 * 1024))
+                self.ocr_preprocess = list(result.get('ocr_preprocess', DEFAULT_OCR_STAGES))
+                self.ocr_workers = int(result.get('ocr_workers', 1))
+                self.ocr_render = dict(result.get('ocr_render', dict()))
+                self.ocr_cache_file_name = os.path.join(self.work_path, result.get('ocr_cache_file_name', 'ocr_cache.db'))
+                self.ocr_cache_size = int(result.get('ocr_cache_size', 256 * 1024 * 1024))
+                self.ocr_detect_script = bool(result.get('ocr_detect_script', 0))
+                self.page_sampling = list(result.get('page_sampling', [0.1, 0.3, 0.5]))
+                self.full_text = bool(result.get('full_text', 0))
+                self.full_text_ocr_pages = int(result.get('full_text_ocr_pages', 0))
+                self.db_commit_rows = int(result.get('db_commit_rows', 1000))
+                self.db_commit_interval = float(result.get('db_commit_interval', 5))
+                self.db_pragmas = dict(result.get('db_pragmas', dict()))
+                self.db_checkpoint_interval = float(result.get('db_checkpoint_interval', 300))
+                self.db_bloom_error_rate = float(result.get('db_bloom_error_rate', 0))
         except Exception as e:
             print(f'Failed to load configuration file: {config_file_name}')
             print(str(e))
@@ -14,12 +14,18 @@
     See the License for the specific language governing permissions and
     limitations under the License.
  """
-import shutil
 import sqlite3
 import contextlib
+import concurrent.futures
+import queue
+import threading
+import time
+import zlib
 from processors.proc_base import *
 from processors.processors import BookInfo
 from logger import *
+from membership import KeySet
+from tools import make_text_snippet
 import re
 
 class FileErrorCode(IntEnum):
@@ -28,6 +34,56 @@ class FileErrorCode(IntEnum):
     ERROR_BAD_ARCHIVE = -102
 
 
+# SQLite pragmas applied to the database connection: WAL journal, so committed changes survive a crash without full
+# sync on every commit, larger page cache, memory mapped reads and temporary tables in memory.
+db_pragmas = {'journal_mode': 'wal',
+              'synchronous': 'normal',
+              'cache_size': -64 * 1024,
+              'mmap_size': 256 * 1024 * 1024,
+              'temp_store': 'memory'}
+
+# Time (seconds) between checkpoints of the RAM drive database to disk, 0 - database is copied to disk on finalize only.
+db_checkpoint_interval = 300.0
+
+pragma_value_re = re.compile(r'^(-?\d+|[A-Za-z_]+)$')
+
+
+def configure_db(pragmas: dict, checkpoint_interval: float):
+    """
+    Sets database options, must be called before database is opened.
+    Args:
+        pragmas: dict (pragma name -> value) overriding default pragmas (see db_pragmas), i.e. {"synchronous": "full"}.
+        checkpoint_interval: See db_checkpoint_interval.
+    """
+    global db_checkpoint_interval
+    for name, value in pragmas.items():
+        if name not in db_pragmas:
+            raise RuntimeError(f'Bad database pragma: {name}')
+        if not pragma_value_re.match(str(value)):
+            raise RuntimeError(f'Bad value of database pragma {name}: {value}')
+        db_pragmas[name] = value
+    db_checkpoint_interval = checkpoint_interval
+
+
+# Maximum number of the books with full text returned by a search, best ranked ones are returned.
+full_text_search_limit = 1000
+
+
+# Tables (and their key columns) indexed in memory during scan, see BooKeeperDB.load_membership().
+membership_keys = {'book_files': 'file_name',
+                   'archive_files': 'file_name',
+                   'bad_files': 'file_name',
+                   'books': 'hash',
+                   'archives': 'hash'}
+
+
+def get_db_files(db_file_name: str) -> list[str]:
+    """
+    Returns: Database file and its journal files.
+    """
+    return [db_file_name + suffix for suffix in ('', '-wal', '-shm', '-journal')]
+
+
 class BooKeeperDB:
     _instance = None
 
@@ -47,23 +103,13 @@ class BooKeeperDB:
 
 
     def finalize(self):
-        self.close_db()
-        self.logger.print_diagnostic(f'BooKeeperDB destroyed.', console_only=True)
-
         if self.ram_drive_db:
             self.logger.print_log("Copying database from RAM drive")
-            tmp_fn = self.db_file_name+'.bak'
-            if os.path.isfile(tmp_fn):
-                os.unlink(tmp_fn)
-
-            if os.path.isfile(self.db_file_name):
-                shutil.move(self.db_file_name, tmp_fn)
-
-            shutil.copy(self.ram_drive_db, self.db_file_name)
-
-            if os.path.isfile(tmp_fn):
-                os.unlink(tmp_fn)
+            self.checkpoint()
+            self.disk_connection.close()
 
+        self.close_db()
+        self.logger.print_diagnostic(f'BooKeeperDB destroyed.', console_only=True)
         self.logger.print_log("Database successfully closed.")
         self.finalized = True
 
@@ -74,24 +120,50 @@ class BooKeeperDB:
         self.db_escape_trans = str.maketrans({"'": "''"})
         self.book_cache = None
         self.file_name_cache = None
+        self.full_text_cache = None
         self.ram_drive_db = ram_drive_db
         self.finalized = False
         self.new_book_counter = 0
-
-        if override_db and os.path.isfile(self.db_file_name):
-            os.unlink(self.db_file_name)
-
+        self.batch_depth = 0
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+        self.commit_rows = 1000
+        self.commit_interval = 5.0
+        self.disk_connection = None
+        self.last_checkpoint = time.monotonic()
+        self.checkpoints = 0
+        self.checkpoint_thread = None
+        self.membership = None
+        self.memory_lookups = 0
+        self.db_lookups = 0
+
+        if override_db:
+            for fn in get_db_files(self.db_file_name):
+                if os.path.isfile(fn):
+                    os.unlink(fn)
+
+        # Connection may be used by the database writer thread (see BooKeeperDBWriter), access is serialized there.
+        # Statements are parameterized, so they are prepared once and taken from the statement cache afterward.
         if self.ram_drive_db:
+            # Database on disk is only written by checkpoints (online backup), so it is consistent even if scan crashes.
             self.logger.print_log("Copying database to RAM drive")
-            if os.path.isfile(ram_drive_db):
-                os.unlink(self.ram_drive_db)
-            if os.path.isfile(self.db_file_name):
-                shutil.copy(self.db_file_name, self.ram_drive_db)
+            for fn in get_db_files(self.ram_drive_db):
+                if os.path.isfile(fn):
+                    os.unlink(fn)
+            self.disk_connection = sqlite3.connect(self.db_file_name, check_same_thread=False)
+            self.apply_pragmas(self.disk_connection)
+            self.connection = sqlite3.connect(self.ram_drive_db, check_same_thread=False, cached_statements=256)
+            self.disk_connection.backup(self.connection)
+        else:
+            self.connection = sqlite3.connect(self.db_file_name, check_same_thread=False, cached_statements=256)
 
-        db_file = self.ram_drive_db if self.ram_drive_db else self.db_file_name
-        self.connection = sqlite3.connect(db_file)
+        self.apply_pragmas(self.connection)
         self.init_db()
+        self.upgrade_db()
         self.connection.commit()
+        # Files written outside of scan (see prepare_scan()) belong to the last scan generation.
+        self.generation = self.connection.execute("""select coalesce(max(id), 0) from scans;""").fetchone()[0]
+        self.scan_root = None
         self.update_cache()
         self.logger.print_diagnostic('BooKeeperDB created.', console_only=True)
 
@@ -184,8 +256,139 @@ foreign key(path_id) references other_paths(id)
         self.connection.commit()
 
 
+    def upgrade_db(self):
+        """
+        Creates tables and indexes introduced after initial database layout, so existing databases are upgraded.
+        """
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            cursor.execute("""CREATE TABLE IF NOT EXISTS file_stats( 
+file_name string primary key,
+device int,
+inode int,
+size sqlite_int64,
+mtime_ns sqlite_int64,
+hash string
+);""")
+
+            cursor.execute("""create index if not exists indx_file_stats_on_stat on file_stats(device, inode, size, mtime_ns);
+""")
+
+            self.add_column(cursor, 'other_files', 'crc string')
+            self.add_column(cursor, 'books', 'language string')
+
+            # Books and archives are not looked up by size.
+            cursor.execute("""drop index if exists indx_books_on_size;""")
+            cursor.execute("""drop index if exists indx_archives_on_size;""")
+
+            cursor.execute("""create index if not exists indx_other_files_on_size on other_files(size);
+""")
+
+            cursor.execute("""create index if not exists indx_bad_files_on_file_name on bad_files(file_name);
+""")
+
+            cursor.execute("""CREATE TABLE IF NOT EXISTS ocr_queue( 
+hash string primary key,
+error string
+);""")
+
+            cursor.execute("""CREATE TABLE IF NOT EXISTS book_texts( 
+hash string primary key,
+text_data blob,
+size int,
+error string
+);""")
+
+            # Full text index is contentless: text is kept compressed in book_texts only, rowids of both tables match.
+            fts_exists = cursor.execute("""select count(*) from sqlite_master where name='book_texts_fts';""").fetchone()[0]
+            cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS book_texts_fts USING fts5(text_data, content='');""")
+            if not fts_exists:
+                for rowid, data in self.connection.execute("""select rowid, text_data from book_texts where error is null;"""):
+                    cursor.execute("""insert into book_texts_fts (rowid, text_data) values(?, ?);""",
+                                   (rowid, zlib.decompress(data).decode('UTF-8')))
+
+            cursor.execute("""CREATE TABLE IF NOT EXISTS scans( 
+id integer primary key,
+library string,
+started real,
+finished real
+);""")
+
+            # Files recorded before scan generations were introduced belong to generation 0.
+            self.add_column(cursor, 'archive_files', 'generation int default 0')
+            self.add_column(cursor, 'book_files', 'generation int default 0')
+            self.add_column(cursor, 'other_files', 'generation int default 0')
+
+        self.connection.commit()
+
+
+    @staticmethod
+    def add_column(cursor, table: str, column: str):
+        """
+        Adds column to the table if it doesn't exist yet.
+        Args:
+            cursor: Database cursor.
+            table: Table name.
+            column: Column definition ('name type').
+        """
+        column_name = column.split(' ')[0]
+        columns = map(lambda r: r[1], cursor.execute(f"""pragma table_info({table});""").fetchall())
+        if column_name not in columns:
+            cursor.execute(f"""alter table {table} add column {column};""")
+
+
+    @staticmethod
+    def apply_pragmas(connection: sqlite3.Connection):
+        # Values are checked by configure_db(), pragmas don't accept parameters.
+        for name, value in db_pragmas.items():
+            connection.execute(f"""pragma {name}={value};""")
+
+
+    def checkpoint(self, wait: bool = True):
+        """
+        Copies RAM drive database to disk with SQLite online backup API. Disk database is replaced in a single
+        transaction, so it keeps the previous checkpoint if copy is interrupted.
+        Args:
+            wait: Wait for the copy. Otherwise, it is made by background thread, and skipped if the previous one is
+                  still running.
+        """
+        if self.disk_connection is None:
+            return
+
+        if self.checkpoint_thread is not None:
+            if not wait and self.checkpoint_thread.is_alive():
+                return
+            self.checkpoint_thread.join()
+            self.checkpoint_thread = None
+
+        self.connection.commit()
+        self.last_checkpoint = time.monotonic()
+        if wait:
+            self.copy_to_disk()
+        else:
+            self.checkpoint_thread = threading.Thread(target=self.copy_to_disk, name='DBCheckpoint')
+            self.checkpoint_thread.start()
+
+
+    def copy_to_disk(self):
+        """
+        Checkpoint copy. RAM drive database is read with its own connection: it is in WAL mode, so the copy doesn't
+        block database writer, and the copy is a snapshot of the last commit.
+        """
+        t = time.monotonic()
+        try:
+            with contextlib.closing(sqlite3.connect(self.ram_drive_db)) as source:
+                source.backup(self.disk_connection)
+        except sqlite3.Error as e:
+            self.logger.print_err(f'Database checkpoint failed: {e}')
+            return
+
+        self.checkpoints += 1
+        self.logger.print_diagnostic(f'Database checkpoint: {time.monotonic() - t:.3f} s.')
+
+
     def close_db(self):
-        #self.connection.commit()
+        # Changes of unfinished batch (see begin_batch()) are kept.
+        self.connection.commit()
         self.connection.close()
 
 
@@ -193,6 +396,104 @@ foreign key(path_id) references other_paths(id)
         return s.translate(self.db_escape_trans)
 
 
+    def load_membership(self):
+        """
+        Loads names of the scanned files and hashes of the processed books and archives into memory, so per-file scan
+        lookups (is_bad_file(), is_scanned_book(), is_processed_book(), ...) don't query the database. Index is updated
+        as rows are written, it is dropped by post_scan().
+        """
+        self.membership = dict()
+        self.memory_lookups = 0
+        self.db_lookups = 0
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            for table, column in membership_keys.items():
+                count = cursor.execute(f"""select count(*) from {table};""").fetchone()[0]
+                keys = KeySet(count)
+                for (key,) in cursor.execute(f"""select {column} from {table};"""):
+                    if key is not None:
+                        keys.add(key)
+                self.membership[table] = keys
+
+
+    def check_membership(self, table: str, key: str):
+        """
+        Returns: True or False if in-memory index knows if key is present in the table, None if database is to be queried.
+        """
+        res = self.membership[table].check(key) if self.membership is not None else None
+        if res is None:
+            self.db_lookups += 1
+        else:
+            self.memory_lookups += 1
+        return res
+
+
+    def add_membership(self, table: str, key: str):
+        if self.membership is not None:
+            self.membership[table].add(key)
+
+
+    def get_membership_stats(self) -> tuple[int, int]:
+        """
+        Returns: tuple (lookups answered by in-memory index, lookups answered by database) since the index was loaded.
+        """
+        return self.memory_lookups, self.db_lookups
+
+
+    def configure_commit(self, rows: int, interval: float):
+        """
+        Sets how often changes are committed within a batch (see begin_batch()).
+        Args:
+            rows: Number of changes committed together, 0 - no limit.
+            interval: Time (seconds) changes may stay uncommitted, 0 - no limit.
+        """
+        self.commit_rows = rows
+        self.commit_interval = interval
+
+
+    def begin_batch(self):
+        """
+        Starts a batch: changes are not committed one by one anymore, they are committed together by flush(),
+        end_batch(), or once commit_rows changes are collected or commit_interval is elapsed. Batches may be nested.
+        """
+        self.batch_depth += 1
+
+
+    def end_batch(self):
+        """
+        Finishes a batch started by begin_batch(), changes are committed once the outermost batch is finished.
+        """
+        self.batch_depth -= 1
+        if self.batch_depth <= 0:
+            self.batch_depth = 0
+            self.flush()
+
+
+    def flush(self):
+        """
+        Commits changes collected so far.
+        """
+        self.connection.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+        if (self.disk_connection is not None and db_checkpoint_interval > 0 and
+                self.last_commit - self.last_checkpoint >= db_checkpoint_interval):
+            self.checkpoint(wait=False)
+
+
+    def commit(self, rows: int = 1):
+        """
+        Commits a change of the given number of rows. Within a batch commit is deferred (see begin_batch()).
+        """
+        if self.batch_depth == 0:
+            self.flush()
+            return
+
+        self.uncommitted += rows
+        if ((self.commit_rows > 0 and self.uncommitted >= self.commit_rows) or
+                (self.commit_interval > 0 and time.monotonic() - self.last_commit >= self.commit_interval)):
+            self.flush()
+
+
     def add_update_bad_file(self,
                             file_name: str,
                             file_hash: str,
@@ -200,37 +501,28 @@ foreign key(path_id) references other_paths(id)
                             parent_arch_hash: str,
                             error_code: FileErrorCode):
 
-        if not parent_arch_hash:
-            parent_arch = "NULL"
-        else:
-            parent_arch = f"'{parent_arch_hash}'"
+        parent_arch = parent_arch_hash if parent_arch_hash else None
 
         do_update = self.is_bad_file(file_name)
         if do_update:
-            query = f"""update bad_files 
+            query = """update bad_files 
 set
-file_type = {int(file_type)},
-hash = '{file_hash}',
-archive_hash = {parent_arch},
-error_code = {error_code},
+file_type = ?,
+hash = ?,
+archive_hash = ?,
+error_code = ?,
 status = 0
 where
-file_name = '{self.escape_string(file_name)}'
-"""
+file_name = ?;"""
         else:
-            query = f"""insert into bad_files (file_name, file_type, hash, archive_hash, error_code, status)
-values( 
-'{self.escape_string(file_name)}',
-{int(file_type)},
-'{file_hash}',
-{parent_arch},
-{error_code},
-0);"""
+            query = """insert into bad_files (file_type, hash, archive_hash, error_code, status, file_name)
+values(?, ?, ?, ?, 0, ?);"""
 
         with contextlib.closing(self.connection.cursor()) as cursor:
             try:
-                cursor.execute(query)
-                cursor.connection.commit()
+                cursor.execute(query, (int(file_type), file_hash, parent_arch, int(error_code), file_name))
+                self.add_membership('bad_files', file_name)
+                self.commit()
             except sqlite3.Error as e:
                 raise RuntimeError(f'Failed to add/update into bad_files.\n{e}')
 
@@ -244,9 +536,10 @@ values(
         if not self.is_processed_archive(file_hash):
             with contextlib.closing(self.connection.cursor()) as cursor:
                 try:
-                    cursor.execute(f"""insert into archives (hash,          file_type, size)
-                                                      values('{file_hash}', {bft},     {file_size} );""")
-                    cursor.connection.commit()
+                    cursor.execute("""insert into archives (hash, file_type, size) values(?, ?, ?);""",
+                                   (file_hash, int(bft), file_size))
+                    self.add_membership('archives', file_hash)
+                    self.commit()
                 except sqlite3.Error as e:
                     raise RuntimeError(f'Failed to insert into archives.\n{e}')
 
@@ -257,32 +550,21 @@ values(
                     file_name: str,
                     file_hash: str,
                     parent_arch_hash: str):
-        escaped_file_name = self.escape_string(file_name)
         try:
             with contextlib.closing(self.connection.cursor()) as cursor:
-                query = f"""select id, status from archive_files where file_name='{escaped_file_name}' limit 1;"""
-                res = cursor.execute(query).fetchone()
+                query = """select id, generation from archive_files where file_name=? limit 1;"""
+                res = cursor.execute(query, (file_name,)).fetchone()
                 if res:
-                    arch_id, status = res
-                    if status != 0:
-                        update_query = f"""update archive_files 
-    set 
-    status=0
-    where 
-    id={arch_id}
-    """
-                        cursor.execute(update_query)
+                    arch_id, generation = res
+                    if generation != self.generation:
+                        cursor.execute("""update archive_files set generation=? where id=?;""", (self.generation, arch_id))
                 else:
+                    parent_arch = parent_arch_hash if parent_arch_hash else None
+                    cursor.execute("""insert into archive_files (file_name, parent_arch_hash, hash, status, generation)
+values(?, ?, ?, 0, ?);""", (file_name, parent_arch, file_hash, self.generation))
+                    self.add_membership('archive_files', file_name)
 
-                        if not parent_arch_hash:
-                            parent_arch = "NULL"
-                        else:
-                            parent_arch = f"'{parent_arch_hash}'"
-                        cursor.execute(f"""insert into archive_files (file_name, parent_arch_hash, hash, status)
-                                                               values('{escaped_file_name}', {parent_arch}, '{file_hash}', 0);""")
-
-
-                cursor.connection.commit()
+                self.commit()
         except sqlite3.Error as e:
             raise RuntimeError(f'Failed to insert/update into archive_files.\n{e}')
 
@@ -293,16 +575,23 @@ values(
         if not self.is_processed_book(bi.hash_value):
             with contextlib.closing(self.connection.cursor()) as cursor:
                 try:
-                    cursor.execute(f"""insert into books (hash, size, ocr, booktype, page_count, text_data, tokens)
-                                                          values('{bi.hash_value}', 
-                                                                 {bi.size}, 
-                                                                 {int(bi.ocr)}, 
-                                                                 {bi.book_type}, 
-                                                                 {bi.page_count}, 
-                                                                 '{bi.text_data}',
-                                                                 '');""")
-
-                    cursor.connection.commit()
+                    cursor.execute("""insert into books (hash, size, ocr, booktype, page_count, text_data, tokens, language)
+values(?, ?, ?, ?, ?, ?, '', ?);""", (bi.hash_value,
+                                      bi.size,
+                                      int(bi.ocr),
+                                      int(bi.book_type),
+                                      bi.page_count,
+                                      bi.text_data,
+                                      bi.language))
+                    self.add_membership('books', bi.hash_value)
+
+                    if bi.ocr_pending:
+                        cursor.execute("""insert or ignore into ocr_queue (hash) values(?);""", (bi.hash_value,))
+
+                    if bi.full_text is not None:
+                        self.insert_full_text(cursor, bi.hash_value, bi.full_text)
+
+                    self.commit()
                     self.new_book_counter += 1
                 except sqlite3.Error as e:
                     raise RuntimeError(f'Failed to insert into books.\n{e}')
@@ -314,59 +603,113 @@ values(
                           file_name: str,
                           file_hash: str,
                           parent_arch_hash: str):
-        escaped_file_name = self.escape_string(file_name)
         try:
             with contextlib.closing(self.connection.cursor()) as cursor:
-                query = f"""select id, status from book_files where file_name='{escaped_file_name}' limit 1;"""
-                res = cursor.execute(query).fetchone()
+                query = """select id, generation from book_files where file_name=? limit 1;"""
+                res = cursor.execute(query, (file_name,)).fetchone()
                 if res:
-                    file_id, status = res
-                    if status != 0:
-                        update_query = f"""update book_files set status=0 where id={file_id}"""
-                        cursor.execute(update_query)
+                    file_id, generation = res
+                    if generation != self.generation:
+                        cursor.execute("""update book_files set generation=? where id=?;""", (self.generation, file_id))
                 else:
-                    if not parent_arch_hash:
-                        parent_arch_hash = "NULL"
-                    else:
-                        parent_arch_hash = f"'{parent_arch_hash}'"
-                    cursor.execute(f"""insert into book_files (file_name, archive_hash, hash, status)
-                                   values('{escaped_file_name}', {parent_arch_hash}, '{file_hash}', 0);""")
-                cursor.connection.commit()
+                    parent_arch = parent_arch_hash if parent_arch_hash else None
+                    cursor.execute("""insert into book_files (file_name, archive_hash, hash, status, generation)
+values(?, ?, ?, 0, ?);""", (file_name, parent_arch, file_hash, self.generation))
+                    self.add_membership('book_files', file_name)
+                self.commit()
         except sqlite3.Error as e:
             raise RuntimeError(f'Failed to insert into book_files.\n{e}')
 
 
     def is_scanned_archive(self, file_name: str):
+        known = self.check_membership('archive_files', file_name)
+        if known is not None:
+            return known
+
         with contextlib.closing(self.connection.cursor()) as cursor:
-            rc = cursor.execute(f"""select count(*) from 
-                                    archive_files where file_name = '{self.escape_string(file_name)}';
-                                    """).fetchone()[0]
+            rc = cursor.execute("""select count(*) from archive_files where file_name = ?;""",
+                                (file_name,)).fetchone()[0]
         return rc > 0
 
     def mark_archive_as_existent(self, file_name: str):
         with contextlib.closing(self.connection.cursor()) as cursor:
-            fn = self.escape_string(os.path.abspath(file_name))
-            pattern = f"{fn}{os.sep}%"
-
-            query_paths = f"""select id from other_paths where path like '{pattern}';"""
-            query_res = cursor.execute(query_paths).fetchall()
-            path_ids = list(map(lambda x: str(x[0]), query_res))
-            path_id_param = ','.join(path_ids)
-
-
-            update_books = f"""update book_files set status=0 where file_name like '{pattern}';"""
-            cursor.execute(update_books)
-
-            update_archives = f"""update archive_files set status=0 where file_name like '{pattern}';"""
-            cursor.execute(update_archives)
-
-            update_archives = f"""update archive_files set status=0 where file_name = '{fn}';"""
-            cursor.execute(update_archives)
+            fn = os.path.abspath(file_name)
+            prefix, prefix_end = self.get_prefix_range(fn)
+            args = {'generation': self.generation, 'file_name': fn, 'prefix': prefix, 'prefix_end': prefix_end}
+            prefix_cond = "(file_name >= :prefix and file_name < :prefix_end)"
+
+            cursor.execute(f"""update book_files set generation=:generation where {prefix_cond};""", args)
+            cursor.execute(f"""update archive_files set generation=:generation where file_name = :file_name or {prefix_cond};""",
+                           args)
+            # Members of the archive itself have archive name as their path.
+            cursor.execute("""update other_files set generation=:generation where path_id in 
+(select id from other_paths where path = :file_name or (path >= :prefix and path < :prefix_end));""", args)
+
+            self.commit()
+
+
+    def find_archive_file(self, file_hash: str, exclude_file_name: str):
+        """
+        Returns: Logical name of the scanned archive with the given hash (other than exclude_file_name), None if there is
+        no such archive.
+        """
+        query = """select file_name from archive_files 
+where hash=? and file_name != ? order by generation desc limit 1;"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            res = cursor.execute(query, (file_hash, exclude_file_name)).fetchone()
+        return res[0] if res else None
+
+
+    def copy_archive_content(self, src_file_name: str, dst_file_name: str, file_hash: str, parent_arch_hash: str):
+        """
+        Copies everything found inside scanned archive (books, nested archives, bad and other files) to another
+        instance of the same archive, so it doesn't need to be extracted and scanned.
+        Args:
+            src_file_name: Logical name of the scanned archive.
+            dst_file_name: Logical name of the archive instance to be added.
+            file_hash: Archive hash.
+            parent_arch_hash: Parent archive hash for the archive instance to be added.
+        """
+        self.add_existing_archive(dst_file_name, file_hash, parent_arch_hash)
+
+        src_len = len(src_file_name)
+        prefix, prefix_end = self.get_prefix_range(src_file_name)
+        prefix_cond = "(file_name >= :prefix and file_name < :prefix_end)"
+        new_name = ":dst || substr(file_name, :prefix_len)"
+        args = {'prefix_len': src_len + 1, 'prefix': prefix, 'prefix_end': prefix_end, 'dst': dst_file_name,
+                'generation': self.generation}
 
-            update_other = f"""update other_files set status=0 where path_id in ({path_id_param});"""
-            cursor.execute(update_other)
+        try:
+            with contextlib.closing(self.connection.cursor()) as cursor:
+                cursor.execute(f"""insert or ignore into archive_files (file_name, hash, parent_arch_hash, status, generation)
+select {new_name}, hash, parent_arch_hash, 0, :generation from archive_files where {prefix_cond};""", args)
+
+                cursor.execute(f"""insert or ignore into book_files (file_name, archive_hash, hash, status, generation)
+select {new_name}, archive_hash, hash, 0, :generation from book_files where {prefix_cond};""", args)
+
+                cursor.execute(f"""insert into bad_files (file_name, file_type, hash, archive_hash, error_code, status)
+select {new_name}, file_type, hash, archive_hash, error_code, 0 from bad_files where {prefix_cond} and
+{new_name} not in (select file_name from bad_files);""", args)
+
+                paths = cursor.execute("""select id, path from other_paths 
+where path = :src or (path >= :prefix and path < :prefix_end);""", {'src': src_file_name, **args}).fetchall()
+                path_ids = [(self.add_get_path(dst_file_name + src_path[src_len:]), self.generation, src_path_id)
+                            for src_path_id, src_path in paths]
+                cursor.executemany("""insert or ignore into other_files (path_id, basename, extension, size, hash, crc, status, generation)
+select ?, basename, extension, size, hash, crc, 0, ? from other_files where path_id=?;""", path_ids)
+
+                if self.membership is not None:
+                    dst_range = self.get_prefix_range(dst_file_name)
+                    for table in ('archive_files', 'book_files', 'bad_files'):
+                        for (fn,) in cursor.execute(f"""select file_name from {table} where file_name >= ? and file_name < ?;""",
+                                                    dst_range).fetchall():
+                            self.add_membership(table, fn)
+
+                self.commit()
+        except sqlite3.Error as e:
+            raise RuntimeError(f'Failed to copy archive content.\n{e}')
 
-            cursor.connection.commit()
+        self.mark_archive_as_existent(dst_file_name)
 
 
     def is_scanned_book(self, file_name: str):
@@ -375,29 +718,30 @@ values(
         if not res:
             file_name = mod_file_name
 
+        known = self.check_membership('book_files', file_name)
+        if known is not None:
+            return known
+
         with contextlib.closing(self.connection.cursor()) as cursor:
-            query = f"""select count(*) from 
-                           book_files where file_name = '{self.escape_string(file_name)}';
-                           """
-            rc = cursor.execute(query).fetchone()[0]
+            rc = cursor.execute("""select count(*) from book_files where file_name = ?;""", (file_name,)).fetchone()[0]
         return rc > 0
 
     def mark_book_as_existent(self, file_name: str):
         with contextlib.closing(self.connection.cursor()) as cursor:
-            query = f"""update book_files set status=0 where file_name='{self.escape_string(file_name)}';"""
-            cursor.execute(query)
-            cursor.connection.commit()
+            cursor.execute("""update book_files set generation=? where file_name=?;""", (self.generation, file_name))
+            self.commit()
 
     def is_bad_file(self, file_name: str):
         res, mod_file_name = test_unicode_string(file_name)
         if not res:
             file_name = mod_file_name
 
+        known = self.check_membership('bad_files', file_name)
+        if known is not None:
+            return known
+
         with contextlib.closing(self.connection.cursor()) as cursor:
-            query = f"""select count(*) from 
-                           bad_files where file_name = '{self.escape_string(file_name)}';
-                           """
-            rc = cursor.execute(query).fetchone()[0]
+            rc = cursor.execute("""select count(*) from bad_files where file_name = ?;""", (file_name,)).fetchone()[0]
         return rc > 0
 
 
@@ -409,18 +753,21 @@ values(
 
 
     def is_processed_archive(self, file_hash: str) -> bool:
-        rc = 0
+        known = self.check_membership('archives', file_hash)
+        if known is not None:
+            return known
+
         with contextlib.closing(self.connection.cursor()) as cursor:
-            rc = cursor.execute(f"""select count(*) from 
-                                    archives where hash='{file_hash}';
-                                    """).fetchone()[0]
+            rc = cursor.execute("""select count(*) from archives where hash=?;""", (file_hash,)).fetchone()[0]
         return rc > 0
 
     def is_processed_book(self, file_hash: str) -> bool:
+        known = self.check_membership('books', file_hash)
+        if known is not None:
+            return known
+
         with contextlib.closing(self.connection.cursor()) as cursor:
-            rc = cursor.execute(f"""select count(*) from 
-                                    books where hash='{file_hash}';
-                                    """).fetchone()[0]
+            rc = cursor.execute("""select count(*) from books where hash=?;""", (file_hash,)).fetchone()[0]
         return rc > 0
 
 
@@ -428,12 +775,16 @@ values(
         self.book_cache = None
         self.file_name_cache = None # Translate hash value to the list of file names
         self.archive_cache = None   # Translate file name to the parent archive hash
+        self.full_text_cache = None # Hashes of the books with full text
 
         try:
             with contextlib.closing(self.connection.cursor()) as cursor:
-                query = """select books.hash, books.text_data, books.booktype from books;"""
+                query = """select books.hash, books.text_data, books.booktype, books.language from books;"""
                 query_res = cursor.execute(query).fetchall()
-                self.book_cache = list(map(lambda t: (t[0], str(t[1]), t[2]), query_res))
+                self.book_cache = list(map(lambda t: (t[0], str(t[1]), t[2], set(str(t[3] or '').split('+'))), query_res))
+
+                query_full_text = """select hash from book_texts where error is null;"""
+                self.full_text_cache = set(map(lambda t: t[0], cursor.execute(query_full_text).fetchall()))
 
                 query2 = """select hash, archive_hash, file_name from book_files;"""
                 query2_res = cursor.execute(query2).fetchall()
@@ -459,6 +810,11 @@ values(
 
 
     def search_books_in_cache(self, sl: list[str]):
+        """
+        Looks for the books matching all queries. Query 'lang:<language>' (e.g. 'lang:rus') is a filter: only books in
+        this language (see books.language) match. Books with full text (see book_texts) are searched in their full text
+        with full text index (see search_full_texts()), other books in their sampled text.
+        """
         file_list = list()
         hash_list = list()
         text_data_list = list()
@@ -469,6 +825,21 @@ values(
         book_type_list = list()
         res = False
 
+        lang_prefix = 'lang:'
+        lang_filter = set(s[len(lang_prefix):].strip() for s in sl if s.startswith(lang_prefix))
+        sl = [s for s in sl if not s.startswith(lang_prefix)]
+        if not any(sl) and not lang_filter:
+            return res, file_list, hash_list, archive_list, text_data_list, spans_list, book_type_list
+
+        # Language only query: all books of the language match.
+        if not any(sl):
+            match_books = dict()
+            for h,t,bt,bl in self.book_cache:
+                if lang_filter <= bl:
+                    match_books[h] = ( 0.0, list(), bt )
+                    text_data_dict[h] = t
+            results_list.append(match_books)
+
         # Find all books that matches every single search query
         for s in sl:
             if not s:
@@ -477,7 +848,9 @@ values(
             search_re = re.compile(re.escape(s), re.IGNORECASE)
 
             match_books = dict()
-            for h,t,bt in self.book_cache:
+            for h,t,bt,bl in self.book_cache:
+                if (lang_filter and not lang_filter <= bl) or h in self.full_text_cache:
+                    continue
                 match_count = 0
                 match_spans = list()
                 for m in re.finditer(search_re, t):
@@ -514,6 +887,13 @@ values(
             for k in remove_keys:
                 match_books.pop(k)
 
+        if any(sl):
+            full_text_books = {h: (bt, bl) for h,t,bt,bl in self.book_cache
+                               if h in self.full_text_cache and (not lang_filter or lang_filter <= bl)}
+            for h, (rang, spans, bt, snippet) in self.search_full_texts(sl, full_text_books).items():
+                match_books[h] = (rang, spans, bt)
+                text_data_dict[h] = snippet
+
         # Sort by rang
         sorted_match = sorted(match_books.items(), key=lambda kv: kv[1][0], reverse=True)
 
@@ -535,13 +915,53 @@ values(
         return res, file_list, hash_list, archive_list, text_data_list, spans_list, book_type_list
 
 
+    def search_full_texts(self, sl: list[str], books: dict) -> dict:
+        """
+        Looks for the books with full text matching all queries. Candidates are found by full text index (words of the
+        query, the last one may be a prefix of the word), their full text is decompressed one by one to find matches,
+        only a snippet around the matches is kept (see make_text_snippet()).
+        Args:
+            sl: Search queries.
+            books: Books which may match, dictionary hash -> (book type, languages).
+        Returns: Dictionary hash -> (rang, spans in the snippet, book type, snippet).
+        """
+        phrases = list()
+        for s in sl:
+            if not s:
+                continue
+            words = re.findall(r'\w+', s)
+            if not words:
+                return dict()
+            phrases.append('"' + ' '.join(words) + '"*')
+
+        search_res = [(s, re.compile(re.escape(s), re.IGNORECASE)) for s in sl if s]
+        query = """select book_texts.hash, book_texts.text_data from book_texts_fts 
+join book_texts on book_texts.rowid = book_texts_fts.rowid 
+where book_texts_fts match ? order by rank limit ?;"""
+        result = dict()
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            for h, data in cursor.execute(query, (' AND '.join(phrases), full_text_search_limit)):
+                if h not in books:
+                    continue
+                t = zlib.decompress(data).decode('UTF-8')
+                rang = 1.0
+                spans = list()
+                for s, search_re in search_res:
+                    match_spans = [m.span() for m in re.finditer(search_re, t)]
+                    rang *= float(len(match_spans) * len(s)) / float(len(t) + 1)
+                    spans += match_spans
+                snippet, snippet_spans = make_text_snippet(t, sorted(spans, key=lambda kv: kv[0]))
+                result[h] = (rang, snippet_spans, books[h][0], snippet)
+        return result
+
+
     def get_book_info(self, hash: str):
 
-        query = f"""select size, ocr, booktype, page_count, text_data, tokens from books where hash='{self.escape_string(hash)}';"""
+        query = """select size, ocr, booktype, page_count, text_data, tokens from books where hash=?;"""
         query_res = None
         try:
             with contextlib.closing(self.connection.cursor()) as cursor:
-                query_res = cursor.execute(query).fetchone()
+                query_res = cursor.execute(query, (hash,)).fetchone()
         except Exception as e:
             pass
 
@@ -551,100 +971,395 @@ values(
         return self.archive_cache[file_name] is not None
 
     def rename_file(self, old_file_name: str, new_file_name: str):
-        file_name_update_query = f"""update book_files set file_name='{self.escape_string(new_file_name)}' where file_name='{old_file_name}';"""
+        file_name_update_query = """update book_files set file_name=? where file_name=?;"""
         with contextlib.closing(self.connection.cursor()) as cursor:
-            cursor.execute(file_name_update_query)
-            cursor.connection.commit()
+            cursor.execute(file_name_update_query, (new_file_name, old_file_name))
+            self.commit()
+
+        if self.membership is not None:
+            self.membership['book_files'].discard(old_file_name)
+            self.membership['book_files'].add(new_file_name)
 
     def add_get_path(self, path: str):
-        path_query = f"""select other_paths.id, other_paths.status from other_paths where path='{path}';"""
+        path_query = """select other_paths.id, other_paths.status from other_paths where path=?;"""
         with contextlib.closing(self.connection.cursor()) as cursor:
-            res = cursor.execute(path_query).fetchone()
+            res = cursor.execute(path_query, (path,)).fetchone()
 
             if not res:
-                insert_path_query = f"""insert into other_paths (path, status) values('{path}', 0);"""
-                cursor.execute(insert_path_query)
-                cursor.connection.commit()
-
-                res = cursor.execute(path_query).fetchone()
+                cursor.execute("""insert into other_paths (path, status) values(?, 0);""", (path,))
+                self.commit()
+                return cursor.lastrowid
 
             path_id, path_status = res
 
             if path_status != 0:
-                    path_update_query = f"""update other_paths set status=0 where id={path_id}"""
-                    cursor.execute(path_update_query)
-                    cursor.connection.commit()
+                    cursor.execute("""update other_paths set status=0 where id=?;""", (path_id,))
+                    self.commit()
 
         return path_id
 
 
-    def add_get_other_file(self, logical_file_name: str, file_name: str, size: int):
-        escaped_file_name = self.escape_string(logical_file_name)
-        file_path, basename = os.path.split(escaped_file_name)
+    def is_size_known(self, size: int) -> bool:
+        """
+        Returns: True if there is known other file (not a book) of the given size.
+        """
+        query = """select 1 from other_files where size=? limit 1;"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            return cursor.execute(query, (size,)).fetchone() is not None
+
+
+    def get_unhashed_other_files(self, size: int) -> list:
+        """
+        Returns: Other files of the given size recorded without hash, list of tuples (id, logical file name). Archive
+        members listed with CRC are not returned.
+        """
+        query = """select other_files.id, other_paths.path, other_files.basename from other_files
+join other_paths on other_paths.id = other_files.path_id
+where other_files.size=? and other_files.hash is null and other_files.crc is null;"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            return [(i, os.path.join(p, b)) for i, p, b in cursor.execute(query, (size,)).fetchall()]
+
+
+    def set_other_file_hash(self, file_id: int, file_hash: str):
+        query = """update other_files set hash=? where id=?;"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            cursor.execute(query, (file_hash, file_id))
+            self.commit()
+
+
+    def get_ocr_queue(self) -> list:
+        """
+        Returns: Books queued for OCR pass, smaller books go first. List of tuples (hash, book type, page count,
+        logical file name, size). Files which are not inside archives are preferred.
+        """
+        query = """select ocr_queue.hash, books.booktype, books.page_count,
+(select file_name from book_files where book_files.hash = ocr_queue.hash order by archive_hash is not null limit 1),
+books.size
+from ocr_queue join books on books.hash = ocr_queue.hash
+where ocr_queue.error is null order by books.size;"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            return cursor.execute(query).fetchall()
+
+
+    def set_book_ocr_text(self, file_hash: str, text_data: str, ocr: bool, language: str, full_text: str = None):
+        """
+        Updates text (and language) of the book recognized by OCR pass and removes it from OCR queue. Full text is
+        replaced if given.
+        """
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            cursor.execute("""update books set text_data=?, ocr=?, language=? where hash=?;""",
+                           (text_data, int(ocr), language, file_hash))
+            cursor.execute("""delete from ocr_queue where hash=?;""", (file_hash,))
+            if full_text is not None:
+                self.insert_full_text(cursor, file_hash, full_text)
+            self.commit()
+
+
+    @staticmethod
+    def insert_full_text(cursor, file_hash: str, full_text: str):
+        BooKeeperDB.unindex_full_text(cursor, file_hash)
+        data = full_text.encode('UTF-8')
+        cursor.execute("""insert or replace into book_texts (hash, text_data, size, error) values(?, ?, ?, NULL);""",
+                       (file_hash, zlib.compress(data), len(data)))
+        cursor.execute("""insert into book_texts_fts (rowid, text_data) values(?, ?);""", (cursor.lastrowid, full_text))
+
+
+    @staticmethod
+    def unindex_full_text(cursor, file_hash: str):
+        """
+        Removes full text of the book from the full text index, must be called before book_texts row is replaced or
+        deleted. Index is contentless, so removed text must be given exactly as it was indexed.
+        """
+        row = cursor.execute("""select rowid, text_data from book_texts where hash=? and error is null;""",
+                             (file_hash,)).fetchone()
+        if row is not None:
+            cursor.execute("""insert into book_texts_fts (book_texts_fts, rowid, text_data) values('delete', ?, ?);""",
+                           (row[0], zlib.decompress(row[1]).decode('UTF-8')))
+
+
+    def set_book_full_text(self, file_hash: str, full_text: str):
+        """
+        Stores full text of the book (zlib compressed).
+        """
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            self.insert_full_text(cursor, file_hash, full_text)
+            self.commit()
+
+
+    def set_full_text_error(self, file_hash: str, message: str):
+        """
+        Marks book as failed to extract full text, it is skipped by next deepen passes.
+        """
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            self.unindex_full_text(cursor, file_hash)
+            cursor.execute("""insert or replace into book_texts (hash, text_data, size, error) values(?, NULL, 0, ?);""",
+                           (file_hash, message))
+            self.commit()
+
+
+    def get_book_full_text(self, file_hash: str) -> str:
+        """
+        Returns: Full text of the book (pages are separated by form feeds), None if it is not extracted.
+        """
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            res = cursor.execute("""select text_data from book_texts where hash=? and error is null;""",
+                                 (file_hash,)).fetchone()
+        return zlib.decompress(res[0]).decode('UTF-8') if res else None
+
+
+    def get_deepen_queue(self) -> list:
+        """
+        Returns: Books without full text, smaller books go first. List of tuples (hash, book type, page count,
+        logical file name, size). Files which are not inside archives are preferred.
+        """
+        query = """select books.hash, books.booktype, books.page_count,
+(select file_name from book_files where book_files.hash = books.hash order by archive_hash is not null limit 1),
+books.size
+from books where books.hash not in (select hash from book_texts) order by books.size;"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            return cursor.execute(query).fetchall()
+
+
+    def get_full_text_stats(self) -> tuple[int, int, int]:
+        """
+        Returns: tuple (number of books with full text, text size, compressed text size). Sizes are in bytes.
+        """
+        query = """select count(*), coalesce(sum(size), 0), coalesce(sum(length(text_data)), 0) 
+from book_texts where error is null;"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            return cursor.execute(query).fetchone()
+
+
+    def set_ocr_error(self, file_hash: str, message: str):
+        """
+        Marks book of the OCR queue as failed, it is skipped by next OCR passes.
+        """
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            cursor.execute("""update ocr_queue set error=? where hash=?;""", (message, file_hash))
+            self.commit()
+
+
+    def get_other_file(self, logical_file_name: str):
+        """
+        Returns: tuple (id, size, hash) for known other file, None otherwise.
+        """
+        file_path, basename = os.path.split(logical_file_name)
+        file_query = """select other_files.id, other_files.size, other_files.hash from other_files
+join other_paths on other_paths.id = other_files.path_id 
+where other_paths.path=? and other_files.basename=?;"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            return cursor.execute(file_query, (file_path, basename)).fetchone()
+
+
+    def add_get_other_file(self, logical_file_name: str, size: int, file_hash: str, crc: str = None):
+        """
+        Adds (or updates) other file. File hash may be None (file size is unique, or file is not extracted from archive).
+        CRC is taken from archive listing, if available.
+        Returns: tuple (file id, True if file is new)
+        """
+        file_path, basename = os.path.split(logical_file_name)
         path_id = self.add_get_path(file_path)
         new_file = False
 
-        file_query = f"""select id, status from other_files where path_id={path_id} and basename='{basename}';"""
+        file_query = """select id, generation, size, hash from other_files where path_id=? and basename=?;"""
         with contextlib.closing(self.connection.cursor()) as cursor:
-            res = cursor.execute(file_query).fetchone()
+            res = cursor.execute(file_query, (path_id, basename)).fetchone()
             if not res:
                 bn, ext = split_file_name(logical_file_name)
-                file_hash = get_file_hash(file_name)
-                insert_file_query = f"""insert into other_files (path_id, basename, extension, size, hash, status)
-values({path_id}, '{basename}', '{self.escape_string(ext.lower())}',{size}, '{file_hash}', 0);"""
-                cursor.execute(insert_file_query)
-                cursor.connection.commit()
-
-                res = cursor.execute(file_query).fetchone()
-                new_file = True
+                cursor.execute("""insert into other_files (path_id, basename, extension, size, hash, crc, status, generation)
+values(?, ?, ?, ?, ?, ?, 0, ?);""", (path_id, basename, ext.lower(), size, file_hash, crc, self.generation))
+                self.commit()
+                return cursor.lastrowid, True
 
-            file_id, status = res
+            file_id, generation, old_size, old_hash = res
 
-            if status != 0:
-                file_update_query = f"""update other_files set status=0 where id={file_id}"""
-                cursor.execute(file_update_query)
-                cursor.connection.commit()
+            if generation != self.generation or old_size != size or old_hash != file_hash:
+                cursor.execute("""update other_files set generation=?, size=?, hash=? where id=?;""",
+                               (self.generation, size, file_hash, file_id))
+                self.commit()
 
         return file_id, new_file
 
 
-    def prepare_scan(self):
-        self.new_book_counter = 0
+    def add_other_files(self, files: list[tuple[str, int, str]]) -> list[bool]:
+        """
+        Adds (or updates) a bulk of other files which are not extracted from archive (see add_get_other_file()).
+        Args:
+            files: List of tuples (logical file name, size, CRC or None).
+
+        Returns: List of flags, True if the file is new.
+        """
+        path_ids = dict()
+        known = dict()
+        rows = list()
+        new_files = list()
+        try:
+            with contextlib.closing(self.connection.cursor()) as cursor:
+                for logical_file_name, size, crc in files:
+                    file_path, basename = os.path.split(logical_file_name)
+                    if file_path not in path_ids:
+                        path_id = self.add_get_path(file_path)
+                        path_ids[file_path] = path_id
+                        known[path_id] = set(map(lambda r: r[0], cursor.execute(
+                            """select basename from other_files where path_id=?;""", (path_id,)).fetchall()))
+                    path_id = path_ids[file_path]
+                    bn, ext = split_file_name(logical_file_name)
+                    new_files.append(basename not in known[path_id])
+                    rows.append((path_id, basename, ext.lower(), size, crc, self.generation))
+
+                cursor.executemany("""insert into other_files (path_id, basename, extension, size, hash, crc, status, generation)
+values(?, ?, ?, ?, NULL, ?, 0, ?) 
+on conflict(path_id, basename) do update set generation=excluded.generation, size=excluded.size, hash=NULL;""", rows)
+                self.commit(len(rows))
+        except sqlite3.Error as e:
+            raise RuntimeError(f'Failed to insert into other_files.\n{e}')
+
+        return new_files
+
+
+    def get_file_stat(self, file_name: str):
+        """
+        Returns: tuple (device, inode, size, mtime_ns, hash) recorded for the file, None if file is unknown.
+        """
+        query = """select device, inode, size, mtime_ns, hash from file_stats where file_name=?;"""
         with contextlib.closing(self.connection.cursor()) as cursor:
-            query = """update archive_files set status = -1;"""
-            cursor.execute(query)
+            return cursor.execute(query, (file_name,)).fetchone()
 
-            query = """update book_files set status = -1;"""
-            cursor.execute(query)
 
-            #query = """update bad_files set status = -1;"""
-            #cursor.execute(query)
+    def find_file_stat_hash(self, device: int, inode: int, size: int, mtime_ns: int):
+        """
+        Returns: Hash of the file with the same stat signature (moved or renamed file), None if there is no such file.
+        """
+        query = """select hash from file_stats 
+where device=? and inode=? and size=? and mtime_ns=? limit 1;"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            res = cursor.execute(query, (device, inode, size, mtime_ns)).fetchone()
+        return res[0] if res else None
 
-            query = """update other_files set status = -1;"""
-            cursor.execute(query)
 
-            #query = """update other_paths set status = -1;"""
-            #cursor.execute(query)
+    def set_file_stat(self, file_name: str, device: int, inode: int, size: int, mtime_ns: int, file_hash: str):
+        query = """insert or replace into file_stats (file_name, device, inode, size, mtime_ns, hash)
+values(?, ?, ?, ?, ?, ?);"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            try:
+                cursor.execute(query, (file_name, device, inode, size, mtime_ns, file_hash))
+                self.commit()
+            except sqlite3.Error as e:
+                raise RuntimeError(f'Failed to insert into file_stats.\n{e}')
 
-            cursor.connection.commit()
 
-            pass
+    def get_scanned_file_hash(self, file_name: str, bft: BookFileType):
+        """
+        Returns: Hash recorded for scanned book or archive, None if file is not scanned.
+        """
+        table = 'archive_files' if bft in book_archive_types else 'book_files'
+        query = f"""select hash from {table} where file_name=? limit 1;"""
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            res = cursor.execute(query, (file_name,)).fetchone()
+        return res[0] if res else None
+
+
+    def forget_scanned_file(self, file_name: str, bft: BookFileType):
+        """
+        Removes scanned book or archive (with everything found inside it), so it is scanned again.
+        """
+        prefix, prefix_end = self.get_prefix_range(file_name)
+        prefix_cond = "(file_name >= :prefix and file_name < :prefix_end)"
+        args = {'file_name': file_name, 'prefix': prefix, 'prefix_end': prefix_end}
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            if bft in book_archive_types:
+                cursor.execute(f"""delete from archive_files where file_name = :file_name or {prefix_cond};""", args)
+                cursor.execute(f"""delete from book_files where {prefix_cond};""", args)
+                cursor.execute(f"""delete from bad_files where {prefix_cond};""", args)
+                cursor.execute("""delete from other_files where path_id in 
+(select id from other_paths where path = :file_name or (path >= :prefix and path < :prefix_end));""", args)
+            else:
+                cursor.execute("""delete from book_files where file_name = :file_name;""", args)
+            self.commit()
+
+        if self.membership is not None:
+            if bft in book_archive_types:
+                self.membership['archive_files'].discard(file_name)
+                for table in ('archive_files', 'book_files', 'bad_files'):
+                    self.membership[table].discard_prefix(args['prefix'])
+            else:
+                self.membership['book_files'].discard(file_name)
+
+
+    def prepare_scan(self, library_path: str):
+        """
+        Starts a new scan generation of the library. Rows of the files found by the scan are marked with this
+        generation, rows of the library files with older generation are deleted by post_scan(). Nothing is written
+        until files are found, so interrupted scan leaves database consistent (nothing is deleted).
+        Args:
+            library_path: Scanned library (or its subdirectory).
+        """
+        self.new_book_counter = 0
+        self.scan_root = os.path.abspath(library_path)
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            cursor.execute("""insert into scans (library, started) values(?, ?);""", (self.scan_root, time.time()))
+            self.generation = cursor.lastrowid
+            self.flush()
+
+        self.load_membership()
+
+
+    @staticmethod
+    def get_prefix_range(path: str) -> tuple[str, str]:
+        """
+        Returns: tuple (prefix, prefix_end), names of the files located in the path are in the range [prefix, prefix_end).
+        Conditions on this range use indexes on file names (unlike substr() or LIKE, names may contain LIKE wildcards).
+        """
+        prefix = os.path.join(path, '')
+        return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
 
     def post_scan(self):
+        """
+        Deletes rows of the files which are inside scanned library, but weren't found by the scan (see prepare_scan()).
+        Files of other libraries are kept.
+        """
+        prefix, prefix_end = self.get_prefix_range(self.scan_root)
+        args = {'generation': self.generation, 'root': self.scan_root, 'prefix': prefix, 'prefix_end': prefix_end}
+        in_library = "(file_name = :root or (file_name >= :prefix and file_name < :prefix_end))"
+        removed = 0
         with contextlib.closing(self.connection.cursor()) as cursor:
-            query = """delete from archive_files where status = -1;"""
+            cursor.execute(f"""delete from archive_files where generation < :generation and {in_library};""", args)
+            removed += cursor.rowcount
+
+            cursor.execute(f"""delete from book_files where generation < :generation and {in_library};""", args)
+            removed += cursor.rowcount
+
+            cursor.execute("""delete from other_files where generation < :generation and path_id in 
+(select id from other_paths where path = :root or (path >= :prefix and path < :prefix_end));""", args)
+            removed += cursor.rowcount
+
+            query = """delete from file_stats where 
+file_name not in (select file_name from book_files) and 
+file_name not in (select file_name from archive_files) and
+file_name not in (select other_paths.path || '/' || other_files.basename from other_files 
+                  join other_paths on other_paths.id = other_files.path_id);"""
             cursor.execute(query)
 
-            query = """delete from book_files where status = -1;"""
+            query = """delete from ocr_queue where hash not in (select hash from books);"""
             cursor.execute(query)
 
-            query = """delete from other_files where status = -1;"""
+            query = """select hash from book_texts where hash not in (select hash from books);"""
+            for (file_hash,) in cursor.execute(query).fetchall():
+                self.unindex_full_text(cursor, file_hash)
+            query = """delete from book_texts where hash not in (select hash from books);"""
             cursor.execute(query)
 
-            cursor.connection.commit()
+            cursor.execute("""update scans set finished=? where id=?;""", (time.time(), self.generation))
+            self.flush()
+
+        # Deleted rows are not tracked by in-memory index, it is loaded again by the next scan.
+        self.membership = None
 
         if self.new_book_counter:
             self.logger.print_log(f"{self.new_book_counter} new books added.")
+        if removed:
+            self.logger.print_log(f"{removed} files not found anymore are removed.")
 
 
 
@@ -657,9 +1372,88 @@ values({path_id}, '{basename}', '{self.escape_string(ext.lower())}',{size}, '{fi
     def execute(self, query):
         with contextlib.closing(self.connection.cursor()) as cursor:
             cursor.execute(query)
-            cursor.connection.commit()
+            self.flush()
 
 
     def get_cursor(self):
         return self.connection.cursor()
 
+
+
+class BooKeeperDBWriter:
+    """
+    Serializes database access for the scanner. In threaded mode every request is executed by a single writer thread,
+    so SQLite connection is never used concurrently. Otherwise, requests are executed immediately by the caller.
+    Requests are executed in the order they are posted, so call() always observes previously posted writes.
+    """
+    def __init__(self, db: BooKeeperDB, threaded: bool):
+        self.db = db
+        self.logger = Logger()
+        self.requests = queue.Queue()
+        self.error = None
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(target=self.run, name='BooKeeperDBWriter', daemon=True)
+            self.thread.start()
+
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+
+            fn, args, kwargs, result = request
+            try:
+                value = fn(*args, **kwargs)
+                if result is not None:
+                    result.set_result(value)
+            except Exception as e:
+                if result is not None:
+                    result.set_exception(e)
+                elif self.error is None:
+                    self.logger.print_err(f'Database writer failed: {e}')
+                    self.error = e
+
+
+    def check_error(self):
+        if self.error is not None:
+            e = self.error
+            self.error = None
+            raise RuntimeError(f'Database writer failed.\n{e}')
+
+
+    def post(self, fn: Callable, *args, **kwargs):
+        """
+        Posts a request without waiting for its completion.
+        """
+        if self.thread is None:
+            fn(*args, **kwargs)
+            return
+
+        self.check_error()
+        self.requests.put((fn, args, kwargs, None))
+
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """
+        Executes a request and returns its result.
+        """
+        if self.thread is None:
+            return fn(*args, **kwargs)
+
+        self.check_error()
+        result = concurrent.futures.Future()
+        self.requests.put((fn, args, kwargs, result))
+        return result.result()
+
+
+    def stop(self):
+        """
+        Executes all posted requests and stops writer thread.
+        """
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+        self.check_error()
@@ -170,7 +170,11 @@ class ResultListBox:
     def draw(self):
 
         if self.text_data:
-            selected_text = tools.select_text(self.text_data, self.span_data[self.span_data_index])
+            if self.span_data:
+                selected_text = tools.select_text(self.text_data, self.span_data[self.span_data_index])
+            else:
+                # Language only query: nothing to select.
+                selected_text = self.text_data
             text_dims = imgui.calc_text_size(selected_text)
             wrapped_text = tools.wrap_text(selected_text, text_dims.x, imgui.get_window_width())
             imgui.input_text_multiline('text_data', wrapped_text, callback=self.text_callback,
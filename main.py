@@ -18,9 +18,17 @@ import cProfile
 from config_file import BooKeeperConfig
 from database import *
 from scanner import Scanner
+from processors.image_pipeline import configure_ocr_pipeline
+from processors.ocr_cache import configure_ocr_cache
+from processors.proc_base import configure_page_ocr, configure_page_render, configure_deferred_ocr, configure_full_text, \
+    configure_page_sampling, configure_script_detection
+from membership import configure_membership
+from ocr_pass import OcrPass, DeepenPass
 from tools import *
 from logger import *
 import sys
+import shutil
+import sqlite3
 import argparse
 
 
@@ -36,12 +44,52 @@ if __name__ == "__main__":
                             default = None,
                             help = 'Quick scan, instructs to scan specified library subdirectory only.')
 
+    arg_parser.add_argument('--jobs',
+                            action = 'store',
+                            type = int,
+                            default = 1,
+                            help = 'Number of worker processes used to process books (1 - process books sequentially).')
+
+    arg_parser.add_argument('--defer-ocr',
+                            action = 'store_true',
+                            help = 'Index books by text layer only, books which require OCR are queued for OCR pass.')
+
+    arg_parser.add_argument('--ocr-pass',
+                            action = 'store_true',
+                            help = 'Recognize books queued for OCR (see --defer-ocr) instead of scanning libraries.')
+
+    arg_parser.add_argument('--deepen',
+                            action = 'store_true',
+                            help = 'Extract full text of the books which have no full text yet instead of scanning libraries.')
+
+    arg_parser.add_argument('--ocr-budget',
+                            action = 'store',
+                            type = float,
+                            default = 0,
+                            help = 'Time budget of OCR pass or deepen pass (minutes). No new books are started once it is exceeded.')
+
     arg_parser.add_argument('config',
                             help='Bookeeper configuration file (json formatted).'
                             )
     arguments = arg_parser.parse_args()
     config = BooKeeperConfig(arguments.config)
     logger = Logger(log_file=config.log_file_name, level=config.log_level)
+    configure_file_hash(config.hash_buffer_size, config.hash_use_mmap)
+    # Page OCR threads are shared out between worker processes, so they don't oversubscribe cores together.
+    configure_page_ocr(config.ocr_workers // max(1, arguments.jobs))
+    configure_deferred_ocr(arguments.defer_ocr)
+    configure_script_detection(config.ocr_detect_script)
+    configure_full_text(config.full_text or arguments.deepen, config.full_text_ocr_pages)
+    try:
+        configure_ocr_pipeline(config.ocr_preprocess)
+        configure_page_render(config.ocr_render)
+        configure_page_sampling(config.page_sampling)
+        configure_ocr_cache(config.ocr_cache_file_name, config.ocr_cache_size)
+        configure_db(config.db_pragmas, config.db_checkpoint_interval)
+        configure_membership(config.db_bloom_error_rate)
+    except (RuntimeError, sqlite3.Error) as e:
+        logger.print_err(f'ERROR: {e}')
+        quit(1)
 
     if not is_ramdrive_mounted(config.ram_drive_path):
         logger.print_err(f'ERROR: Ram drive "{config.ram_drive_path}" is not mounted.')
@@ -56,13 +104,29 @@ if __name__ == "__main__":
     db = BooKeeperDB(db_file_name=config.db_file_name,
                      ram_drive_db=config.ram_drive_db,
                      override_db = config.delete_db_on_start)
+    db.configure_commit(config.db_commit_rows, config.db_commit_interval)
+
+    if arguments.ocr_pass or arguments.deepen:
+        pass_type = OcrPass if arguments.ocr_pass else DeepenPass
+        ocr_pass = pass_type(ram_drive_path=config.ram_drive_path,
+                             language_option=config.language_option,
+                             delete_artifacts=config.delete_artifacts,
+                             jobs=arguments.jobs,
+                             budget=arguments.ocr_budget * 60)
+        ocr_pass.run()
+        db.finalize()
+        quit(0)
 
     for lp in config.libraries:
         logger.print_log(f'[LIBRARY] {lp}')
         scanner = Scanner(library_path=lp,
                           ram_drive_path=config.ram_drive_path,
                           language_option=config.language_option,
-                          delete_artifacts=config.delete_artifacts)
+                          delete_artifacts=config.delete_artifacts,
+                          jobs=arguments.jobs,
+                          hash_workers=config.hash_workers,
+                          scratch_path=config.scratch_path,
+                          ram_drive_reserve=config.ram_drive_reserve)
         cProfile.run("scanner.scan()", "scanstats")
     db.finalize()
 
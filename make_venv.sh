@@ -3,5 +3,6 @@ rm -rf ./.venv
 python3 -m venv ./.venv
 ./.venv/bin/python3 -m pip install --upgrade pip
 ./.venv/bin/python3 -m pip install termcolor tabulate colorama
+./.venv/bin/python3 -m pip install pillow numpy
 ./.venv/bin/python3 -m pip install imgui glfw pyopengl
 
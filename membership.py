@@ -0,0 +1,97 @@
+"""
+    Copyright 2025 Oleh Sharuda <oleh.sharuda@gmail.com>
+
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+ """
+import hashlib
+import math
+
+# False positive rate of the Bloom filters used instead of exact key sets, 0 - exact sets are used.
+bloom_error_rate = 0.0
+
+# Bloom filter is sized for twice as many keys as loaded (but not less than this), so it is not saturated by the scan.
+min_bloom_capacity = 100000
+
+
+def configure_membership(error_rate: float):
+    global bloom_error_rate
+    if not 0.0 <= error_rate < 1.0:
+        raise RuntimeError(f'Bad Bloom filter error rate: {error_rate}')
+    bloom_error_rate = error_rate
+
+
+class BloomFilter:
+    """
+    Bloom filter of strings: memory is fixed by capacity and error rate, key may be reported as present while it is not
+    (false positive), but never vice versa.
+    """
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        Args:
+            capacity: Expected number of keys.
+            error_rate: False positive rate for the expected number of keys.
+        """
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def get_positions(self, key: str):
+        # Double hashing: positions are derived from two halves of a single digest.
+        digest = hashlib.blake2b(key.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key: str):
+        for p in self.get_positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.get_positions(key))
+
+
+class KeySet:
+    """
+    Set of keys (file names, hashes) kept in memory: exact set, or Bloom filter if bloom_error_rate is configured.
+    """
+    def __init__(self, count: int):
+        """
+        Args:
+            count: Number of keys to be loaded.
+        """
+        if bloom_error_rate > 0:
+            self.keys = BloomFilter(max(2 * count, min_bloom_capacity), bloom_error_rate)
+        else:
+            self.keys = set()
+
+    def add(self, key: str):
+        self.keys.add(key)
+
+    def discard(self, key: str):
+        # Keys can't be removed from Bloom filter, removed key remains a false positive.
+        if isinstance(self.keys, set):
+            self.keys.discard(key)
+
+    def discard_prefix(self, prefix: str):
+        if isinstance(self.keys, set):
+            self.keys = set(filter(lambda k: not k.startswith(prefix), self.keys))
+
+    def check(self, key: str):
+        """
+        Returns: True if key is present, False if it is not, None if it is unknown (Bloom filter reported it as
+        present, it may be a false positive).
+        """
+        if key not in self.keys:
+            return False
+        return True if isinstance(self.keys, set) else None
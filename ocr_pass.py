@@ -0,0 +1,275 @@
+"""
+    Copyright 2025 Oleh Sharuda <oleh.sharuda@gmail.com>
+
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+ """
+import concurrent.futures
+import os
+import shutil
+import time
+from database import BooKeeperDB
+from logger import Logger
+from processors import languages, ocr_cache
+from processors.proc_arch import Arch_PROC
+from processors.proc_base import BookFileType
+from processors.processors import init_book_processors
+from scan_pool import ScanPool
+from terminator import Terminator
+
+
+def raise_invalid_operation(*args):
+    raise RuntimeError('Invalid operation')
+
+
+class OcrPass:
+    """
+    Recognizes books queued for OCR by scan with deferred OCR, books text is updated in place.
+    """
+    # See Book_PROC.extract_text()
+    allow_ocr = True
+
+    def __init__(self,
+                 ram_drive_path: str,
+                 language_option: str,
+                 delete_artifacts: bool,
+                 jobs: int = 1,
+                 budget: float = 0):
+        """
+        Args:
+            ram_drive_path: Path to the RAM drive.
+            language_option: Language option for tesseract.
+            delete_artifacts: If true all temporary and intermediate files will be deleted.
+            jobs: Number of worker processes.
+            budget: Time budget (seconds), no new books are started once it is exceeded. 0 - no limit.
+        """
+        self.db = BooKeeperDB()
+        self.logger = Logger()
+        self.terminator = None
+        self.ram_drive_path = ram_drive_path
+        self.language_option = language_option
+        self.delete_artifacts = delete_artifacts
+        self.jobs = jobs
+        self.budget = budget
+        self.pool = None
+        self.processors = None
+        self.pending_jobs = list()
+        self.extract_counter = 0
+        self.done_books = 0
+        self.failed_books = 0
+        self.processed_size = 0
+        self.arch_proc = Arch_PROC(ram_drive_path,
+                                   language_option,
+                                   delete_artifacts,
+                                   raise_invalid_operation,
+                                   raise_invalid_operation,
+                                   raise_invalid_operation,
+                                   raise_invalid_operation,
+                                   raise_invalid_operation,
+                                   BookFileType.ARCH_7Z)
+
+
+    def run(self):
+        """
+        Runs OCR pass.
+        """
+        self.terminator = Terminator()
+        queue = self.get_queue()
+
+        if self.jobs > 1:
+            self.pool = ScanPool(self.jobs, self.ram_drive_path, self.language_option, self.delete_artifacts)
+        else:
+            self.processors = init_book_processors(self.ram_drive_path, self.language_option, self.delete_artifacts,
+                                                   raise_invalid_operation, raise_invalid_operation)
+        self.terminator.add_exit_handler(self.stop_workers)
+
+        ocr_cache_start = ocr_cache.ocr_cache.get_stats() if ocr_cache.ocr_cache is not None else None
+        start = time.monotonic()
+        for file_hash, bft, page_count, lfn, size in queue:
+            self.terminator.check_exit()
+            if self.budget > 0 and time.monotonic() - start > self.budget:
+                self.logger.print_log('Time budget is exhausted.')
+                break
+            self.process_book(file_hash, BookFileType(bft), page_count, lfn)
+            self.processed_size += size
+
+        self.collect_jobs(0)
+        self.terminator.remove_exit_handler(self.stop_workers)
+        self.stop_workers()
+        self.print_summary(len(queue), time.monotonic() - start)
+        if ocr_cache_start is not None:
+            self.logger.print_log(ocr_cache.format_ocr_cache_stats(ocr_cache_start))
+
+
+    def get_queue(self) -> list:
+        """
+        Returns: Books to be processed, see BooKeeperDB.get_ocr_queue().
+        """
+        queue = self.db.get_ocr_queue()
+        self.logger.print_log(f'{len(queue)} books are queued for OCR.')
+        return queue
+
+
+    def print_summary(self, queue_len: int, elapsed: float):
+        self.logger.print_log(f'{self.done_books} books recognized, {self.failed_books} books failed, '
+                              f'{queue_len - self.done_books - self.failed_books} books left in OCR queue.')
+
+
+    def stop_workers(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            self.pending_jobs.clear()
+
+
+    def process_book(self, file_hash: str, bft: BookFileType, page_count: int, lfn: str):
+        """
+        Recognizes a single book: book is extracted (if it is inside archive) and passed to the worker pool.
+        Args:
+            file_hash: Book hash.
+            bft: Book type.
+            page_count: Number of pages.
+            lfn: Logical file name.
+        """
+        try:
+            file_name = self.get_book_file(lfn)
+        except RuntimeError as e:
+            self.on_book_failed(file_hash, lfn, str(e))
+            return
+
+        self.logger.print_diagnostic(f'OCR: {lfn}')
+        if self.pool is None:
+            try:
+                text, ocr, ocr_pending, full = self.processors[bft].extract_text(file_name, page_count,
+                                                                                 allow_ocr=self.allow_ocr)
+                self.on_book_done(file_hash, lfn, text, ocr, full)
+            except RuntimeError as e:
+                self.on_book_failed(file_hash, lfn, str(e))
+            self.release_book_file(file_name, lfn)
+            return
+
+        if len(self.pending_jobs) >= self.pool.max_pending:
+            self.collect_jobs(self.pool.max_pending - 1)
+        future = self.pool.submit_text(file_name, bft, page_count, self.allow_ocr)
+        self.pending_jobs.append((future, file_hash, lfn, file_name))
+
+
+    def collect_jobs(self, max_pending: int):
+        """
+        Waits until no more than max_pending worker jobs are left, results are written to the database.
+        """
+        while len(self.pending_jobs) > max_pending:
+            concurrent.futures.wait(map(lambda j: j[0], self.pending_jobs),
+                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            still_pending = list()
+            for job in self.pending_jobs:
+                future, file_hash, lfn, file_name = job
+                if not future.done():
+                    still_pending.append(job)
+                    continue
+
+                text, ocr, full, message = future.result()
+                if text is None:
+                    self.on_book_failed(file_hash, lfn, message)
+                else:
+                    self.on_book_done(file_hash, lfn, text, ocr, full)
+                self.release_book_file(file_name, lfn)
+            self.pending_jobs = still_pending
+
+
+    def get_book_file(self, lfn: str) -> str:
+        """
+        Returns: Real file name of the book, book is extracted to the RAM drive if it is inside archive.
+        """
+        if lfn is None:
+            raise RuntimeError('Book file is not found.')
+
+        file_name = self.arch_proc.unpack_file(lfn)
+        if file_name == lfn:
+            return file_name
+
+        # Extracted files are named by basename, make them unique while they wait for the workers.
+        self.extract_counter += 1
+        unique_name = os.path.join(self.ram_drive_path, f'ocr_{self.extract_counter}_{os.path.basename(file_name)}')
+        shutil.move(file_name, unique_name)
+        return unique_name
+
+
+    def release_book_file(self, file_name: str, lfn: str):
+        if file_name != lfn and os.path.isfile(file_name):
+            os.unlink(file_name)
+
+
+    def on_book_done(self, file_hash: str, lfn: str, text: str, ocr: bool, full_text: str):
+        self.db.set_book_ocr_text(file_hash, text, ocr, languages.get_text_language(text, self.language_option),
+                                  full_text)
+        self.done_books += 1
+        self.logger.print_log(f'OCR DONE: {lfn}', options=('green',))
+
+
+    def on_book_failed(self, file_hash: str, lfn: str, message: str):
+        self.db.set_ocr_error(file_hash, message)
+        self.failed_books += 1
+        self.logger.print_err(f'OCR FAILED: {lfn}\n{message}')
+
+
+class DeepenPass(OcrPass):
+    """
+    Extracts full text of the books scanned without full text mode (see configure_full_text()), so existing database
+    is deepened incrementally: books which already have full text are skipped. Sampled text is not changed.
+    """
+    # OCR is done as by scan (it may be deferred).
+    allow_ocr = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.text_size = 0
+
+
+    def get_queue(self) -> list:
+        queue = self.db.get_deepen_queue()
+        self.logger.print_log(f'{len(queue)} books have no full text.')
+        return queue
+
+
+    def print_summary(self, queue_len: int, elapsed: float):
+        books, size, compressed = self.db.get_full_text_stats()
+        mb = self.processed_size / (1024 * 1024)
+        self.logger.print_log(f'{self.done_books} books deepened, {self.failed_books} books failed, '
+                              f'{queue_len - self.done_books - self.failed_books} books left without full text.')
+        self.logger.print_log(f'{mb:.1f} MB of books processed in {elapsed:.1f} s '
+                              f'({elapsed / mb if mb > 0 else 0.0:.3f} s/MB), {self.text_size} bytes of text extracted.')
+        self.logger.print_log(format_full_text_stats(books, size, compressed))
+
+
+    def on_book_done(self, file_hash: str, lfn: str, text: str, ocr: bool, full_text: str):
+        self.db.set_book_full_text(file_hash, full_text)
+        self.text_size += len(full_text.encode('UTF-8'))
+        self.done_books += 1
+        self.logger.print_log(f'DEEPENED: {lfn}', options=('green',))
+
+
+    def on_book_failed(self, file_hash: str, lfn: str, message: str):
+        self.db.set_full_text_error(file_hash, message)
+        self.failed_books += 1
+        self.logger.print_err(f'DEEPEN FAILED: {lfn}\n{message}')
+
+
+def format_full_text_stats(books: int, size: int, compressed: int) -> str:
+    """
+    Returns: Full text storage summary, see BooKeeperDB.get_full_text_stats().
+    """
+    ratio = size / compressed if compressed else 0.0
+    per_book = compressed / books if books else 0
+    return (f'Full text of {books} books: {size} bytes of text stored in {compressed} bytes '
+            f'(compression {ratio:.1f}x, {per_book:.0f} bytes per book).')
@@ -0,0 +1,173 @@
+"""
+    Copyright 2025 Oleh Sharuda <oleh.sharuda@gmail.com>
+
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+ """
+import io
+from collections.abc import Callable
+from PIL import Image, ImageFilter, ImageOps, ImageSequence
+import numpy as np
+
+
+# Special pipeline: former ImageMagick convert chain (page image is enhanced by external convert call).
+CONVERT_PIPELINE = 'convert'
+DEFAULT_OCR_STAGES = ['grayscale', 'denoise', 'binarize']
+
+
+def to_grayscale(image: Image.Image) -> Image.Image:
+    return image if image.mode == 'L' else ImageOps.grayscale(image)
+
+
+def stage_grayscale(image: Image.Image) -> Image.Image:
+    return to_grayscale(image)
+
+
+def stage_autocontrast(image: Image.Image) -> Image.Image:
+    return ImageOps.autocontrast(to_grayscale(image), cutoff=1)
+
+
+def stage_denoise(image: Image.Image) -> Image.Image:
+    return to_grayscale(image).filter(ImageFilter.MedianFilter(3))
+
+
+def get_otsu_threshold(pixels: np.ndarray) -> int:
+    p = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    p /= pixels.size
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma_b = (mu[-1] * omega - mu) ** 2 / (omega * (1.0 - omega))
+    return int(np.argmax(np.nan_to_num(sigma_b)))
+
+
+def stage_binarize(image: Image.Image) -> Image.Image:
+    pixels = np.asarray(to_grayscale(image))
+    threshold = get_otsu_threshold(pixels)
+    return Image.fromarray(np.where(pixels > threshold, 255, 0).astype(np.uint8), mode='L')
+
+
+def stage_deskew(image: Image.Image, max_angle: float = 5.0, step: float = 0.5) -> Image.Image:
+    """
+    Rotates page so text lines are horizontal. Angle is the one giving the sharpest profile of dark pixels by rows,
+    it is searched for on a downscaled copy of the page.
+    """
+    image = to_grayscale(image)
+    small = image.copy()
+    small.thumbnail((800, 800))
+    small = ImageOps.invert(small)
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        profile = np.asarray(small.rotate(float(angle), resample=Image.Resampling.NEAREST)).sum(axis=1, dtype=np.float64)
+        score = float(np.var(profile))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+
+    if best_angle == 0.0:
+        return image
+    return image.rotate(best_angle, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255)
+
+
+# Available preprocessing stages: name -> function(image) -> image
+ocr_stages: dict[str, Callable[[Image.Image], Image.Image]] = {
+    'grayscale': stage_grayscale,
+    'autocontrast': stage_autocontrast,
+    'denoise': stage_denoise,
+    'binarize': stage_binarize,
+    'deskew': stage_deskew,
+}
+
+
+class ImagePipeline:
+    """
+    In-process page image preprocessing for OCR. Stages are applied in the given order.
+    """
+    def __init__(self, stages: list[str]):
+        unknown = [s for s in stages if s not in ocr_stages]
+        if unknown:
+            raise RuntimeError(f'Unknown OCR preprocessing stage(s): {", ".join(unknown)}. '
+                               f'Available stages: {", ".join(ocr_stages.keys())}')
+        self.stages = list(stages)
+
+    @property
+    def name(self) -> str:
+        return ','.join(self.stages)
+
+    def process(self, image: Image.Image) -> Image.Image:
+        for s in self.stages:
+            image = ocr_stages[s](image)
+        return image
+
+    def process_file(self, image_file_name: str) -> bytes:
+        """
+        Preprocesses page image file.
+        Returns: Preprocessed image encoded as PNM (cheap to encode, read by tesseract from stdin).
+        """
+        with Image.open(image_file_name) as image:
+            image.load()
+            return ImagePipeline.encode(self.process(image))
+
+    def process_pages(self, images: list[Image.Image]) -> bytes:
+        """
+        Preprocesses page images.
+        Returns: Preprocessed pages encoded as multipage TIFF (tesseract recognizes it page by page).
+        """
+        pages = list(map(lambda i: ImagePipeline.to_encodable(self.process(i)), images))
+        buffer = io.BytesIO()
+        pages[0].save(buffer, format='TIFF', save_all=True, append_images=pages[1:])
+        return buffer.getvalue()
+
+    @staticmethod
+    def to_encodable(image: Image.Image) -> Image.Image:
+        return image if image.mode in {'1', 'L', 'RGB'} else image.convert('RGB')
+
+    @staticmethod
+    def encode(image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        ImagePipeline.to_encodable(image).save(buffer, format='PPM')
+        return buffer.getvalue()
+
+
+def cap_image_size(image: Image.Image, max_size: int) -> Image.Image:
+    """
+    Scales image down, so neither width nor height exceed max_size (0 - no limit).
+    """
+    if max_size <= 0 or max(image.size) <= max_size:
+        return image
+    if image.mode == '1':
+        image = image.convert('L')
+    image = image.copy()
+    image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    return image
+
+
+def read_images(file_name: str) -> list[Image.Image]:
+    """
+    Reads all images (frames) of the image file, images are loaded into memory, so file may be deleted.
+    """
+    with Image.open(file_name) as image:
+        return [frame.copy() for frame in ImageSequence.Iterator(image)]
+
+
+# Configured pipeline, None means former convert chain.
+ocr_pipeline = ImagePipeline(DEFAULT_OCR_STAGES)
+
+
+def get_ocr_pipeline_name() -> str:
+    return CONVERT_PIPELINE if ocr_pipeline is None else ocr_pipeline.name
+
+
+def configure_ocr_pipeline(stages: list[str]):
+    global ocr_pipeline
+    ocr_pipeline = None if stages == [CONVERT_PIPELINE] else ImagePipeline(stages)
@@ -0,0 +1,100 @@
+"""
+    Copyright 2025 Oleh Sharuda <oleh.sharuda@gmail.com>
+
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+ """
+import collections
+import re
+import unicodedata
+
+
+# Tesseract languages by script (script names are the ones reported by tesseract OSD).
+script_languages = {
+    'Latin': {'eng', 'deu', 'fra', 'spa', 'ita', 'por', 'nld', 'pol', 'ces', 'slk', 'slv', 'hrv', 'hun', 'ron', 'fin',
+              'swe', 'nor', 'dan', 'est', 'lav', 'lit', 'tur', 'lat', 'cat', 'vie', 'ind'},
+    'Cyrillic': {'rus', 'ukr', 'bel', 'bul', 'srp', 'mkd', 'kaz'},
+    'Greek': {'ell', 'grc'},
+    'Arabic': {'ara', 'fas', 'urd'},
+    'Hebrew': {'heb', 'yid'},
+    'Devanagari': {'hin', 'mar', 'nep', 'san'},
+    'Han': {'chi_sim', 'chi_tra'},
+    'Japanese': {'jpn'},
+    'Hangul': {'kor'},
+    'Georgian': {'kat'},
+    'Armenian': {'hye'},
+}
+
+# Unicode character name prefixes of the scripts.
+unicode_scripts = {
+    'LATIN': 'Latin',
+    'CYRILLIC': 'Cyrillic',
+    'GREEK': 'Greek',
+    'ARABIC': 'Arabic',
+    'HEBREW': 'Hebrew',
+    'DEVANAGARI': 'Devanagari',
+    'CJK': 'Han',
+    'HIRAGANA': 'Japanese',
+    'KATAKANA': 'Japanese',
+    'HANGUL': 'Hangul',
+    'GEORGIAN': 'Georgian',
+    'ARMENIAN': 'Armenian',
+}
+
+# OSD script confidence below this is not trusted, page is recognized with all configured languages.
+min_script_confidence = 1.0
+
+osd_script_re = re.compile(r'^Script:\s*(\S+)\s*$', re.MULTILINE)
+osd_confidence_re = re.compile(r'^Script confidence:\s*([\d.]+)\s*$', re.MULTILINE)
+
+
+def get_script_languages(script: str, lang_opt: str) -> str:
+    """
+    Returns: Languages of lang_opt ('+' separated) written with the script, None if there are none.
+    """
+    languages = script_languages.get(script, set())
+    res = [l for l in lang_opt.split('+') if l in languages]
+    return '+'.join(res) if res else None
+
+
+def parse_osd(osd: str, page_count: int) -> list[str]:
+    """
+    Parses tesseract OSD output (--psm 0) of page_count pages.
+    Returns: List of scripts, script is None if it is not detected reliably.
+    """
+    scripts = osd_script_re.findall(osd)
+    confidences = osd_confidence_re.findall(osd)
+    if len(scripts) != page_count or len(confidences) != page_count:
+        return [None] * page_count
+    return [s if float(c) >= min_script_confidence else None for s, c in zip(scripts, confidences)]
+
+
+def get_text_script(text: str) -> str:
+    """
+    Returns: The most used script of the text letters, None if text has no letters of known scripts.
+    """
+    counter = collections.Counter()
+    for ch in text:
+        if ch.isalpha():
+            counter[unicode_scripts.get(unicodedata.name(ch, ' ').split(' ')[0])] += 1
+    counter.pop(None, None)
+    return counter.most_common(1)[0][0] if counter else None
+
+
+def get_text_language(text: str, lang_opt: str) -> str:
+    """
+    Returns: Languages of lang_opt written with the most used script of the text ('+' separated), empty string if
+    unknown.
+    """
+    script = get_text_script(text)
+    return (get_script_languages(script, lang_opt) or '') if script else ''
@@ -0,0 +1,195 @@
+"""
+    Copyright 2025 Oleh Sharuda <oleh.sharuda@gmail.com>
+
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+ """
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from PIL import Image
+
+
+class OcrCache:
+    """
+    Persistent cache of OCR results keyed by digest of the rendered page image, preprocessing pipeline and language
+    option. Cache is kept in a sidecar SQLite file, so worker processes may use it concurrently (every process opens
+    its own connection). Least recently used entries are evicted when cache size exceeds the limit.
+    Lookups are read only: last use time of the found entries and hit/miss counters are collected in memory and written
+    by put() or flush() (see flush_size).
+    """
+    # Number of the collected lookups which are written without waiting for put() or flush().
+    flush_size = 1000
+
+    def __init__(self, file_name: str, max_size: int):
+        """
+        Args:
+            file_name: Cache file name.
+            max_size: Cache size limit (bytes of cached text).
+        """
+        self.file_name = file_name
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+        self.pending_used = dict()
+        self.pending_hits = 0
+        self.pending_misses = 0
+
+        conn = self.get_connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS ocr_cache (key TEXT PRIMARY KEY, text TEXT, confidence REAL, '
+                     'size INTEGER, last_used REAL);')
+        conn.execute('CREATE INDEX IF NOT EXISTS ocr_cache_last_used ON ocr_cache (last_used);')
+        conn.execute('CREATE TABLE IF NOT EXISTS ocr_cache_stats (name TEXT PRIMARY KEY, value INTEGER);')
+        conn.execute("INSERT OR IGNORE INTO ocr_cache_stats (name, value) VALUES ('hits', 0), ('misses', 0);")
+        # Total size of the cached text is kept up to date by put(), it is summed up only here.
+        conn.execute("INSERT OR REPLACE INTO ocr_cache_stats (name, value) "
+                     "SELECT 'size', COALESCE(SUM(size), 0) FROM ocr_cache;")
+        conn.commit()
+
+    def get_connection(self) -> sqlite3.Connection:
+        # Connection is never shared between processes: worker processes are forked with the cache instance.
+        if self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.file_name, timeout=60, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL;')
+            self.connection.execute('PRAGMA synchronous=NORMAL;')
+            self.pid = os.getpid()
+            # Lookups collected by the parent process are written by the parent.
+            self.pending_used = dict()
+            self.pending_hits = 0
+            self.pending_misses = 0
+        return self.connection
+
+    @staticmethod
+    def make_key(image: Image.Image, pipeline_name: str, lang_opt: str) -> str:
+        h = hashlib.md5()
+        h.update(f'{image.mode}:{image.size[0]}x{image.size[1]}:{pipeline_name}:{lang_opt}:'.encode())
+        h.update(image.tobytes())
+        return h.hexdigest()
+
+    @staticmethod
+    def make_file_key(image_file_name: str, pipeline_name: str, lang_opt: str) -> str:
+        h = hashlib.md5()
+        h.update(f'file:{pipeline_name}:{lang_opt}:'.encode())
+        with open(image_file_name, 'rb') as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def get(self, keys: list[str]) -> dict[str, tuple[str, float]]:
+        """
+        Looks up cached results, hit and miss counters are updated (see flush()).
+        Returns: Dictionary key -> (page text, average word confidence) for the keys found in cache.
+        """
+        result = dict()
+        with self.lock:
+            conn = self.get_connection()
+            for k in keys:
+                row = conn.execute('SELECT text, confidence FROM ocr_cache WHERE key=?;', (k,)).fetchone()
+                if row is not None:
+                    result[k] = (row[0], row[1])
+
+            now = time.time()
+            hits = sum(1 for k in keys if k in result)
+            self.pending_used.update((k, now) for k in result.keys())
+            self.pending_hits += hits
+            self.pending_misses += len(keys) - hits
+            if self.pending_hits + self.pending_misses >= self.flush_size:
+                self.write_pending(conn)
+                conn.commit()
+        return result
+
+    def flush(self):
+        """
+        Writes lookups collected by get(): last use time of the found entries, hit and miss counters.
+        """
+        with self.lock:
+            conn = self.get_connection()
+            if self.write_pending(conn):
+                conn.commit()
+
+    def write_pending(self, conn: sqlite3.Connection) -> bool:
+        if not self.pending_hits and not self.pending_misses:
+            return False
+        conn.executemany('UPDATE ocr_cache SET last_used=? WHERE key=?;', [(t, k) for k, t in self.pending_used.items()])
+        conn.execute("UPDATE ocr_cache_stats SET value=value+? WHERE name='hits';", (self.pending_hits,))
+        conn.execute("UPDATE ocr_cache_stats SET value=value+? WHERE name='misses';", (self.pending_misses,))
+        self.pending_used = dict()
+        self.pending_hits = 0
+        self.pending_misses = 0
+        return True
+
+    def put(self, entries: dict[str, tuple[str, float]]):
+        """
+        Stores results: dictionary key -> (page text, average word confidence).
+        """
+        with self.lock:
+            conn = self.get_connection()
+            now = time.time()
+            rows = [(k, t, conf, len(t.encode()), now) for k, (t, conf) in entries.items()]
+            replaced = sum(row[0] for k in entries.keys()
+                           for row in conn.execute('SELECT size FROM ocr_cache WHERE key=?;', (k,)))
+            conn.executemany('INSERT OR REPLACE INTO ocr_cache (key, text, confidence, size, last_used) '
+                             'VALUES (?, ?, ?, ?, ?);', rows)
+            conn.execute("UPDATE ocr_cache_stats SET value=value+? WHERE name='size';",
+                         (sum(r[3] for r in rows) - replaced,))
+            self.write_pending(conn)
+            self.evict(conn)
+            conn.commit()
+
+    def evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT value FROM ocr_cache_stats WHERE name='size';").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        # Evict down to 90% of the limit, so eviction doesn't run on every put once cache is full.
+        excess = total - self.max_size * 9 // 10
+        evicted = 0
+        for key, size in conn.execute('SELECT key, size FROM ocr_cache ORDER BY last_used;').fetchall():
+            if evicted >= excess:
+                break
+            conn.execute('DELETE FROM ocr_cache WHERE key=?;', (key,))
+            evicted += size
+        conn.execute("UPDATE ocr_cache_stats SET value=value-? WHERE name='size';", (evicted,))
+
+    def get_stats(self) -> tuple[int, int]:
+        """
+        Returns: tuple (hits, misses) counted by all processes since cache file was created. Lookups of other processes
+        are counted once they are written (see flush()).
+        """
+        self.flush()
+        with self.lock:
+            rows = dict(self.get_connection().execute('SELECT name, value FROM ocr_cache_stats;').fetchall())
+        return rows.get('hits', 0), rows.get('misses', 0)
+
+
+# Configured cache, None if cache is disabled.
+ocr_cache = None
+
+
+def configure_ocr_cache(file_name: str, max_size: int):
+    global ocr_cache
+    ocr_cache = OcrCache(file_name, max_size) if file_name and max_size > 0 else None
+
+
+def format_ocr_cache_stats(start: tuple[int, int]) -> str:
+    """
+    Returns: Summary of cache use since start, start is a result of OcrCache.get_stats().
+    """
+    hits, misses = ocr_cache.get_stats()
+    hits -= start[0]
+    misses -= start[1]
+    total = hits + misses
+    rate = 100.0 * hits / total if total else 0.0
+    return f'OCR cache: {hits} pages taken from cache, {misses} pages recognized ({rate:.1f} % hit rate).'
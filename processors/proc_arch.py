@@ -19,7 +19,12 @@ import os.path
 from os.path import basename
 from processors.proc_base import *
 from tools import *
+from scratch_space import ScratchSpace
 import shutil
+import stat
+import tarfile
+import zipfile
+import zlib
 
 
 class Arch_PROC(Book_PROC):
@@ -32,13 +37,18 @@ class Arch_PROC(Book_PROC):
                  on_archive_enter: Callable[[str, str, str], None],
                  on_archive_leave: Callable[None, None],
                  on_bad_callback: Callable[[str, str], None],
-                 arch_type: BookFileType):
+                 arch_type: BookFileType,
+                 on_archive_member: Callable[[str, int, str], None] = None,
+                 scratch_space: ScratchSpace = None):
         super().__init__(tmpdir, lang_opt, delete_artifacts, on_book_callback, on_bad_callback)
         self.arch_type = arch_type
+        self.scratch_space = scratch_space
         self.on_archive_enter = on_archive_enter
         self.on_archive_leave = on_archive_leave
+        self.on_archive_member = on_archive_member
         self.on_scan_file = on_scan_file
         self.uniq_counter = 0
+        self.copy_buffer_size = 1024 * 1024
         pass
 
     def unpack_archive(self, file_name: str, extract_path: str) -> str:
@@ -199,7 +209,18 @@ class Arch_PROC(Book_PROC):
         Returns:
             Extracted file name
         """
-
+        destination_file = os.path.join(target_dir, basename(inner_rel_path))
+        try:
+            with zipfile.ZipFile(archive_name) as zf:
+                info = zf.getinfo(inner_rel_path)
+                if Arch_PROC.is_zip_supported([info]):
+                    with zf.open(info) as src:
+                        self.write_member(src, destination_file)
+                    return destination_file
+        except (zipfile.BadZipFile, KeyError, OSError, EOFError, zlib.error) as e:
+            raise RuntimeError(f'Failed to extract an archive {archive_name}({os.sep}{inner_rel_path}).\n{e}')
+
+        # Compression method is not supported by zipfile
         res, code, stdout = run_shell_adv(['unzip', archive_name, escape_path(inner_rel_path), f'-d', target_dir], print_stdout=False)
         if not res:
             raise RuntimeError(f'Failed to extract an archive {archive_name}({os.sep}{inner_rel_path}).\nError code: {code}\n{stdout}')
@@ -207,8 +228,7 @@ class Arch_PROC(Book_PROC):
         self.add_write_perm_to_dir(target_dir)
 
         extract_file = os.path.join(target_dir, inner_rel_path)
-        destination_file = os.path.join(target_dir, basename(inner_rel_path))
-        if inner_rel_path != destination_file:
+        if extract_file != destination_file:
             shutil.move(extract_file, destination_file)
 
         return destination_file
@@ -224,16 +244,17 @@ class Arch_PROC(Book_PROC):
         Returns:
             Extracted file name
         """
-        res, code, stdout = run_shell_adv(['tar', '-xzvf', archive_name, '-C', target_dir, inner_rel_path], print_stdout=False)
-        if not res:
-            raise RuntimeError(f'Failed to extract an archive {archive_name}({os.sep}{inner_rel_path}).\nError code: {code}\n{stdout}')
-
-        extract_file = os.path.join(target_dir, inner_rel_path)
         destination_file = os.path.join(target_dir, basename(inner_rel_path))
-        if inner_rel_path != destination_file:
-            shutil.move(extract_file, destination_file)
+        try:
+            with tarfile.open(archive_name, 'r|gz') as tf:
+                for member in tf:
+                    if member.isfile() and os.path.normpath(member.name) == os.path.normpath(inner_rel_path):
+                        self.write_member(tf.extractfile(member), destination_file)
+                        return destination_file
+        except (tarfile.TarError, OSError, EOFError, zlib.error) as e:
+            raise RuntimeError(f'Failed to extract an archive {archive_name}({os.sep}{inner_rel_path}).\n{e}')
 
-        return destination_file
+        raise RuntimeError(f'Failed to extract an archive {archive_name}({os.sep}{inner_rel_path}).\nFile is not found.')
 
     def unpack_file_rar(self, archive_name: str, inner_rel_path: str, target_dir: str) -> str:
         """
@@ -268,6 +289,41 @@ class Arch_PROC(Book_PROC):
         os.makedirs(tmp_dir)
         return tmp_dir
 
+    def make_extract_dir(self, file_name: str, size: int) -> str:
+        """
+        Creates directory to extract archive content to.
+        Args:
+            file_name: Archive name.
+            size: Amount of data (bytes) to be extracted.
+
+        Returns: Directory path. It is created in scratch space (if any), which may place it on disk.
+        """
+        if self.scratch_space is None:
+            return self.make_tmp_dir()
+
+        uniq_name = str(self.arch_type)+f'_{self.uniq_counter}'
+        self.uniq_counter += 1
+        return self.scratch_space.allocate_dir(uniq_name, size, file_name)
+
+    def free_extract_dir(self, extract_path: str):
+        if self.scratch_space is None:
+            shutil.rmtree(extract_path)
+        else:
+            self.scratch_space.free_dir(extract_path)
+
+    @staticmethod
+    def get_gzip_size(file_name: str) -> int:
+        """
+        Returns: Uncompressed size of gzip file (taken from gzip trailer, it's stored modulo 4 GiB).
+        """
+        with open(file_name, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size < 4:
+                return size
+            f.seek(-4, os.SEEK_END)
+            isize = int.from_bytes(f.read(4), 'little')
+        return max(isize, size)
+
     def unpack_tar_gz(self, file_name: str, target_dir: str):
         res, code, stdout = run_shell_adv(['tar', '-xzvf', file_name, '-C', target_dir], print_stdout=False)
         if not res:
@@ -296,22 +352,271 @@ class Arch_PROC(Book_PROC):
             self.logger.print_error(f'Failed set permissions for {path}.\nError code: {code}\n{stdout}')
 
 
-    def process_file(self, file_name: str, file_hash: str):
+    @staticmethod
+    def get_member_path(extract_path: str, member_name: str):
+        """
+        Returns: Path archive member is extracted to, or None if member name points outside extraction directory.
+        """
+        rel_path = os.path.normpath(member_name.lstrip('/'))
+        if rel_path == '.' or rel_path == '..' or rel_path.startswith('..' + os.sep):
+            return None
+        return os.path.join(extract_path, rel_path)
+
+    def write_member(self, src, target_file: str):
+        os.makedirs(os.path.dirname(target_file), exist_ok=True)
+        with open(target_file, 'wb') as dst:
+            shutil.copyfileobj(src, dst, self.copy_buffer_size)
+
+    def release_member(self, file_name: str):
+        """
+        Scan parameter for extracted archive members: scanner calls it once member is processed.
+        """
+        if os.path.isfile(file_name):
+            os.unlink(file_name)
+
+    @staticmethod
+    def is_member_extracted(member_name: str) -> bool:
+        """
+        Only books and nested archives are extracted, other members are recorded from the archive listing.
+        """
+        return get_book_type(member_name) != BookFileType.NONE
+
+    def scan_member(self, member_name: str, size: int, crc: str, extract_path: str, open_member: Callable):
+        """
+        Scans single archive member. Books and nested archives are extracted, scanned and deleted right away.
+        Args:
+            member_name: Member name (as it is in the archive).
+            size: Member size.
+            crc: Member CRC (None if not available).
+            extract_path: Extraction directory.
+            open_member: Callable returning file-like object with member data.
+        """
+        member_path = Arch_PROC.get_member_path(extract_path, member_name)
+        if member_path is None:
+            self.logger.print_warn(f'Archive member is skipped (bad name): {member_name}')
+            return
+
+        if not Arch_PROC.is_member_extracted(member_name):
+            if self.on_archive_member is not None:
+                self.on_archive_member(member_path, size, crc)
+            return
+
+        with open_member() as src:
+            self.write_member(src, member_path)
+        self.on_scan_file(member_path, self.release_member)
+
+    @staticmethod
+    def is_zip_supported(members: list) -> bool:
+        supported = {zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA}
+        return all(map(lambda i: i.compress_type in supported, members))
+
+    def scan_zip(self, file_name: str, file_hash: str):
+        """
+        Scans zip archive member by member, without extracting the whole archive.
+        """
+        try:
+            with zipfile.ZipFile(file_name) as zf:
+                members = list(filter(lambda i: not i.is_dir() and not stat.S_ISLNK(i.external_attr >> 16),
+                                      zf.infolist()))
+                if not Arch_PROC.is_zip_supported(members):
+                    # Compression method is not supported by zipfile, archive must be extracted by unzip.
+                    self.scan_unpacked(file_name, file_hash, sum(map(lambda i: i.file_size, members)))
+                    return
+
+                size = sum(map(lambda i: i.file_size, filter(lambda i: Arch_PROC.is_member_extracted(i.filename), members)))
+                extract_path = self.make_extract_dir(file_name, size)
+                self.on_archive_enter(file_name, extract_path, file_hash)
+                try:
+                    for info in members:
+                        self.scan_member(info.filename,
+                                         info.file_size,
+                                         f'{info.CRC:08x}',
+                                         extract_path,
+                                         lambda: zf.open(info))
+                finally:
+                    self.on_archive_leave()
+                    self.free_extract_dir(extract_path)
+        except (zipfile.BadZipFile, OSError, EOFError, zlib.error) as e:
+            raise RuntimeError(f'Failed to read an archive {file_name}.\n{e}')
+
+    def scan_tar_gz(self, file_name: str, file_hash: str):
+        """
+        Scans tar.gz archive in a single pass member by member, without extracting the whole archive.
+        """
+        try:
+            # Members are not known before single pass, so reserve uncompressed size of the whole archive.
+            extract_path = self.make_extract_dir(file_name, Arch_PROC.get_gzip_size(file_name))
+            try:
+                with tarfile.open(file_name, 'r|gz') as tf:
+                    self.on_archive_enter(file_name, extract_path, file_hash)
+                    try:
+                        for member in tf:
+                            if member.isfile():
+                                self.scan_member(member.name, member.size, None, extract_path,
+                                                 lambda: tf.extractfile(member))
+                    finally:
+                        self.on_archive_leave()
+            finally:
+                self.free_extract_dir(extract_path)
+        except (tarfile.TarError, OSError, EOFError, zlib.error) as e:
+            raise RuntimeError(f'Failed to read an archive {file_name}.\n{e}')
+
+    def scan_unpacked(self, file_name: str, file_hash: str, size: int):
+        """
+        Extracts the whole archive and scans extracted files.
+        """
         location_dir = os.path.dirname(file_name)
         base_name = os.path.basename(file_name)
-        extract_path = self.make_tmp_dir()
-
+        extract_path = self.make_extract_dir(file_name, size)
         try:
             self.unpack_archive(file_name, extract_path)
 
             self.on_archive_enter(file_name, extract_path, file_hash)
-            scan_directory(extract_path, on_file=self.on_scan_file, scan_param=(location_dir, base_name, extract_path))
-            self.on_archive_leave()
+            try:
+                scan_directory(extract_path, on_file=self.on_scan_file, scan_param=(location_dir, base_name, extract_path))
+            finally:
+                self.on_archive_leave()
+        finally:
+            self.free_extract_dir(extract_path)
+
+    @staticmethod
+    def parse_listing_7z(listing: str) -> list:
+        """
+        Parses technical listing (7z l -slt).
+        Returns: list of tuples (member name, size, crc) for files.
+        """
+        result = list()
+        # Archive properties go before separator line, members are separated by empty lines.
+        _, sep, members = listing.partition(f'{os.linesep}----------{os.linesep}')
+        if not sep:
+            return result
+
+        for block in members.split(os.linesep * 2):
+            props = dict()
+            for line in block.splitlines():
+                key, sep, value = line.partition(' = ')
+                if sep:
+                    props[key] = value
+
+            name = props.get('Path')
+            if not name or props.get('Folder') == '+' or props.get('Attributes', '').startswith('D'):
+                continue
+
+            crc = props.get('CRC')
+            result.append((name, int(props.get('Size') or 0), crc.lower() if crc else None))
+        return result
+
+    @staticmethod
+    def parse_listing_rar(listing: str) -> list:
+        """
+        Parses technical listing (unrar lt).
+        Returns: list of tuples (member name, size, crc) for files.
+        """
+        result = list()
+        props = dict()
+        for line in listing.splitlines() + ['']:
+            key, sep, value = line.strip().partition(': ')
+            if sep and key == 'Name':
+                props = {key: value}
+            elif sep:
+                props[key] = value
+            elif props:
+                if props.get('Type') == 'File':
+                    crc = props.get('CRC32')
+                    result.append((props['Name'], int(props.get('Size') or 0), crc.lower() if crc else None))
+                props = dict()
+        return result
+
+    def list_archive(self, file_name: str) -> list:
+        """
+        Lists rar or 7z archive.
+        Returns: list of tuples (member name, size, crc) for files.
+        """
+        if self.arch_type == BookFileType.ARCH_RAR:
+            res, code, stdout = run_shell_adv(['unrar', 'lt', '-p-', file_name], print_stdout=False)
+            members = Arch_PROC.parse_listing_rar(stdout) if res else None
+        else:
+            res, code, stdout = run_shell_adv(['7z', 'l', '-slt', file_name], print_stdout=False)
+            members = Arch_PROC.parse_listing_7z(stdout) if res else None
+
+        if not res:
+            raise RuntimeError(f'Failed to list an archive {file_name}.\nError code: {code}\n{stdout}')
+
+        return members
+
+    def extract_members(self, file_name: str, members: list, target_dir: str):
+        """
+        Extracts listed members of rar or 7z archive with a single call.
+        Args:
+            file_name: Archive name.
+            members: List of member names.
+            target_dir: Target directory.
+        """
+        list_file = target_dir + '.lst'
+        with open(list_file, 'w', encoding='utf-8') as f:
+            f.write(os.linesep.join(members) + os.linesep)
+
+        try:
+            if self.arch_type == BookFileType.ARCH_RAR:
+                params = ['unrar', 'x', '-p-', '-scfl', file_name, f'@{list_file}', f'{target_dir}/']
+            else:
+                params = ['7z', 'x', '-spd', '-scsUTF-8', file_name, f'@{list_file}', f'-o{target_dir}']
+            res, code, stdout = run_shell_adv(params, print_stdout=False)
+        finally:
+            os.unlink(list_file)
+
+        if not res:
+            raise RuntimeError(f'Failed to extract an archive {file_name}.\nError code: {code}\n{stdout}')
+
+    def scan_listed(self, file_name: str, file_hash: str):
+        """
+        Scans rar or 7z archive: non-book members are recorded from the archive listing, only books and nested archives
+        are extracted.
+        """
+        members = self.list_archive(file_name)
+        extracted = list(filter(lambda m: Arch_PROC.is_member_extracted(m[0]), members))
+        extract_path = self.make_extract_dir(file_name, sum(map(lambda m: m[1], extracted)))
+        try:
+            self.on_archive_enter(file_name, extract_path, file_hash)
+            try:
+                self.scan_listed_members(file_name, members, extract_path)
+            finally:
+                self.on_archive_leave()
+        finally:
+            self.free_extract_dir(extract_path)
+
+    def scan_listed_members(self, file_name: str, members: list, extract_path: str):
+        extracted = list()
+        for member_name, size, crc in members:
+            member_path = Arch_PROC.get_member_path(extract_path, member_name)
+            if member_path is None:
+                self.logger.print_warn(f'Archive member is skipped (bad name): {member_name}')
+            elif Arch_PROC.is_member_extracted(member_name):
+                extracted.append((member_name, member_path))
+            elif self.on_archive_member is not None:
+                self.on_archive_member(member_path, size, crc)
+
+        if extracted:
+            self.extract_members(file_name, [n for n, p in extracted], extract_path)
+
+        for member_name, member_path in extracted:
+            if os.path.isfile(member_path):
+                self.on_scan_file(member_path, self.release_member)
+            else:
+                self.logger.print_warn(f'Archive member is not extracted: {file_name}{os.sep}{member_name}')
+
+    def process_file(self, file_name: str, file_hash: str):
+        try:
+            match self.arch_type:
+                case BookFileType.ARCH_TARGZ:
+                    self.scan_tar_gz(file_name, file_hash)
+                case BookFileType.ARCH_ZIP:
+                    self.scan_zip(file_name, file_hash)
+                case _:
+                    self.scan_listed(file_name, file_hash)
         except RuntimeError as e:
             self.on_bad_callback(file_name, str(e))
 
-        shutil.rmtree(extract_path)
-
     def get_page_with_ocr(self, file_name: str, page: int, page_num: int) -> str:
         raise RuntimeError(f'get_page_with_ocr() is not implemented for {type(self)}')
 
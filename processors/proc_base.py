@@ -15,12 +15,147 @@
     limitations under the License.
  """
 
+import concurrent.futures
+import itertools
 import threading
+import zipfile
+from xml.etree.ElementTree import ParseError
 from enum import IntEnum
 from abc import ABC, abstractmethod
 from tools import *
 import os
 from logger import Logger
+from processors import image_pipeline, languages, ocr_cache, xml_text
+
+# Number of threads recognizing pages of a single book (see configure_page_ocr())
+page_ocr_workers = 1
+
+# Scratch file name counter, names are unique across threads and worker processes (pid is a part of the name).
+scratch_name_counter = itertools.count()
+
+
+# If True, pages without text layer are not recognized, books are queued for OCR pass instead.
+defer_ocr = False
+
+
+def configure_page_ocr(workers: int):
+    global page_ocr_workers
+    page_ocr_workers = max(1, workers)
+
+
+def configure_deferred_ocr(enabled: bool):
+    global defer_ocr
+    defer_ocr = enabled
+
+
+# If True, text of all pages is extracted (see configure_full_text()).
+full_text = False
+
+# Number of the first pages recognized in full text mode if they have no text layer, 0 - only sampled pages.
+full_text_ocr_pages = 0
+
+
+def configure_full_text(enabled: bool, ocr_pages: int):
+    """
+    Enables full text mode: besides sampled text (text_data), text of all pages is extracted with text layer and
+    returned as BookInfo.full_text.
+    Args:
+        enabled: Enable full text mode.
+        ocr_pages: Number of the first pages recognized if they have no text layer, 0 - only sampled pages.
+    """
+    global full_text, full_text_ocr_pages
+    full_text = enabled
+    full_text_ocr_pages = max(0, ocr_pages)
+
+
+# Relative positions of the pages sampled besides the first pages (see configure_page_sampling()).
+page_sampling = [0.1, 0.3, 0.5]
+
+
+def configure_page_sampling(positions: list[float]):
+    """
+    Sets positions of the pages sampled when the first pages don't give enough text.
+    Args:
+        positions: Page positions relative to the page count (0 <= position < 1).
+    """
+    global page_sampling
+    try:
+        values = list(map(float, positions))
+    except (TypeError, ValueError):
+        raise RuntimeError(f'Bad page sampling position(s): {positions}. Positions must be numbers in [0, 1).')
+    bad = [p for p in values if not 0 <= p < 1]
+    if bad:
+        raise RuntimeError(f'Bad page sampling position(s): {", ".join(map(str, bad))}. Positions must be in [0, 1).')
+    page_sampling = values
+
+
+# If True, script of the page is detected before OCR and page is recognized with the languages of this script only.
+detect_script = False
+
+# Pages are downscaled to this size (pixels, width or height) for script detection.
+script_detection_size = 1500
+
+
+def configure_script_detection(enabled: bool):
+    global detect_script
+    detect_script = enabled
+
+
+def get_scratch_name() -> str:
+    return f'{os.getpid()}_{next(scratch_name_counter)}'
+
+
+class RenderSettings:
+    """
+    Page rendering settings for OCR.
+    """
+    def __init__(self,
+                 dpi: int = 200,
+                 color: str = 'gray',
+                 max_size: int = 4000,
+                 adaptive_dpi: int = 0,
+                 min_confidence: float = 60.0):
+        """
+        Args:
+            dpi: Render resolution.
+            color: Rendered image colors: 'color', 'gray' or 'mono'.
+            max_size: Maximal width and height of the rendered page (pixels), larger pages are scaled down. 0 - no limit.
+            adaptive_dpi: If non-zero, pages recognized with no text or low confidence are rendered again with this
+                          resolution and recognized again.
+            min_confidence: Minimal average word confidence (0-100) of tesseract for adaptive mode.
+        """
+        if color not in {'color', 'gray', 'mono'}:
+            raise RuntimeError(f'Bad render color option: {color}. Available values are: color, gray, mono')
+        self.dpi = dpi
+        self.color = color
+        self.max_size = max_size
+        self.adaptive_dpi = adaptive_dpi
+        self.min_confidence = min_confidence
+
+    def __str__(self):
+        adaptive = f', adaptive {self.adaptive_dpi} dpi' if self.adaptive_dpi else ''
+        cap = f', max {self.max_size} px' if self.max_size else ''
+        return f'{self.dpi} dpi, {self.color}{cap}{adaptive}'
+
+
+# Page rendering settings by processor (see configure_page_render())
+render_settings = {'pdf': RenderSettings(), 'djvu': RenderSettings()}
+
+
+def configure_page_render(settings: dict):
+    """
+    Sets page rendering settings.
+    Args:
+        settings: dict (processor name -> dict of RenderSettings arguments), i.e. {"pdf": {"dpi": 150}}
+    """
+    for name, values in settings.items():
+        if name not in render_settings:
+            raise RuntimeError(f'Bad render settings: unknown processor {name}')
+        try:
+            render_settings[name] = RenderSettings(**values)
+        except TypeError as e:
+            raise RuntimeError(f'Bad render settings for {name}: {e}')
+
 
 """
 Supported file types
@@ -50,14 +185,20 @@ class BookInfo:
                  page_count = -1,
                  size = -1,
                  text_data = '',
-                 hash_value = ''):
+                 hash_value = '',
+                 ocr_pending = False,
+                 full_text = None,
+                 language = ''):
         self.book_type = book_type
         self.name = name
         self.ocr = ocr
+        self.ocr_pending = ocr_pending
         self.page_count = page_count
         self.size = size
         self.text_data = text_data
         self.hash_value = hash_value
+        self.full_text = full_text
+        self.language = language
 
     def to_report(self):
         text_recognition = "OCR" if self.ocr else "TEXT LAYER"
@@ -65,6 +206,7 @@ class BookInfo:
 {self.name}
 Book type: {BookFileType(self.book_type).name}
 Text source: {text_recognition}
+Language: {self.language}
 Page count: {self.page_count}
 File size: {self.size}
 File hash (MD5): {self.hash_value}
@@ -88,6 +230,9 @@ class Book_PROC(ABC):
         self.max_text_data_len = 1024
         self.on_bad_callback = on_bad_callback
         self.delete_artifacts = delete_artifacts
+        self.page_executor = None
+        self.batch_render = False
+        self.render_settings = RenderSettings()
         pass
 
     @abstractmethod
@@ -102,18 +247,63 @@ class Book_PROC(ABC):
     def get_page_text_layer(self, file_name: str, page: int, page_num: int) -> str:
         pass
 
-    def extract_text(self, file_name: str, max_page: int) -> tuple[str, bool]:
+    def get_text_layer_pages(self, file_name: str, page_count: int) -> list[str]:
+        """
+        Extracts text layer of the first pages with a single call. Processors which support it override this method.
+        Args:
+            file_name: Book file name.
+            page_count: Number of pages to extract.
+
+        Returns: List of page texts (page_count elements), or None if batch extraction is not supported.
+        """
+        return None
+
+    @staticmethod
+    def split_pages(text: str, page_count: int) -> list[str]:
+        """
+        Splits text extracted for several pages by form feed page separators.
+        Returns: List of page_count page texts, missing pages are empty.
+        """
+        pages = list(map(lambda p: p.strip(), text.split('\f')[:page_count]))
+        return pages + [''] * (page_count - len(pages))
+
+    def get_text_limit(self) -> int:
+        """
+        Returns: Number of characters text tools should produce, 0 - no limit (full text mode).
+        """
+        return 0 if full_text else self.max_text_data_len * 2
+
+    def extract_text(self, file_name: str, max_page: int, allow_ocr: bool = None) -> tuple[str, bool, bool, str]:
+        """
+        Extracts text of the sampled pages (see extract_page_text()). In full text mode text of all pages is extracted
+        as well (see configure_full_text()).
+        Args:
+            file_name: Book file name.
+            max_page: Number of pages in the book (-1 if pages are not applicable).
+            allow_ocr: If False, pages without text layer are not recognized. By default OCR is allowed unless it is
+                       deferred (see configure_deferred_ocr()).
+
+        Returns: tuple (text, True if OCR was used, True if OCR is required but it was not allowed, full text or None if
+                 full text mode is disabled). Pages of full text are separated by form feeds.
+        """
         raw_text = ''
+        full = None
         ocr = False
+        ocr_pending = False
+        if allow_ocr is None:
+            allow_ocr = not defer_ocr
 
         if max_page < 0:
             # Page is not applicable
             raw_text = self.get_page_text_layer(file_name, -1, -1)
+            if full_text:
+                full = raw_text.strip()
         else:
-            for i in range(0, self.max_page):
-                t, page_ocr = self.get_page_text(file_name, i, max_page)
-                ocr = ocr or page_ocr
-                raw_text = raw_text + ' ' + t
+            raw_text, ocr, ocr_pending, full = self.extract_page_text(file_name, max_page, allow_ocr)
+
+        # Cache lookups of the book are written once per book.
+        if ocr_cache.ocr_cache is not None:
+            ocr_cache.ocr_cache.flush()
 
         raw_text = self.raw_text_filter(raw_text)
         if len(raw_text) > self.max_text_data_len:
@@ -122,19 +312,191 @@ class Book_PROC(ABC):
             if index >= 0:
                 raw_text = raw_text[:index]
 
-        return raw_text, ocr
-
-    def get_page_text(self, file_name: str, page: int, page_num) -> tuple[str, bool]:
-        if page >= page_num:
-            return '', False
-
-        s = self.get_page_text_layer(file_name, page, page_num)
-        ocr = False
-        if len(s.strip()) == 0:
-            s = self.get_page_with_ocr(file_name, page, page_num)
-            ocr = True
-
-        return s, ocr
+        return raw_text, ocr, ocr_pending, full
+
+    def get_sample_pages(self, page_num: int) -> tuple[list[int], list[int]]:
+        """
+        Returns: tuple (first pages, pages spread over the book), see configure_page_sampling().
+        """
+        first = list(range(min(self.max_page, page_num)))
+        if page_num <= 0:
+            return first, list()
+        spread = sorted(set(min(page_num - 1, int(page_num * p)) for p in page_sampling) - set(first))
+        return first, spread
+
+    def is_enough_text(self, texts: list[str]) -> bool:
+        return len(self.raw_text_filter(' '.join(texts))) > self.max_text_data_len
+
+    def get_blank_pages(self, file_name: str, pages: list[int]) -> set[int]:
+        """
+        Finds blank pages among the pages without text layer, they are not recognized. Processors which can tell it
+        cheaply override this method.
+        Returns: Set of blank pages.
+        """
+        return set()
+
+    def extract_page_text(self, file_name: str, page_num: int, allow_ocr: bool) -> tuple[str, bool, bool, str]:
+        """
+        Extracts text of the sampled pages: the first pages, then pages spread over the book, until text is long enough
+        (see max_text_data_len). Text layer is taken first, pages without it are recognized only if text is still not
+        long enough: pages spread over the book go first, the first pages (cover, title, copyright) go last. Pages are
+        recognized by rounds, recognition stops once text is long enough.
+        Args:
+            file_name: Book file name.
+            page_num: Number of pages in the book.
+            allow_ocr: If False, pages without text layer are not recognized.
+
+        Returns: See extract_text().
+        """
+        first, spread = self.get_sample_pages(page_num)
+        layer_count = page_num if full_text else len(first)
+        text_layer = self.get_text_layer_pages(file_name, layer_count) if layer_count > 0 else None
+        if text_layer is None:
+            text_layer = [self.get_page_text_layer(file_name, i, page_num) for i in range(layer_count)]
+        texts = dict(enumerate(map(lambda t: t.strip(), text_layer)))
+
+        selected = list()
+        for p in first + spread:
+            if self.is_enough_text([texts[s] for s in sorted(selected)]):
+                break
+            if p not in texts:
+                texts[p] = self.get_page_text_layer(file_name, p, page_num).strip()
+            selected.append(p)
+
+        # Pages are recognized by bounded rounds, so only rendered pages of one round are kept on RAM drive and in memory.
+        round_size = max(2, page_ocr_workers)
+        ocr_pages = list()
+        ocr_pending = False
+        if not self.is_enough_text([texts[s] for s in sorted(selected)]):
+            candidates = [p for p in selected if p in spread] + [p for p in reversed(selected) if p in first]
+            candidates = [p for p in candidates if not texts[p]]
+            blank = self.get_blank_pages(file_name, candidates) if candidates else set()
+            candidates = [p for p in candidates if p not in blank]
+            ocr_pending = len(candidates) > 0 and not allow_ocr
+
+            while candidates and allow_ocr and not self.is_enough_text([texts[s] for s in sorted(selected)]):
+                ocr_round = sorted(candidates[:round_size])
+                candidates = candidates[round_size:]
+                for p, t in zip(ocr_round, self.get_pages_with_ocr(file_name, ocr_round, page_num)):
+                    texts[p] = t.strip()
+                ocr_pages += ocr_round
+
+        full = None
+        if full_text:
+            extra = [p for p in range(min(full_text_ocr_pages, page_num)) if not texts[p] and p not in ocr_pages]
+            if extra and allow_ocr:
+                for i in range(0, len(extra), round_size):
+                    ocr_round = extra[i:i + round_size]
+                    for p, t in zip(ocr_round, self.get_pages_with_ocr(file_name, ocr_round, page_num)):
+                        texts[p] = t.strip()
+                    ocr_pages += ocr_round
+            ocr_pending = ocr_pending or (len(extra) > 0 and not allow_ocr)
+            full = '\f'.join(texts[p] for p in range(page_num))
+
+        raw_text = ' '.join(texts[p] for p in sorted(selected))
+        return raw_text, len(ocr_pages) > 0, ocr_pending, full
+
+    def get_pages_with_ocr(self, file_name: str, pages: list[int], page_num: int) -> list[str]:
+        """
+        Recognizes pages, up to page_ocr_workers pages are recognized concurrently.
+        Returns: List of page texts in the order of pages.
+        """
+        if not pages:
+            return list()
+
+        workers = min(page_ocr_workers, len(pages))
+        if workers <= 1:
+            return self.get_page_group_with_ocr(file_name, pages, page_num)
+
+        if self.page_executor is None:
+            self.page_executor = concurrent.futures.ThreadPoolExecutor(max_workers=page_ocr_workers)
+
+        group_size = -(-len(pages) // workers)
+        futures = [self.page_executor.submit(self.get_page_group_with_ocr, file_name, pages[i:i + group_size], page_num)
+                   for i in range(0, len(pages), group_size)]
+        # Let all pages finish before raising, so no job is left writing scratch files.
+        concurrent.futures.wait(futures)
+        return [t for f in futures for t in f.result()]
+
+    def get_page_group_with_ocr(self, file_name: str, pages: list[int], page_num: int) -> list[str]:
+        if self.batch_render and image_pipeline.ocr_pipeline is not None:
+            return self.get_pages_with_ocr_batch(file_name, pages, page_num)
+        return [self.get_page_with_ocr(file_name, p, page_num) for p in pages]
+
+    def render_pages(self, file_name: str, pages: list[int], page_num: int, dpi: int) -> list:
+        """
+        Renders page images with a single call. Processors which support it override this method and set batch_render.
+        Args:
+            file_name: Book file name.
+            pages: Pages (zero based, ascending).
+            page_num: Number of pages in the book.
+            dpi: Render resolution (other settings are taken from self.render_settings).
+
+        Returns: List of page images (PIL images) in the order of pages.
+        """
+        raise RuntimeError(f'render_pages() is not implemented for {type(self)}')
+
+    def recognize_pages(self, file_name: str, pages: list[int], page_num: int, dpi: int) -> list[tuple[str, float]]:
+        """
+        Renders pages with a single call and recognizes them with a single tesseract run (language data is loaded once).
+        Returns: List of tuples (page text, average word confidence) in the order of pages.
+        """
+        images = self.render_pages(file_name, pages, page_num, dpi)
+        images = [image_pipeline.cap_image_size(i, self.render_settings.max_size) for i in images]
+
+        # Pages already recognized (same rendered image, preprocessing and language) are taken from OCR cache.
+        cache = ocr_cache.ocr_cache
+        cached = dict()
+        keys = list()
+        if cache is not None:
+            keys = [cache.make_key(i, image_pipeline.ocr_pipeline.name, self.lang_opt) for i in images]
+            cached = cache.get(keys)
+        missing = [n for n in range(len(images)) if not keys or keys[n] not in cached]
+        if not missing:
+            return [cached[k] for k in keys]
+
+        # Pages are recognized by groups of the same languages (single tesseract run per group).
+        if detect_script:
+            page_languages = self.detect_page_languages([images[n] for n in missing])
+        else:
+            page_languages = [self.lang_opt] * len(missing)
+
+        recognized = [None] * len(missing)
+        for lang in dict.fromkeys(page_languages):
+            group = [i for i, l in enumerate(page_languages) if l == lang]
+            try:
+                image_data = image_pipeline.ocr_pipeline.process_pages([images[missing[i]] for i in group])
+            except (OSError, ValueError) as e:
+                raise RuntimeError(f'Failed to preprocess page images of {file_name}: {e}')
+
+            for i, r in zip(group, self.run_tesseract_tsv(image_data, len(group), lang)):
+                recognized[i] = r
+
+        if cache is None:
+            return recognized
+
+        cached.update({keys[n]: r for n, r in zip(missing, recognized)})
+        cache.put({keys[n]: r for n, r in zip(missing, recognized)})
+        return [cached[k] for k in keys]
+
+    def get_pages_with_ocr_batch(self, file_name: str, pages: list[int], page_num: int) -> list[str]:
+        """
+        Recognizes pages rendered with a single call. In adaptive mode pages recognized with no text or low confidence
+        are rendered again with higher resolution.
+        Returns: List of page texts in the order of pages.
+        """
+        settings = self.render_settings
+        results = self.recognize_pages(file_name, pages, page_num, settings.dpi)
+
+        if settings.adaptive_dpi > settings.dpi:
+            retry = [i for i, (t, conf) in enumerate(results) if not t.strip() or conf < settings.min_confidence]
+            if retry:
+                retry_results = self.recognize_pages(file_name, [pages[i] for i in retry], page_num, settings.adaptive_dpi)
+                for i, r in zip(retry, retry_results):
+                    if len(r[0].strip()) > 0:
+                        results[i] = r
+
+        return [t for t, conf in results]
 
 
     def process_book_name(self, file_name: str):
@@ -179,22 +541,163 @@ class Book_PROC(ABC):
         if res is False:
             raise RuntimeError(f'Failed to convert {type_switch} to text. pandoc returned error: {code}\n{stdout}')
 
-        res = read_text_file(out_name, self.max_text_data_len * 2).strip()
+        res = read_text_file(out_name, self.get_text_limit() or -1).strip()
         if self.delete_artifacts:
             os.unlink(out_name)
 
         return res
 
+    def get_xml_book_text(self, file_name: str, fmt: xml_text.XmlTextFormat, type_switch: str) -> str:
+        """
+        Extracts text of XML based book in-process, only the beginning of the document is parsed. Pandoc is used if
+        book is malformed.
+        Args:
+            file_name: Book file name.
+            fmt: Book format.
+            type_switch: Pandoc input format.
+        """
+        try:
+            return xml_text.get_book_xml_text(file_name, fmt, self.get_text_limit())
+        except (ParseError, zipfile.BadZipFile, KeyError, ValueError, OSError) as e:
+            self.logger.print_diagnostic(f'Failed to parse {file_name} ({e}), pandoc is used.')
+
+        return self.get_pandoc_text(file_name, type_switch)
+
     def get_catdoc_text(self, file_name: str) -> str:
         res, code, stdout = run_shell_adv(['catdoc', f'{file_name}'],
-                                          print_stdout=False)
+                                          print_stdout=False,
+                                          output_limit=self.get_text_limit())
         if res is False:
             raise RuntimeError(f'Failed to convert doc to text. catdoc returned error: {code}\n{stdout}')
 
         return stdout
 
     def ocr_text(self, image_file_name: str) -> str:
-        uniq_name = str(threading.current_thread().native_id)
+        """
+        Recognizes text of the page image. Image is preprocessed in-process and passed to tesseract through stdin,
+        text is read from tesseract stdout.
+        """
+        cache = ocr_cache.ocr_cache
+        key = None
+        if cache is not None:
+            key = cache.make_file_key(image_file_name, image_pipeline.get_ocr_pipeline_name(), self.lang_opt)
+            cached = cache.get([key])
+            if key in cached:
+                return cached[key][0]
+
+        pipeline = image_pipeline.ocr_pipeline
+        if pipeline is None:
+            text = self.ocr_text_convert(image_file_name)
+        else:
+            try:
+                image_data = pipeline.process_file(image_file_name)
+            except (OSError, ValueError) as e:
+                raise RuntimeError(f'Failed to preprocess page image {image_file_name}: {e}')
+            text = self.run_tesseract(image_data)
+
+        if cache is not None:
+            cache.put({key: (text, 0.0)})
+        return text
+
+    def run_tesseract(self, image_data: bytes) -> str:
+        """
+        Runs tesseract on image passed through stdin (multipage TIFF is recognized page by page, pages are separated by
+        form feeds).
+        Returns: Recognized text.
+        """
+        res, code, stdout = run_shell_adv(['tesseract',
+                                           'stdin',
+                                           'stdout',
+                                           '-l',
+                                           self.lang_opt,
+                                           '-c',
+                                           'debug_file=/dev/null'],
+                                          input=image_data,
+                                          envvars=self.get_tesseract_env(),
+                                          print_stdout=False)
+        if res is False:
+            raise RuntimeError(f'Failed to recognize text: {code}\n{stdout}')
+
+        return stdout
+
+    def detect_page_languages(self, images: list) -> list[str]:
+        """
+        Detects script of the pages with tesseract OSD (single run on downscaled pages).
+        Returns: List of tesseract language options: configured languages of the detected script, or all configured
+                 languages if script is not detected reliably.
+        """
+        try:
+            small = [image_pipeline.cap_image_size(i, script_detection_size) for i in images]
+            image_data = image_pipeline.ImagePipeline(['grayscale']).process_pages(small)
+        except (OSError, ValueError) as e:
+            raise RuntimeError(f'Failed to preprocess page images for script detection: {e}')
+
+        res, code, stdout = run_shell_adv(['tesseract',
+                                           'stdin',
+                                           'stdout',
+                                           '--psm',
+                                           '0',
+                                           '-c',
+                                           'debug_file=/dev/null'],
+                                          input=image_data,
+                                          envvars=self.get_tesseract_env(),
+                                          print_stdout=False)
+        scripts = languages.parse_osd(stdout, len(images)) if res else [None] * len(images)
+        return [(languages.get_script_languages(s, self.lang_opt) if s else None) or self.lang_opt for s in scripts]
+
+    def run_tesseract_tsv(self, image_data: bytes, page_count: int, lang_opt: str = None) -> list[tuple[str, float]]:
+        """
+        Runs tesseract on image passed through stdin with TSV output.
+        Args:
+            image_data: Page images.
+            page_count: Number of pages.
+            lang_opt: Language option, by default configured one is used.
+
+        Returns: List of page_count tuples (page text, average word confidence).
+        """
+        res, code, stdout = run_shell_adv(['tesseract',
+                                           'stdin',
+                                           'stdout',
+                                           '-l',
+                                           lang_opt or self.lang_opt,
+                                           '-c',
+                                           'debug_file=/dev/null',
+                                           'tsv'],
+                                          input=image_data,
+                                          envvars=self.get_tesseract_env(),
+                                          print_stdout=False)
+        if res is False:
+            raise RuntimeError(f'Failed to recognize text: {code}\n{stdout}')
+
+        return Book_PROC.parse_tesseract_tsv(stdout, page_count)
+
+    @staticmethod
+    def parse_tesseract_tsv(tsv: str, page_count: int) -> list[tuple[str, float]]:
+        # Columns: level page_num block_num par_num line_num word_num left top width height conf text
+        lines = [dict() for i in range(page_count)]
+        confidence = [list() for i in range(page_count)]
+        for row in tsv.splitlines()[1:]:
+            cols = row.split('\t')
+            if len(cols) < 12 or cols[0] != '5' or not cols[11].strip():
+                continue
+            page = int(cols[1]) - 1
+            if 0 <= page < page_count:
+                lines[page].setdefault(tuple(cols[2:5]), list()).append(cols[11])
+                confidence[page].append(float(cols[10]))
+
+        return [(os.linesep.join(map(' '.join, lines[i].values())),
+                 sum(confidence[i]) / len(confidence[i]) if confidence[i] else 0.0) for i in range(page_count)]
+
+    @staticmethod
+    def get_tesseract_env() -> dict:
+        # Pages are recognized in parallel: one thread per tesseract, otherwise cores are oversubscribed.
+        return {'OMP_THREAD_LIMIT': '1'} if page_ocr_workers > 1 else None
+
+    def ocr_text_convert(self, image_file_name: str) -> str:
+        """
+        Former OCR chain: page image is enhanced by ImageMagick convert, tesseract reads and writes files.
+        """
+        uniq_name = get_scratch_name()
         base_name = os.path.join(self.temp_dir, f'{uniq_name}')
         png_name = f'{base_name}.png'
         txt_name = f'{base_name}.txt'
@@ -217,6 +720,7 @@ class Book_PROC(ABC):
                                            f'{base_name}',
                                            '-l',
                                            self.lang_opt],
+                                          envvars=self.get_tesseract_env(),
                                           print_stdout=False)
         if res is False:
             raise RuntimeError(f'Failed to recognize text: {code}\n{stdout}')
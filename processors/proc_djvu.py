@@ -17,6 +17,7 @@
 
 import os.path
 from processors.proc_base import *
+from processors.image_pipeline import read_images, to_grayscale
 
 
 class Djvu_PROC(Book_PROC):
@@ -27,6 +28,8 @@ class Djvu_PROC(Book_PROC):
                  on_book_callback: Callable[[str, BookInfo], None],
                  on_bad_callback: Callable[[str, str], None]):
         super().__init__(tmpdir, lang_opt, delete_artifacts, on_book_callback, on_bad_callback)
+        self.batch_render = True
+        self.render_settings = render_settings['djvu']
         pass
 
     def process_file(self, file_name: str, file_hash: str):
@@ -36,19 +39,25 @@ class Djvu_PROC(Book_PROC):
         info.size = os.path.getsize(file_name)
         info.hash_value = file_hash
 
+        info.page_count = self.get_page_count(file_name)
+        info.text_data, info.ocr, info.ocr_pending, info.full_text = self.extract_text(file_name, info.page_count)
+        self.on_book_callback(file_name, info)
+
+    def get_page_count(self, file_name: str) -> int:
         res, code, stdout = run_shell_adv(['djvused', '-e', 'n', f'{file_name}'],
                                           print_stdout=False)
         if res is False:
             raise RuntimeError(f'Failed to get page number for {file_name}\nError code: {code}\n{stdout}')
-        info.page_count = int(stdout)
-        info.text_data, info.ocr = self.extract_text(file_name, info.page_count)
-        self.on_book_callback(file_name, info)
+        return int(stdout)
 
     def get_page_with_ocr(self, file_name: str, page: int, page_num: int) -> str:
-        base_name = os.path.join(self.temp_dir, f'{os.path.basename(file_name)}.{page}')
+        base_name = os.path.join(self.temp_dir, f'{get_scratch_name()}.{page}')
         pnm_name = f'{base_name}.pnm'
 
-        res, code, stdout = run_shell_adv(['ddjvu', f'-page={page}', f'{file_name}', f'{pnm_name}'],
+        render_args = self.get_render_args(self.render_settings.dpi)
+        if self.render_settings.color == 'gray':
+            render_args.append('-format=pgm')
+        res, code, stdout = run_shell_adv(['ddjvu', *render_args, f'-page={page + 1}', f'{file_name}', f'{pnm_name}'],
                                           print_stdout=False)
         if res is False:
             if os.path.isfile(pnm_name) and self.delete_artifacts:
@@ -61,11 +70,48 @@ class Djvu_PROC(Book_PROC):
             os.unlink(pnm_name)
         return res
 
+    def get_render_args(self, dpi: int) -> list:
+        # -scale is the render resolution (dpi), mono pages are rendered bitonal
+        args = [f'-scale={dpi}']
+        if self.render_settings.color == 'mono':
+            args.append('-mode=black')
+        return args
+
+    def render_pages(self, file_name: str, pages: list[int], page_num: int, dpi: int) -> list:
+        tif_name = os.path.join(self.temp_dir, f'{get_scratch_name()}.tif')
+        page_spec = ','.join(map(lambda p: str(p + 1), pages))
+        try:
+            res, code, stdout = run_shell_adv(['ddjvu', '-format=tiff', *self.get_render_args(dpi), f'-page={page_spec}', f'{file_name}', f'{tif_name}'],
+                                              print_stdout=False)
+            if res is False:
+                raise RuntimeError(f'Failed to extract pages. ddjvu returned error: {code}\n{stdout}')
+
+            images = read_images(tif_name)
+            # ddjvu has no grayscale TIFF output
+            if self.render_settings.color == 'gray':
+                images = list(map(to_grayscale, images))
+            return images
+        except OSError as e:
+            raise RuntimeError(f'Failed to read page images of {file_name}: {e}')
+        finally:
+            if os.path.isfile(tif_name) and self.delete_artifacts:
+                os.unlink(tif_name)
+
     def get_page_text_layer(self, file_name: str, page: int, page_num: int) -> str:
-        res, code, stdout = run_shell_adv(['djvutxt', f'-page={page}', f'{file_name}'],
-                                          print_stdout=False)
+        res, code, stdout = run_shell_adv(['djvutxt', f'-page={page + 1}', f'{file_name}'],
+                                          print_stdout=False,
+                                          output_limit=self.get_text_limit())
         if res is False:
             raise RuntimeError(f'Failed to extract text layer. ddjvu returned error: {code}\n{stdout}')
 
 
         return stdout
+
+    def get_text_layer_pages(self, file_name: str, page_count: int) -> list[str]:
+        res, code, stdout = run_shell_adv(['djvutxt', f'-page=1-{page_count}', f'{file_name}'],
+                                          print_stdout=False,
+                                          output_limit=self.get_text_limit())
+        if res is False:
+            raise RuntimeError(f'Failed to extract text layer. djvutxt returned error: {code}\n{stdout}')
+
+        return Book_PROC.split_pages(stdout, page_count)
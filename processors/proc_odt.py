@@ -17,6 +17,7 @@
 
 import os.path
 from processors.proc_base import *
+from processors import xml_text
 
 
 class Odt_PROC(Book_PROC):
@@ -36,7 +37,7 @@ class Odt_PROC(Book_PROC):
         info.size = os.path.getsize(file_name)
         info.hash_value = file_hash
         info.page_count = -1
-        info.text_data, info.ocr = self.extract_text(file_name, info.page_count)
+        info.text_data, info.ocr, info.ocr_pending, info.full_text = self.extract_text(file_name, info.page_count)
         self.on_book_callback(file_name, info)
 
 
@@ -45,4 +46,4 @@ class Odt_PROC(Book_PROC):
 
 
     def get_page_text_layer(self, file_name: str, page: int, page_num: int) -> str:
-        return self.get_pandoc_text(file_name, 'odt')
\ No newline at end of file
+        return self.get_xml_book_text(file_name, xml_text.ODT_FORMAT, 'odt')
\ No newline at end of file
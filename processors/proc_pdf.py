@@ -17,6 +17,7 @@
 
 from processors.proc_base import *
 from tools import *
+from processors.image_pipeline import read_images
 import re
 
 
@@ -29,6 +30,8 @@ class Pdf_PROC(Book_PROC):
                  on_bad_callback: Callable[[str, str], None]):
         super().__init__(tmpdir, lang_opt, delete_artifacts, on_book_callback, on_bad_callback)
         self.page_num_re = re.compile(r'^Pages:\s+(\d+)\s*$', re.MULTILINE)
+        self.batch_render = True
+        self.render_settings = render_settings['pdf']
         pass
 
     def process_file(self, file_name: str, file_hash: str):
@@ -38,6 +41,13 @@ class Pdf_PROC(Book_PROC):
         info.size = os.path.getsize(file_name)
         info.hash_value = file_hash
 
+        info.page_count = self.get_page_count(file_name)
+
+        (info.text_data, info.ocr, info.ocr_pending, info.full_text) = self.extract_text(file_name, info.page_count)
+        self.on_book_callback(file_name, info)
+
+
+    def get_page_count(self, file_name: str) -> int:
         res, code, stdout = run_shell_adv(['pdfinfo', file_name],
                                           print_stdout=False)
         if res is False:
@@ -47,25 +57,35 @@ class Pdf_PROC(Book_PROC):
         if not m:
             raise RuntimeError(f"Failed to get pdf file page count.")
 
-        info.page_count = int(m.group(1))
-
-        (info.text_data, info.ocr) = self.extract_text(file_name, info.page_count)
-        self.on_book_callback(file_name, info)
-
-
-    def get_page_with_ocr(self, file_name: str, page: int, page_num: int) -> str:
-        page += 1
-        base_name = os.path.join(self.temp_dir, f'{os.path.basename(file_name)}')
-        base_name = os.path.join(self.temp_dir, f'image')
-
+        return int(m.group(1))
+
+    def get_render_args(self, dpi: int) -> tuple[list, str]:
+        """
+        Returns: tuple (pdftoppm arguments, rendered image file extension)
+        """
+        match self.render_settings.color:
+            case 'gray':
+                return ['-r', f'{dpi}', '-gray'], '.pgm'
+            case 'mono':
+                return ['-r', f'{dpi}', '-mono'], '.pbm'
+            case _:
+                return ['-r', f'{dpi}'], '.ppm'
+
+    @staticmethod
+    def get_ppm_name(base_name: str, page: int, page_num: int, ext: str = '.ppm') -> str:
         # pdftoppm produces page number as 000xxx, where xxx - is actual page number with heading zeroes,
         # so the total string length is the same as length of the page_num
         pnl = len(str(page_num))
         pl = len(str(page))
         page_str = '0'*(pnl - pl) + str(page)
+        return f'{base_name}-{page_str}{ext}'
 
-        ppm_name = f'{base_name}-{page_str}.ppm'
-        res, code, stdout = run_shell_adv(['pdftoppm', file_name, f'-f', f'{page}', f'-l', f'{page}', base_name],
+    def get_page_with_ocr(self, file_name: str, page: int, page_num: int) -> str:
+        page += 1
+        base_name = os.path.join(self.temp_dir, f'image_{get_scratch_name()}')
+        render_args, ext = self.get_render_args(self.render_settings.dpi)
+        ppm_name = Pdf_PROC.get_ppm_name(base_name, page, page_num, ext)
+        res, code, stdout = run_shell_adv(['pdftoppm', *render_args, file_name, f'-f', f'{page}', f'-l', f'{page}', base_name],
                                           print_stdout=False)
         if res is False:
             if os.path.isfile(ppm_name) and self.delete_artifacts:
@@ -77,9 +97,43 @@ class Pdf_PROC(Book_PROC):
             os.unlink(ppm_name)
         return res
 
+    @staticmethod
+    def get_page_runs(pages: list[int]) -> list[tuple[int, int]]:
+        """
+        Returns: Runs of consecutive pages: list of tuples (first page, last page).
+        """
+        runs = list()
+        for p in pages:
+            if runs and runs[-1][1] + 1 == p:
+                runs[-1] = (runs[-1][0], p)
+            else:
+                runs.append((p, p))
+        return runs
+
+    def render_pages(self, file_name: str, pages: list[int], page_num: int, dpi: int) -> list:
+        base_name = os.path.join(self.temp_dir, f'image_{get_scratch_name()}')
+        render_args, ext = self.get_render_args(dpi)
+        ppm_names = [Pdf_PROC.get_ppm_name(base_name, p + 1, page_num, ext) for p in pages]
+        try:
+            # Every run of consecutive pages is rendered with a single call, so sampled pages spread over the book
+            # don't make pages in between rendered.
+            for first, last in Pdf_PROC.get_page_runs(pages):
+                res, code, stdout = run_shell_adv(['pdftoppm', *render_args, file_name, f'-f', f'{first + 1}', f'-l', f'{last + 1}', base_name],
+                                                  print_stdout=False)
+                if res is False:
+                    raise RuntimeError(f'Failed to extract page images. pdftoppm returned error: {code}\n{stdout}')
+
+            return [image for ppm_name in ppm_names for image in read_images(ppm_name)]
+        except OSError as e:
+            raise RuntimeError(f'Failed to read page images of {file_name}: {e}')
+        finally:
+            if self.delete_artifacts:
+                for ppm_name in filter(os.path.isfile, ppm_names):
+                    os.unlink(ppm_name)
+
     def get_page_text_layer(self, file_name: str, page: int, page_num: int) -> str:
         page += 1
-        out_name = os.path.join(self.temp_dir, f'{os.path.basename(file_name)}.{page}.txt')
+        out_name = os.path.join(self.temp_dir, f'{get_scratch_name()}.{page}.txt')
         res, code, stdout = run_shell_adv(['pdftotext', file_name, f'-f', f'{page}', f'-l', f'{page}', out_name],
                                           print_stdout=False)
         if res is False:
@@ -92,3 +146,33 @@ class Pdf_PROC(Book_PROC):
             os.unlink(out_name)
 
         return res
+
+    def get_blank_pages(self, file_name: str, pages: list[int]) -> set[int]:
+        # Pages without text layer and images are blank. If images can't be listed, no page is considered blank.
+        try:
+            res, code, stdout = run_shell_adv(['pdfimages', '-list', '-f', f'{min(pages) + 1}', '-l', f'{max(pages) + 1}',
+                                               file_name],
+                                              print_stdout=False)
+        except OSError:
+            return set()
+        if res is False:
+            return set()
+
+        # Listing has two header lines, page number is the first column.
+        image_pages = set()
+        for line in stdout.splitlines()[2:]:
+            fields = line.split()
+            if fields and fields[0].isdigit():
+                image_pages.add(int(fields[0]) - 1)
+
+        return set(pages) - image_pages
+
+    def get_text_layer_pages(self, file_name: str, page_count: int) -> list[str]:
+        # Text goes to stdout, -q keeps error messages out of it.
+        res, code, stdout = run_shell_adv(['pdftotext', '-q', f'-f', '1', f'-l', f'{page_count}', file_name, '-'],
+                                          print_stdout=False,
+                                          output_limit=self.get_text_limit())
+        if res is False:
+            raise RuntimeError(f'Failed to extract text layer. pdftotext returned error: {code}\n{stdout}')
+
+        return Book_PROC.split_pages(stdout, page_count)
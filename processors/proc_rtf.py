@@ -36,7 +36,7 @@ class Rtf_PROC(Book_PROC):
         info.size = os.path.getsize(file_name)
         info.hash_value = file_hash
         info.page_count = -1
-        info.text_data, info.ocr = self.extract_text(file_name, info.page_count)
+        info.text_data, info.ocr, info.ocr_pending, info.full_text = self.extract_text(file_name, info.page_count)
         self.on_book_callback(file_name, info)
 
 
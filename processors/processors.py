@@ -25,6 +25,34 @@ from processors.proc_pdf import *
 from processors.proc_rtf import *
 
 
+def init_book_processors(temp_dir: str,
+                         lang_opt: str,
+                         delete_artifacts: bool,
+                         on_book_callback: Callable[[str, BookInfo], None],
+                         on_bad_book_callback: Callable[[str, str], None]):
+    """
+    Initializes book (non-archive) processors
+    Args:
+        temp_dir: Temporary directory for intermediate files (RAM drive)
+        lang_opt: Language option
+        delete_artifacts: If true all temporary and intermediate files will be deleted. For debug purposes set false.
+        on_book_callback: Callback to be called for every discovered book.
+        on_bad_book_callback: Callback to be called for every broken book.
+
+    Returns: dict() with book processors (key is BookFileType)
+
+    """
+    processor_map = dict()
+    processor_map[BookFileType.DJVU] = Djvu_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
+    processor_map[BookFileType.PDF] = Pdf_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
+    processor_map[BookFileType.FB2] = Fb2_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
+    processor_map[BookFileType.DOCX] = Docx_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
+    processor_map[BookFileType.DOC] = Doc_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
+    processor_map[BookFileType.ODT] = Odt_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
+    processor_map[BookFileType.RTF] = Rtf_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
+    return processor_map
+
+
 def init_processors(temp_dir: str,
                     lang_opt: str,
                     delete_artifacts: bool,
@@ -33,7 +61,9 @@ def init_processors(temp_dir: str,
                     on_archive_enter: Callable[[str, str, str], None],
                     on_archive_leave: Callable[None, None],
                     on_bad_book_callback: Callable[[str, str], None],
-                    on_bad_archive_callback: Callable[[str, str], None]):
+                    on_bad_archive_callback: Callable[[str, str], None],
+                    on_archive_member: Callable[[str, int, str], None] = None,
+                    scratch_space: ScratchSpace = None):
     """
     Initializes file processors
     Args:
@@ -46,20 +76,15 @@ def init_processors(temp_dir: str,
         on_archive_leave: Callback to be called when leave into some archive.
         on_bad_book_callback: Callback to be called for every broken book.
         on_bad_archive_callback: Callback to be called for every broken archive.
+        on_archive_member: Callback to be called for every archive member which is not extracted (not a book).
+        scratch_space: Scratch space archives are extracted to. If None, archives are extracted to temp_dir.
 
     Returns: dict() with all processors (key is BookFileType)
 
     """
-    processor_map = dict()
-    processor_map[BookFileType.DJVU] = Djvu_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
-    processor_map[BookFileType.PDF] = Pdf_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
-    processor_map[BookFileType.FB2] = Fb2_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
-    processor_map[BookFileType.DOCX] = Docx_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
-    processor_map[BookFileType.DOC] = Doc_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
-    processor_map[BookFileType.ODT] = Odt_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
-    processor_map[BookFileType.RTF] = Rtf_PROC(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
-    processor_map[BookFileType.ARCH_TARGZ] = Arch_PROC(temp_dir, lang_opt, delete_artifacts, on_scan_file, on_book_callback, on_archive_enter, on_archive_leave, on_bad_archive_callback, BookFileType.ARCH_TARGZ)
-    processor_map[BookFileType.ARCH_RAR] = Arch_PROC(temp_dir, lang_opt, delete_artifacts, on_scan_file, on_book_callback, on_archive_enter, on_archive_leave, on_bad_archive_callback, BookFileType.ARCH_RAR)
-    processor_map[BookFileType.ARCH_ZIP] = Arch_PROC(temp_dir, lang_opt, delete_artifacts, on_scan_file, on_book_callback, on_archive_enter, on_archive_leave, on_bad_archive_callback, BookFileType.ARCH_ZIP)
-    processor_map[BookFileType.ARCH_7Z] = Arch_PROC(temp_dir, lang_opt, delete_artifacts, on_scan_file, on_book_callback, on_archive_enter, on_archive_leave, on_bad_archive_callback, BookFileType.ARCH_7Z)
+    processor_map = init_book_processors(temp_dir, lang_opt, delete_artifacts, on_book_callback, on_bad_book_callback)
+    processor_map[BookFileType.ARCH_TARGZ] = Arch_PROC(temp_dir, lang_opt, delete_artifacts, on_scan_file, on_book_callback, on_archive_enter, on_archive_leave, on_bad_archive_callback, BookFileType.ARCH_TARGZ, on_archive_member, scratch_space)
+    processor_map[BookFileType.ARCH_RAR] = Arch_PROC(temp_dir, lang_opt, delete_artifacts, on_scan_file, on_book_callback, on_archive_enter, on_archive_leave, on_bad_archive_callback, BookFileType.ARCH_RAR, on_archive_member, scratch_space)
+    processor_map[BookFileType.ARCH_ZIP] = Arch_PROC(temp_dir, lang_opt, delete_artifacts, on_scan_file, on_book_callback, on_archive_enter, on_archive_leave, on_bad_archive_callback, BookFileType.ARCH_ZIP, on_archive_member, scratch_space)
+    processor_map[BookFileType.ARCH_7Z] = Arch_PROC(temp_dir, lang_opt, delete_artifacts, on_scan_file, on_book_callback, on_archive_enter, on_archive_leave, on_bad_archive_callback, BookFileType.ARCH_7Z, on_archive_member, scratch_space)
     return processor_map
@@ -0,0 +1,164 @@
+"""
+    Copyright 2025 Oleh Sharuda <oleh.sharuda@gmail.com>
+
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+ """
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import BinaryIO
+
+
+class XmlTextFormat:
+    """
+    Describes where text is kept in XML document of the book format. Tag names are given without namespace.
+    """
+    def __init__(self,
+                 member: str,
+                 paragraphs: set[str],
+                 text: set[str] = None,
+                 replacements: dict[str, str] = None,
+                 skip: set[str] = None,
+                 space_count: tuple[str, str] = None):
+        """
+        Args:
+            member: Name of the zip member with XML document, None if book file is XML document itself.
+            paragraphs: Tags of paragraph elements, text is collected paragraph by paragraph.
+            text: Tags of elements with text inside paragraph, None if any text of paragraph is collected.
+            replacements: Tags of elements which stand for some text (tabs, line breaks): tag -> text.
+            skip: Tags of elements which text is not collected (notes, images).
+            space_count: Tag of the space element and its repeat count attribute (ODT), None if not applicable.
+        """
+        self.member = member
+        self.paragraphs = paragraphs
+        self.text = text
+        self.replacements = replacements if replacements is not None else dict()
+        self.skip = skip if skip is not None else set()
+        self.space_count = space_count
+
+
+FB2_FORMAT = XmlTextFormat(None,
+                           paragraphs={'p', 'v', 'subtitle', 'text-author'},
+                           replacements={'empty-line': '\n'},
+                           skip={'description', 'binary', 'image'})
+
+DOCX_FORMAT = XmlTextFormat('word/document.xml',
+                            paragraphs={'p'},
+                            text={'t'},
+                            replacements={'tab': '\t', 'br': '\n', 'cr': '\n'},
+                            skip={'pPr', 'rPr', 'instrText', 'delText'})
+
+ODT_FORMAT = XmlTextFormat('content.xml',
+                           paragraphs={'p', 'h'},
+                           replacements={'tab': '\t', 'line-break': '\n'},
+                           skip={'note', 'annotation', 'tracked-changes'},
+                           space_count=('s', 'c'))
+
+
+def get_local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def get_attribute(element: ET.Element, name: str, default: str) -> str:
+    for k, v in element.attrib.items():
+        if get_local_name(k) == name:
+            return v
+    return default
+
+
+def get_paragraph_text(element: ET.Element, fmt: XmlTextFormat, in_text: bool, out: list[str]):
+    """
+    Collects text of the paragraph element (mixed content) into out.
+    Args:
+        element: Element.
+        fmt: Book format.
+        in_text: True if element is inside text element (or format has no text elements).
+        out: Collected text chunks.
+    """
+    name = get_local_name(element.tag)
+    if name in fmt.skip:
+        return
+
+    if name in fmt.replacements:
+        out.append(fmt.replacements[name])
+    elif fmt.space_count is not None and name == fmt.space_count[0]:
+        out.append(' ' * int(get_attribute(element, fmt.space_count[1], '1')))
+    else:
+        in_text = in_text or (fmt.text is not None and name in fmt.text)
+        if in_text and element.text:
+            out.append(element.text)
+        for child in element:
+            get_paragraph_text(child, fmt, in_text, out)
+            if in_text and child.tail:
+                out.append(child.tail)
+
+
+def clear_element(element: ET.Element):
+    # Tail belongs to the parent paragraph, it may be already parsed.
+    tail = element.tail
+    element.clear()
+    element.tail = tail
+
+
+def get_xml_text(stream: BinaryIO, fmt: XmlTextFormat, max_len: int) -> str:
+    """
+    Streams XML document and collects text of the paragraphs until max_len characters are collected, the rest of the
+    document is not parsed.
+    Args:
+        stream: XML document.
+        fmt: Book format.
+        max_len: Number of characters to collect, 0 - no limit.
+
+    Returns: Text, paragraphs are separated by new lines.
+    Raises ET.ParseError if document is malformed.
+    """
+    result = list()
+    length = 0
+    skip_depth = 0
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        name = get_local_name(element.tag)
+        if name in fmt.skip:
+            skip_depth += 1 if event == 'start' else -1
+            if event == 'end':
+                clear_element(element)
+            continue
+
+        if event != 'end' or skip_depth > 0 or name not in fmt.paragraphs:
+            continue
+
+        chunks = list()
+        get_paragraph_text(element, fmt, fmt.text is None, chunks)
+        # Nested paragraphs (text boxes, notes) are cleared when collected, so they are not collected twice.
+        clear_element(element)
+        paragraph = ''.join(chunks).strip()
+        if paragraph:
+            result.append(paragraph)
+            length += len(paragraph) + 1
+            if 0 < max_len <= length:
+                break
+
+    return '\n'.join(result)
+
+
+def get_book_xml_text(file_name: str, fmt: XmlTextFormat, max_len: int) -> str:
+    """
+    Extracts text of the book in XML based format (the document may be a zip member).
+    Raises ET.ParseError, zipfile.BadZipFile, KeyError (no document in zip) or OSError if book can't be read.
+    """
+    if fmt.member is None:
+        with open(file_name, 'rb') as f:
+            return get_xml_text(f, fmt, max_len)
+
+    with zipfile.ZipFile(file_name) as z:
+        with z.open(fmt.member) as f:
+            return get_xml_text(f, fmt, max_len)
@@ -1,6 +1,6 @@
 #!/bin/bash
 SCRIPT_PATH=$(dirname "$(realpath $0)")
 pushd $SCRIPT_PATH > /dev/null
-./.venv/bin/python main.py "${1}"
+./.venv/bin/python main.py "$@"
 popd > /dev/null
 
@@ -0,0 +1,138 @@
+"""
+    Copyright 2025 Oleh Sharuda <oleh.sharuda@gmail.com>
+
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+ """
+import concurrent.futures
+import glob
+import multiprocessing
+import os
+import shutil
+import signal
+from processors.proc_base import BookInfo, BookFileType
+from processors.processors import init_book_processors
+
+# Worker process state. Every worker process has its own processors and its own scratch directory.
+worker_processors = None
+worker_book_info = None
+
+
+def get_worker_scratch_dir(temp_dir: str, pid) -> str:
+    return os.path.join(temp_dir, f'worker_{pid}')
+
+
+def on_worker_book(file_name: str, info: BookInfo):
+    global worker_book_info
+    worker_book_info = info
+
+
+def on_worker_bad_book(file_name: str, message: str):
+    raise RuntimeError(message)
+
+
+def init_worker(temp_dir: str, lang_opt: str, delete_artifacts: bool):
+    """
+    Worker process initializer.
+    Args:
+        temp_dir: Temporary directory (RAM drive). Worker creates its own scratch directory inside it.
+        lang_opt: Language option
+        delete_artifacts: If true all temporary and intermediate files will be deleted.
+    """
+    global worker_processors
+
+    # Ctrl-C is handled by the main process (Terminator), workers must not be interrupted.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    scratch_dir = get_worker_scratch_dir(temp_dir, os.getpid())
+    if os.path.isdir(scratch_dir):
+        shutil.rmtree(scratch_dir)
+    os.makedirs(scratch_dir)
+
+    worker_processors = init_book_processors(scratch_dir, lang_opt, delete_artifacts, on_worker_book, on_worker_bad_book)
+
+
+def process_book(file_name: str, file_hash: str, bft: BookFileType) -> tuple[BookInfo, str]:
+    """
+    Processes a single book in the worker process.
+    Args:
+        file_name: Book file name (real file system name).
+        file_hash: Book hash.
+        bft: Book type.
+
+    Returns: tuple (book information, error message). Book information is None if book is bad.
+    """
+    global worker_book_info
+    worker_book_info = None
+    try:
+        worker_processors[bft].process_file(file_name, file_hash)
+    except RuntimeError as e:
+        return None, str(e)
+
+    if worker_book_info is None:
+        return None, f'Processor returned no book information for {file_name}'
+
+    return worker_book_info, ''
+
+
+def extract_book_text(file_name: str, bft: BookFileType, page_count: int, allow_ocr: bool) -> tuple[str, bool, str, str]:
+    """
+    Extracts text of a single book in the worker process (OCR pass, deepen pass).
+    Args:
+        file_name: Book file name (real file system name).
+        bft: Book type.
+        page_count: Number of pages.
+        allow_ocr: See Book_PROC.extract_text().
+
+    Returns: tuple (text, True if OCR was used, full text, error message). Text is None if book failed.
+    """
+    try:
+        text, ocr, ocr_pending, full = worker_processors[bft].extract_text(file_name, page_count, allow_ocr=allow_ocr)
+    except RuntimeError as e:
+        return None, False, None, str(e)
+
+    return text, ocr, full, ''
+
+
+class ScanPool:
+    """
+    Pool of worker processes running book processors. Archives are still unpacked by the scanner (main process),
+    database is never accessed by workers: results are returned to the scanner.
+    """
+    def __init__(self, jobs: int, temp_dir: str, lang_opt: str, delete_artifacts: bool):
+        self.jobs = jobs
+        self.max_pending = jobs * 2
+        self.temp_dir = temp_dir
+        self.delete_artifacts = delete_artifacts
+
+        # Linux only: workers are forked, so they inherit logger instance.
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                               mp_context=multiprocessing.get_context('fork'),
+                                                               initializer=init_worker,
+                                                               initargs=(temp_dir, lang_opt, delete_artifacts))
+
+        # With fork, all workers are started on the first submit. Do it now, before any other thread is started.
+        self.executor.submit(os.getpid).result()
+
+    def submit(self, file_name: str, file_hash: str, bft: BookFileType) -> concurrent.futures.Future:
+        return self.executor.submit(process_book, file_name, file_hash, bft)
+
+    def submit_text(self, file_name: str, bft: BookFileType, page_count: int, allow_ocr: bool) -> concurrent.futures.Future:
+        return self.executor.submit(extract_book_text, file_name, bft, page_count, allow_ocr)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+        if self.delete_artifacts:
+            for scratch_dir in glob.glob(get_worker_scratch_dir(self.temp_dir, '*')):
+                shutil.rmtree(scratch_dir)
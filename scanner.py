@@ -15,24 +15,48 @@
     limitations under the License.
  """
 import os.path
+import concurrent.futures
 
 from database import *
+from processors import languages, ocr_cache, proc_base
 from processors.proc_base import get_book_type, BookInfo, BookFileType, book_archive_types
 from processors.processors import init_processors
+from scan_pool import ScanPool
+from ocr_pass import format_full_text_stats
+from scratch_space import ScratchSpace
 from terminator import Terminator
-from tools import get_file_hash, test_unicode_string, scan_directory
+from tools import get_file_hash, test_unicode_string, scan_directory, HashPrefetcher
 from logger import Logger
 
 
 class Scanner:
+    # Number of archive members written to the database at once.
+    member_batch_size = 1000
+
     def __init__(self,
                  library_path: str,
                  ram_drive_path:str,
                  language_option: str,
-                 delete_artifacts: bool):
+                 delete_artifacts: bool,
+                 jobs: int = 1,
+                 hash_workers: int = 0,
+                 scratch_path: str = '',
+                 ram_drive_reserve: int = 0):
         self.archive_stack = list()
+        self.archive_members = list()
+        self.current_directory = None
         self.current_logical_path = ''
         self.db = BooKeeperDB()
+        self.db_writer = None
+        self.jobs = jobs
+        self.pool = None
+        self.pending_jobs = list()
+        self.hash_workers = hash_workers
+        self.prefetcher = None
+        self.prefetched_dirs = set()
+        self.hashed_files = 0
+        self.stat_hits = 0
+        self.avoided_hashes = 0
         self.logger = Logger()
         self.terminator = None
         self.ram_drive_path = ram_drive_path
@@ -40,6 +64,7 @@ class Scanner:
         self.library_path = library_path
         self.delete_artifacts = delete_artifacts
         self.new_prefix = '[⚡] '
+        self.scratch_space = ScratchSpace(ram_drive_path, scratch_path, ram_drive_reserve, on_wait=self.wait_for_job)
         self.processor_map = init_processors(
             temp_dir=self.ram_drive_path,
             lang_opt=self.language_option,
@@ -49,7 +74,9 @@ class Scanner:
             on_archive_enter=self.on_archive_enter,
             on_archive_leave=self.on_archive_leave,
             on_bad_book_callback=self.on_bad_book,
-            on_bad_archive_callback=self.on_bad_archive)
+            on_bad_archive_callback=self.on_bad_archive,
+            on_archive_member=self.on_archive_member,
+            scratch_space=self.scratch_space)
         pass
 
 
@@ -58,9 +85,187 @@ class Scanner:
         Run library scan
         """
         self.terminator = Terminator()
-        self.db.prepare_scan()
+        if self.jobs > 1:
+            # Pool must be created before writer thread, workers are forked.
+            self.pool = ScanPool(self.jobs, self.ram_drive_path, self.language_option, self.delete_artifacts)
+        self.db_writer = BooKeeperDBWriter(self.db, threaded=self.pool is not None)
+        self.prefetcher = HashPrefetcher(self.hash_workers, self.hash_workers * 2, self.is_hash_required)
+        self.prefetched_dirs = set()
+        self.terminator.add_exit_handler(self.stop_workers)
+
+        ocr_cache_start = ocr_cache.ocr_cache.get_stats() if ocr_cache.ocr_cache is not None else None
+        self.db_writer.call(self.db.prepare_scan, self.library_path)
+        self.db_writer.call(self.db.begin_batch)
         scan_directory(self.library_path, on_file=self.on_scan_file)
-        self.db.post_scan()
+        self.collect_jobs(0)
+        self.db_writer.call(self.db.end_batch)
+        self.db_writer.call(self.db.post_scan)
+        self.logger.print_log(f'{self.hashed_files} files hashed, {self.stat_hits} hashes taken from file stats, '
+                              f'{self.avoided_hashes} full hashes avoided (unique size).')
+        memory_lookups, db_lookups = self.db_writer.call(self.db.get_membership_stats)
+        self.logger.print_log(f'{memory_lookups} file lookups answered from memory, {db_lookups} queried from database.')
+        self.logger.print_log(f'{self.scratch_space.spills} archives extracted to disk scratch directory, '
+                              f'{self.scratch_space.waits} waits for RAM drive space.')
+        if ocr_cache_start is not None:
+            self.logger.print_log(ocr_cache.format_ocr_cache_stats(ocr_cache_start))
+        if proc_base.full_text:
+            self.logger.print_log(format_full_text_stats(*self.db_writer.call(self.db.get_full_text_stats)))
+
+        self.terminator.remove_exit_handler(self.stop_workers)
+        self.stop_workers()
+
+
+    def stop_workers(self):
+        """
+        Stops worker processes and database writer thread (if any). All posted database requests are executed.
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+            self.prefetcher = None
+
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            self.pending_jobs.clear()
+
+        if self.db_writer is not None:
+            self.flush_archive_members()
+            self.db_writer.stop()
+            self.db_writer = None
+
+
+    def prefetch_directory(self, file_name: str):
+        """
+        Schedules hashing of the directory files ahead of their scan once scan enters the directory of the file, and
+        moves prefetcher past the file being scanned.
+        """
+        if self.hash_workers <= 0:
+            return
+
+        path = os.path.dirname(file_name)
+        if path not in self.prefetched_dirs:
+            self.prefetched_dirs.add(path)
+            # Hidden files are skipped the same way scan_directory() does.
+            with os.scandir(path) as it:
+                self.prefetcher.schedule([e.path for e in it if not e.name.startswith('.') and e.is_file()])
+        self.prefetcher.advance(file_name)
+
+
+    def is_hash_required(self, file_name: str) -> bool:
+        """
+        Predicate for hash prefetcher: checks if file is going to be hashed by the scan.
+        Files extracted from archives are always hashed (archive is extracted only if it is not scanned yet), library
+        files are hashed unless they are already scanned or their stat signature is known. Other files (not books) are
+        hashed only if there are other files of the same size.
+        """
+        file_name = os.path.abspath(file_name)
+        bft = get_book_type(file_name)
+        if bft == BookFileType.NONE and not self.db_writer.call(self.db.is_size_known, os.path.getsize(file_name)):
+            return False
+
+        for afn, ep, h in self.archive_stack:
+            if file_name.startswith(os.path.join(ep, '')):
+                return True
+
+        if bft == BookFileType.NONE:
+            known = self.db_writer.call(self.db.get_other_file, file_name) is not None
+        elif bft in book_archive_types:
+            known = self.db_writer.call(self.db.is_scanned_archive, file_name)
+        else:
+            known = self.db_writer.call(self.db.is_scanned_book, file_name)
+        if known:
+            return False
+
+        st = os.stat(file_name)
+        recorded = self.db_writer.call(self.db.get_file_stat, file_name)
+        return recorded is None or tuple(recorded[:4]) != (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+    def submit_book(self,
+                    file_name: str,
+                    file_hash: str,
+                    bft: BookFileType,
+                    on_release: Callable[[str], None]):
+        """
+        Submits book to the worker pool. Result is written to the database by database writer thread.
+        Args:
+            file_name: Book file name (real file system name).
+            file_hash: Book hash.
+            bft: Book type.
+            on_release: Callback to be called once book is processed, or None.
+        """
+        if len(self.pending_jobs) >= self.pool.max_pending:
+            self.collect_jobs(0, self.pool.max_pending - 1)
+
+        lfn = self.get_logical_name(file_name)
+        parent_arch_hash = self.get_parent_archive_hash()
+        future = self.pool.submit(file_name, file_hash, bft)
+        self.pending_jobs.append((future,
+                                  len(self.archive_stack),
+                                  file_name,
+                                  on_release,
+                                  (lfn, file_hash, bft, parent_arch_hash)))
+
+
+    def collect_jobs(self, depth: int, max_pending: int = 0):
+        """
+        Waits for worker jobs and passes their results to the database writer.
+        Args:
+            depth: Only jobs submitted at this archive depth or deeper are waited for.
+            max_pending: Wait until no more than max_pending jobs (at the given depth) are left.
+        """
+        while True:
+            still_pending = list()
+            waited = list()
+            for job in self.pending_jobs:
+                future, job_depth, file_name, on_release, job_args = job
+                if future.done():
+                    if on_release is not None:
+                        on_release(file_name)
+                    self.db_writer.post(self.on_book_job_done, future, *job_args)
+                else:
+                    still_pending.append(job)
+                    if job_depth >= depth:
+                        waited.append(future)
+            self.pending_jobs = still_pending
+
+            if len(waited) <= max_pending:
+                break
+
+            concurrent.futures.wait(waited, return_when=concurrent.futures.FIRST_COMPLETED)
+
+
+    def wait_for_job(self) -> bool:
+        """
+        Scratch space back-pressure: waits for one of the worker jobs to complete, which frees RAM drive space.
+        Returns: False if there are no worker jobs to wait for.
+        """
+        if not self.pending_jobs:
+            return False
+        self.collect_jobs(0, len(self.pending_jobs) - 1)
+        return True
+
+
+    def on_book_job_done(self,
+                         future: concurrent.futures.Future,
+                         lfn: str,
+                         file_hash: str,
+                         bft: BookFileType,
+                         parent_arch_hash: str):
+        """
+        Handles worker job result. Called by database writer.
+        """
+        try:
+            b, message = future.result()
+        except Exception as e:
+            b, message = None, f'Worker failed: {e}'
+
+        if b is not None:
+            b.name = lfn
+            b.language = languages.get_text_language(b.text_data, self.language_option)
+            self.record_book(b, parent_arch_hash)
+        else:
+            self.record_bad_book(lfn, file_hash, bft, parent_arch_hash, message)
 
 
     def update_logical_path(self):
@@ -107,7 +312,7 @@ class Scanner:
         self.logger.print_log(f'{self.new_prefix}ARCH: {arch_file_name}', options=('blue',), linesep='')
         self.logger.print_log(f' ({file_hash})', options=('yellow',))
 
-        self.db.add_new_archive(arch_logical_name, file_size, file_hash, parent_arch_hash, bft)
+        self.db_writer.post(self.db.add_new_archive, arch_logical_name, file_size, file_hash, parent_arch_hash, bft)
         self.update_logical_path()
 
 
@@ -115,6 +320,15 @@ class Scanner:
         """
         Callback to be called every time scanner leaves the archive.
         """
+        # Extracted files are deleted once archive is left, so all books of this archive must be processed.
+        self.collect_jobs(len(self.archive_stack))
+        self.flush_archive_members()
+        self.db_writer.post(self.db.flush)
+        extract_path = self.archive_stack[-1][1]
+        self.prefetcher.discard(extract_path)
+        # Extraction path may be reused by the next archive.
+        self.prefetched_dirs = set(filter(lambda d: d != extract_path and not d.startswith(os.path.join(extract_path, '')),
+                                          self.prefetched_dirs))
         self.archive_stack.pop()
         self.update_logical_path()
 
@@ -145,11 +359,12 @@ class Scanner:
             message: Error message
         """
         lfn = self.get_logical_name(file_name)
-        self.db.add_update_bad_file(lfn,
-                                    get_file_hash(file_name),
-                                    get_book_type(file_name),
-                                    self.get_parent_archive_hash(),
-                                    FileErrorCode.ERROR_BAD_ARCHIVE)
+        self.db_writer.post(self.db.add_update_bad_file,
+                            lfn,
+                            get_file_hash(file_name),
+                            get_book_type(file_name),
+                            self.get_parent_archive_hash(),
+                            FileErrorCode.ERROR_BAD_ARCHIVE)
         self.logger.print_err(f'BAD ARCHIVE: {lfn}')
         self.logger.write_log(message)
 
@@ -162,11 +377,25 @@ class Scanner:
             message: Error message
         """
         lfn = self.get_logical_name(file_name)
-        self.db.add_update_bad_file(lfn,
-                                    get_file_hash(file_name),
-                                    get_book_type(file_name),
-                                    self.get_parent_archive_hash(),
-                                    FileErrorCode.ERROR_BAD_FILE_NAME)
+        self.db_writer.post(self.record_bad_book,
+                            lfn,
+                            get_file_hash(file_name),
+                            get_book_type(file_name),
+                            self.get_parent_archive_hash(),
+                            message)
+
+
+    def record_bad_book(self, lfn: str, file_hash: str, bft: BookFileType, parent_arch_hash: str, message: str):
+        """
+        Writes bad book into the database.
+        Args:
+            lfn: Logical file name.
+            file_hash: Book hash.
+            bft: Book type.
+            parent_arch_hash: Parent archive hash or empty string.
+            message: Error message
+        """
+        self.db.add_update_bad_file(lfn, file_hash, bft, parent_arch_hash, FileErrorCode.ERROR_BAD_FILE_NAME)
         self.logger.print_err(f'BAD BOOK: {lfn}')
         self.logger.write_log(message)
 
@@ -179,37 +408,150 @@ class Scanner:
             b: Book information
         """
         b.name = self.get_logical_name(file_name)
-        parent_arch_hash = self.get_parent_archive_hash()
+        b.language = languages.get_text_language(b.text_data, self.language_option)
+        self.db_writer.post(self.record_book, b, self.get_parent_archive_hash())
+
+
+    def record_book(self, b: BookInfo, parent_arch_hash: str):
+        """
+        Writes book into the database.
+        Args:
+            b: Book information (logical file name is expected in b.name).
+            parent_arch_hash: Parent archive hash or empty string.
+        """
         self.db.add_new_book(b, parent_arch_hash)
         self.logger.print_log(f'{self.new_prefix}BOOK: {b.name}', options=('green',), linesep='')
         self.logger.print_log(f' ({b.hash_value})', options=('yellow',))
 
 
 
+    def hash_file(self, file_name: str, known_hash: str = None) -> str:
+        """
+        Returns file hash. Files of the library (not extracted from archives) are hashed only if their stat signature
+        (device, inode, size, modification time) is not known yet, otherwise hash recorded for this signature is used.
+        Args:
+            file_name: File name (real file system name).
+            known_hash: Hash recorded for this file by the scan which didn't record file stats. Trusted if file stat
+                        signature is not known.
+        Returns: File hash.
+        """
+        if self.archive_stack:
+            self.hashed_files += 1
+            return self.prefetcher.get_file_hash(file_name)
+
+        st = os.stat(file_name)
+        signature = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        file_hash = None
+
+        recorded = self.db_writer.call(self.db.get_file_stat, file_name)
+        if recorded is not None and tuple(recorded[:4]) == signature:
+            self.stat_hits += 1
+            return recorded[4]
+
+        if recorded is None:
+            file_hash = self.db_writer.call(self.db.find_file_stat_hash, *signature)
+            if file_hash is None:
+                file_hash = known_hash
+
+        if file_hash is None:
+            self.hashed_files += 1
+            file_hash = self.prefetcher.get_file_hash(file_name)
+        else:
+            self.stat_hits += 1
+
+        self.db_writer.post(self.db.set_file_stat, file_name, *signature, file_hash)
+        return file_hash
+
+
+    def is_replaced(self, lfn: str, file_name: str, bft: BookFileType) -> bool:
+        """
+        Checks if scanned library file was replaced in place (its content doesn't match the recorded hash anymore).
+        Files extracted from archives are never treated as replaced: archive is replaced as a whole.
+        """
+        if self.archive_stack:
+            return False
+
+        recorded_hash = self.db_writer.call(self.db.get_scanned_file_hash, lfn, bft)
+        return self.hash_file(file_name, recorded_hash) != recorded_hash
+
+
+    def reuse_archive(self, lfn: str, file_hash: str) -> bool:
+        """
+        Adds archive which is already scanned somewhere else by copying its content, so it is not extracted.
+        Args:
+            lfn: Logical name of the archive.
+            file_hash: Archive hash.
+
+        Returns: True if archive content was copied, False if there is no scanned instance of the archive.
+        """
+        src_lfn = self.db_writer.call(self.db.find_archive_file, file_hash, lfn)
+        if src_lfn is None:
+            return False
+
+        self.db_writer.post(self.db.copy_archive_content, src_lfn, lfn, file_hash, self.get_parent_archive_hash())
+        self.logger.print_log(f'{self.new_prefix}ARCH: {lfn}', options=('blue',), linesep='')
+        self.logger.print_log(f' (copy of {src_lfn})', options=('yellow',))
+        return True
+
+
+    def hash_unhashed_other_files(self, size: int):
+        """
+        Other files are not hashed while their size is unique. Once another file of the same size is found, hashes of
+        the library files recorded without hash are filled in. Archive members are left as is: they are not extracted.
+        """
+        for file_id, file_name in self.db_writer.call(self.db.get_unhashed_other_files, size):
+            if not os.path.isfile(file_name):
+                continue
+            self.hashed_files += 1
+            self.db_writer.post(self.db.set_other_file_hash, file_id, get_file_hash(file_name))
+
+
     def check_and_process_existing(self, lfn: str, file_name: str, bft: BookFileType):
         if bft==BookFileType.NONE:
-            file_id, new_file = self.db.add_get_other_file(lfn, file_name, os.path.getsize(file_name))
+            size = os.path.getsize(file_name)
+            recorded = self.db_writer.call(self.db.get_other_file, lfn)
+            if recorded is not None and (self.archive_stack or (recorded[2] is None and recorded[1] == size)):
+                file_hash = recorded[2]
+            elif recorded is not None and recorded[2] is not None:
+                file_hash = self.hash_file(file_name, recorded[2])
+            elif self.db_writer.call(self.db.is_size_known, size):
+                file_hash = self.hash_file(file_name)
+                self.hash_unhashed_other_files(size)
+            else:
+                # Nothing to compare with, hash is not required.
+                self.avoided_hashes += 1
+                file_hash = None
+
+            file_id, new_file = self.db_writer.call(self.db.add_get_other_file, lfn, size, file_hash)
             if new_file:
                 self.logger.print_diagnostic(f'{self.new_prefix}OTHER: {lfn}', options=('dark_grey', None, ['dark']))
             else:
                 self.logger.print_diagnostic(f'OTHER: {lfn}', options=('dark_grey',None,['dark']))
             return
 
-        if self.db.is_bad_file(lfn):
+        if self.db_writer.call(self.db.is_bad_file, lfn):
             return True
 
         if bft in book_archive_types:
-            res = self.db.is_scanned_archive(lfn)
+            res = self.db_writer.call(self.db.is_scanned_archive, lfn)
             if not res:
                 return False
-            self.db.mark_archive_as_existent(lfn)
+            if self.is_replaced(lfn, file_name, bft):
+                self.logger.print_log(f'REPLACED ARCH: {lfn}', options=('yellow',))
+                self.db_writer.post(self.db.forget_scanned_file, lfn, bft)
+                return False
+            self.db_writer.post(self.db.mark_archive_as_existent, lfn)
             self.logger.print_log(f'ARCH: {lfn}', options=('dark_grey',None,['dark']))
 
         else:
-            res = self.db.is_scanned_book(lfn)
+            res = self.db_writer.call(self.db.is_scanned_book, lfn)
             if not res:
                 return False
-            self.db.mark_book_as_existent(lfn)
+            if self.is_replaced(lfn, file_name, bft):
+                self.logger.print_log(f'REPLACED BOOK: {lfn}', options=('yellow',))
+                self.db_writer.post(self.db.forget_scanned_file, lfn, bft)
+                return False
+            self.db_writer.post(self.db.mark_book_as_existent, lfn)
             self.logger.print_log(f'BOOK: {lfn}', options=('dark_grey', None, ['dark']))
         return res
 
@@ -219,43 +561,116 @@ class Scanner:
         Callback to be called every time scanner encounters some file.
         Args:
             file_name: Book file name (real file system name).
-            scan_param: Scan parameter - unused here
+            scan_param: Scan parameter - if callable, it is called with file name once file is not needed anymore
+                        (archive processor deletes extracted archive members this way).
+        """
+        on_release = scan_param if callable(scan_param) else None
+        self.prefetch_directory(file_name)
+        if not self.scan_file(file_name, on_release) and on_release is not None:
+            on_release(file_name)
+
+
+    def on_archive_member(self, file_name: str, size: int, crc: str):
+        """
+        Callback to be called for every archive member which is not a book (it is not extracted).
+        Args:
+            file_name: File name the member would have being extracted (real file system name).
+            size: Member size.
+            crc: Member CRC from the archive listing (None if not available).
+        """
+        self.terminator.check_exit()
+        lfn = self.get_logical_name(os.path.abspath(file_name))
+        res, mod_lfn = test_unicode_string(lfn)
+        if not res:
+            self.logger.print_err(f'BAD FILE NAME: {mod_lfn}')
+            return
+
+        # Members are written in bulk, nothing is looked up for them until archive is left.
+        self.archive_members.append((lfn, size, crc))
+        if len(self.archive_members) >= self.member_batch_size:
+            self.flush_archive_members()
+
+
+    def flush_archive_members(self):
+        """
+        Passes archive members collected by on_archive_member() to the database writer.
+        """
+        if self.archive_members:
+            self.db_writer.post(self.record_archive_members, self.archive_members)
+            self.archive_members = list()
+
+
+    def record_archive_members(self, members: list[tuple[str, int, str]]):
+        """
+        Writes archive members into the database.
+        Args:
+            members: List of tuples (logical file name, size, CRC or None).
+        """
+        new_files = self.db.add_other_files(members)
+        for (lfn, size, crc), new_file in zip(members, new_files):
+            prefix = self.new_prefix if new_file else ''
+            self.logger.print_diagnostic(f'{prefix}OTHER: {lfn}', options=('dark_grey', None, ['dark']))
+
+
+    def scan_file(self, file_name: str, on_release: Callable[[str], None]) -> bool:
+        """
+        Scans a file.
+        Args:
+            file_name: Book file name (real file system name).
+            on_release: Callback to be called once file is not needed anymore, or None.
+
+        Returns: True if file was passed to the worker pool (on_release is called once it is processed), False if
+        file was scanned completely.
         """
         self.terminator.check_exit()
         file_name = os.path.abspath(file_name)
         bft = get_book_type(file_name)
         lfn = self.get_logical_name(file_name)
 
+        # Changes are committed per library directory (see BooKeeperDB.begin_batch()).
+        if not self.archive_stack and os.path.dirname(file_name) != self.current_directory:
+            self.current_directory = os.path.dirname(file_name)
+            self.db_writer.post(self.db.flush)
+
         # Test if file name is utf-8, and we use it further.
         # Beware: some archives may produce non utf-8 names, which may not be handled.
         res, mod_lfn = test_unicode_string(lfn)
         if not res:
             self.logger.print_err(f'BAD FILE NAME: {mod_lfn}')
             file_hash = get_file_hash(file_name)
-            self.db.add_update_bad_file(mod_lfn,
-                                        file_hash,
-                                        bft,
-                                        self.get_parent_archive_hash(),
-                                        FileErrorCode.ERROR_BAD_BOOK)
-            return
+            self.db_writer.post(self.db.add_update_bad_file,
+                                mod_lfn,
+                                file_hash,
+                                bft,
+                                self.get_parent_archive_hash(),
+                                FileErrorCode.ERROR_BAD_BOOK)
+            return False
 
         if self.check_and_process_existing(lfn, file_name, bft):
-            return
+            return False
 
         if bft == BookFileType.NONE:
-            return
+            return False
 
         self.logger.print_diagnostic(f'SCAN LFN:  {lfn}')
         self.logger.print_diagnostic(f'SCAN FILE: {file_name}')
 
-        file_hash = get_file_hash(file_name)
-        if self.db.is_processed_file(file_hash, bft) and bft not in book_archive_types:
+        file_hash = self.hash_file(file_name)
+        is_processed = self.db_writer.call(self.db.is_processed_file, file_hash, bft)
+        if is_processed and bft not in book_archive_types:
             parent_arch_hash = self.get_parent_archive_hash()
             self.logger.print_log(f'BOOK: {lfn}', options=('green', None, ['dark']))
-            self.db.add_existing_book(lfn, file_hash, parent_arch_hash)
+            self.db_writer.post(self.db.add_existing_book, lfn, file_hash, parent_arch_hash)
+        elif is_processed and self.reuse_archive(lfn, file_hash):
+            pass
+        elif self.pool is not None and bft not in book_archive_types:
+            self.submit_book(file_name, file_hash, bft, on_release)
+            return True
         else:
             bp = self.processor_map[bft]
             try:
                 bp.process_file(file_name, file_hash)
             except RuntimeError as e:
                 bp.on_bad_callback(file_name, str(e))
+
+        return False
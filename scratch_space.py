@@ -0,0 +1,111 @@
+"""
+    Copyright 2025 Oleh Sharuda <oleh.sharuda@gmail.com>
+
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+ """
+import os
+import shutil
+import threading
+from typing import Callable
+from logger import Logger
+
+
+class ScratchSpace:
+    """
+    Scratch space for archive extraction. Extraction directories are created on RAM drive while extracted data fits
+    into RAM drive budget, otherwise they are created in on-disk scratch directory (spill).
+    """
+    def __init__(self,
+                 ram_drive_path: str,
+                 disk_scratch_path: str,
+                 ram_drive_reserve: int,
+                 on_wait: Callable[[None], bool] = None):
+        """
+        Args:
+            ram_drive_path: RAM drive path.
+            disk_scratch_path: On-disk scratch directory, empty string if spilling is disabled.
+            ram_drive_reserve: Space (bytes) to be kept free on RAM drive.
+            on_wait: Back-pressure callback, it is called when reservation doesn't fit into RAM drive. It should wait
+                     for some RAM drive space to be freed (i.e. for some worker job) and return True, or return False if
+                     there is nothing to wait for.
+        """
+        self.logger = Logger()
+        self.lock = threading.Lock()
+        self.ram_drive_path = ram_drive_path
+        self.disk_scratch_path = disk_scratch_path
+        self.ram_drive_reserve = ram_drive_reserve
+        self.on_wait = on_wait
+        self.budget = shutil.disk_usage(ram_drive_path).free - ram_drive_reserve
+        self.reserved = 0
+        self.reservations = dict()
+        self.spills = 0
+        self.waits = 0
+
+        if disk_scratch_path:
+            os.makedirs(disk_scratch_path, exist_ok=True)
+
+    def get_ram_available(self) -> int:
+        # Budget doesn't account files written by worker processes, actual free space does.
+        free = shutil.disk_usage(self.ram_drive_path).free - self.ram_drive_reserve
+        return min(self.budget - self.reserved, free)
+
+    def try_reserve(self, size: int) -> bool:
+        with self.lock:
+            if size > self.get_ram_available():
+                return False
+            self.reserved += size
+            return True
+
+    def allocate_dir(self, name: str, size: int, description: str) -> str:
+        """
+        Creates scratch directory for extraction of the given amount of data.
+        Args:
+            name: Directory name.
+            size: Amount of data (bytes) to be extracted into directory.
+            description: What is extracted (for logging).
+
+        Returns: Directory path.
+        """
+        on_ram = self.try_reserve(size)
+        while not on_ram and self.on_wait is not None and self.on_wait():
+            self.waits += 1
+            on_ram = self.try_reserve(size)
+
+        if on_ram:
+            root = self.ram_drive_path
+        elif self.disk_scratch_path:
+            root = self.disk_scratch_path
+            self.spills += 1
+            self.logger.print_log(f'SPILL: {description} ({size} bytes) is extracted to {self.disk_scratch_path}')
+        else:
+            root = self.ram_drive_path
+            self.logger.print_warn(f'RAM drive may overflow: {description} ({size} bytes), scratch directory '
+                                   f'is not configured.')
+
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+        with self.lock:
+            self.reservations[path] = size if on_ram else 0
+        return path
+
+    def free_dir(self, path: str):
+        """
+        Removes scratch directory and releases its reservation.
+        """
+        shutil.rmtree(path, ignore_errors=True)
+        with self.lock:
+            self.reserved -= self.reservations.pop(path, 0)
@@ -49,15 +49,27 @@ class Terminator(object):
         self.logger = Logger()
         self.db = BooKeeperDB()
         self.exit_requested = False
+        self.exit_handlers = list()
         self.old_handler = signal.getsignal(signal.SIGINT)
         signal.signal(signal.SIGINT, Terminator.terminator_signal_handler)
         self.logger.print_diagnostic('Terminator created.', console_only=True)
 
 
+    def add_exit_handler(self, handler: Callable[[], None]):
+        self.exit_handlers.append(handler)
+
+
+    def remove_exit_handler(self, handler: Callable[[], None]):
+        if handler in self.exit_handlers:
+            self.exit_handlers.remove(handler)
+
+
     def check_exit(self):
         while self.exit_requested:
             reply = input('Are you sure to exit? [Y/N] : ')
             if reply.lower() == 'y':
+                for handler in self.exit_handlers:
+                    handler()
                 self.db.finalize()
                 self.logger.print_log('Program terminated due to user request. Bye!')
                 quit(0)
@@ -16,14 +16,19 @@
  """
 
 import subprocess
+import selectors
 from typing import *
 import os
 import fcntl
 import re
 import glob
 import hashlib
+import mmap
+import collections
+import concurrent.futures
 import signal
 import shutil
+import threading
 
 
 def set_nonblock_io(f):
@@ -31,26 +36,100 @@ def set_nonblock_io(f):
     return fcntl.fcntl(f, fcntl.F_SETFL, flags | os.O_NONBLOCK)
 
 
-def read_stdout_lines(proc: subprocess.Popen, print_data: False) -> str:
-    result = str()
-    for line in iter(proc.stdout.readline, b''):
-        l = line.rstrip().decode("UTF-8", errors='replace')
-        result += l + os.linesep
-    if print_data:
-        print(result)
-    return result
+def open_pidfd(pid: int):
+    """
+    Returns file descriptor which becomes readable once process exits, or None if it is not supported by the kernel.
+    """
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def kill_process_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class StdoutCollector:
+    """
+    Collects output of the child process, splits it into lines (trailing white spaces are removed).
+    """
+    def __init__(self, print_data: bool, on_stdout: Callable[[str], None], limit: int = 0):
+        """
+        Args:
+            print_data: Print output.
+            on_stdout: Callback to be called with every portion of output.
+            limit: Number of characters to collect, the rest of the output is ignored. 0 - no limit.
+        """
+        self.print_data = print_data
+        self.on_stdout = on_stdout
+        self.limit = limit
+        self.length = 0
+        self.tail = b''
+        self.chunks = list()
+
+    @property
+    def limit_reached(self) -> bool:
+        return self.limit > 0 and self.length >= self.limit
+
+    def feed(self, data: bytes, final: bool = False):
+        if self.limit_reached:
+            return
+        data = self.tail + data
+        lines = data.split(b'\n')
+        self.tail = b'' if final else lines.pop()
+        if final and not lines[-1]:
+            lines.pop()
+        if not lines:
+            return
+
+        s = ''.join(map(lambda l: l.rstrip().decode("UTF-8", errors='replace') + os.linesep, lines))
+        self.chunks.append(s)
+        self.length += len(s)
+        if self.print_data:
+            print(s, end='')
+        if self.on_stdout is not None:
+            self.on_stdout(s)
+
+    def result(self) -> str:
+        res = ''.join(self.chunks)
+        return res[:self.limit] if self.limit_reached else res
 
 
 def run_shell_adv(  params : list,
                     cwd=None,
-                    input: list = None,
+                    input: list | bytes = None,
                     print_stdout = True,
                     envvars : dict = None,
                     on_stdout: Callable[[str], None] = None,
                     on_check_kill: Callable[[None], bool] = None,
                     on_started: Callable[[int], None] = None,
-                    on_stopped: Callable[[None], None] = None) -> tuple:
-    stdout_accum = ""
+                    on_stopped: Callable[[None], None] = None,
+                    kill_check_interval: float = 0.5,
+                    output_limit: int = 0) -> tuple:
+    """
+    Runs child process and waits for its completion. Waiting is event driven: function returns as soon as child exits
+    (pidfd is used if available, otherwise end of stdout), output is passed to on_stdout as soon as it is read.
+    Args:
+        params: Command line.
+        cwd: Working directory.
+        input: List of lines written into child's stdin, or bytes written into child's stdin as is.
+        print_stdout: Print child's output.
+        envvars: Additional environment variables.
+        on_stdout: Callback to be called with every portion of child's output.
+        on_check_kill: Callback to be called periodically (every kill_check_interval seconds and on every output),
+                       child process group is killed if it returns True.
+        on_started: Callback to be called with child pid once it is started.
+        on_stopped: Callback to be called once child is stopped.
+        kill_check_interval: Interval (seconds) of on_check_kill calls.
+        output_limit: Number of output characters required (0 - no limit). Child process group is killed as soon as
+                      they are collected, so the rest of output is never produced. Run is successful in this case.
+
+    Returns: tuple (success, return code, output)
+    """
     env_vars = os.environ.copy()
     if envvars:
         env_vars = {**env_vars, **envvars}
@@ -61,43 +140,92 @@ def run_shell_adv(  params : list,
         env=env_vars,
         preexec_fn=os.setpgrp)
 
-    if input:
-        data = os.linesep.join(map(str, input))
-        ba = data.encode("UTF-8")
-        proc.stdin.write(ba)
-
-    proc.stdin.flush()
-    proc.stdin.close()
-
-    set_nonblock_io(proc.stdout)
-
     if on_started:
         on_started(proc.pid)
 
-    while proc.poll() is None:
-        s = read_stdout_lines(proc, print_data=print_stdout)
-        stdout_accum += s
-        if s and on_stdout is not None:
-            on_stdout(s)
-
+    collector = StdoutCollector(print_stdout, on_stdout, output_limit)
+    stdin_data = b''
+    if isinstance(input, bytes):
+        stdin_data = input
+    elif input:
+        stdin_data = os.linesep.join(map(str, input)).encode("UTF-8")
 
-        if on_check_kill is not None and on_check_kill() is True:
-            os.killpg(proc.pid, signal.SIGKILL)
-
-        try:
-            proc.wait(timeout=0.5)
-        except subprocess.TimeoutExpired:
-            pass
-
-    s = read_stdout_lines(proc, print_data=print_stdout)
-    stdout_accum += s
-    if s and on_stdout is not None:
-        on_stdout(s)
+    stdout_fd = proc.stdout.fileno()
+    stdin_fd = proc.stdin.fileno()
+    set_nonblock_io(proc.stdout)
+    pidfd = open_pidfd(proc.pid)
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(stdout_fd, selectors.EVENT_READ)
+        if pidfd is not None:
+            selector.register(pidfd, selectors.EVENT_READ)
+        if stdin_data:
+            set_nonblock_io(proc.stdin)
+            selector.register(stdin_fd, selectors.EVENT_WRITE)
+        else:
+            proc.stdin.close()
+
+        timeout = kill_check_interval if on_check_kill is not None else None
+        stdout_open = True
+        limited = False     # Child was killed because output limit is reached.
+        while stdout_open:
+            for key, events in selector.select(timeout):
+                if key.fd == stdin_fd:
+                    try:
+                        # Non-blocking write takes as much as pipe can hold, memoryview avoids copying the rest.
+                        written = os.write(stdin_fd, stdin_data)
+                        stdin_data = memoryview(stdin_data)[written:]
+                    except BrokenPipeError:
+                        stdin_data = b''
+
+                    if not stdin_data:
+                        selector.unregister(stdin_fd)
+                        proc.stdin.close()
+
+                elif key.fd == stdout_fd:
+                    try:
+                        data = os.read(stdout_fd, 65536)
+                    except BlockingIOError:
+                        # Pipe was already drained (child exit is handled in the same batch of events).
+                        continue
+                    if data:
+                        collector.feed(data)
+                    else:
+                        stdout_open = False
+
+                    if data and collector.limit_reached:
+                        limited = True
+                        kill_process_group(proc.pid)
+                        stdout_open = False
+                        break
+
+                elif key.fd == pidfd:
+                    # Child exited: take what is left in the pipe, don't wait for EOF (grandchildren may hold it).
+                    try:
+                        while data := os.read(stdout_fd, 65536):
+                            collector.feed(data)
+                    except BlockingIOError:
+                        pass
+                    stdout_open = False
+                    break
+
+            if stdout_open and on_check_kill is not None and on_check_kill() is True:
+                os.killpg(proc.pid, signal.SIGKILL)
+
+    if pidfd is not None:
+        os.close(pidfd)
+    if not proc.stdin.closed:
+        proc.stdin.close()
+    proc.stdout.close()
+    proc.wait()
+    collector.feed(b'', final=True)
 
     if on_stopped:
         on_stopped()
 
-    return (proc.returncode==0, proc.returncode, stdout_accum)
+    # Child which exited by itself before it was killed reports its own result.
+    limited = limited and proc.returncode == -signal.SIGKILL
+    return (proc.returncode==0 or limited, proc.returncode, collector.result())
 
 
 def is_ramdrive_mounted(path: str) -> bool:
@@ -133,11 +261,149 @@ def scan_directory( search_dir: str,
     pass
 
 
+hash_buffer_size = 1024 * 1024
+hash_use_mmap = False
+
+
+def configure_file_hash(buffer_size: int, use_mmap: bool):
+    """
+    Sets options used by get_file_hash().
+    Args:
+        buffer_size: Size of the chunk file is read (or hashed when mapped into memory) by.
+        use_mmap: Map file into memory instead of reading it.
+    """
+    global hash_buffer_size, hash_use_mmap
+    hash_buffer_size = max(buffer_size, 4096)
+    hash_use_mmap = use_mmap
+
+
 def get_file_hash(file_name: str) -> hash:
-    h = hashlib.md5(open(file_name,'rb').read())
+    """
+    Calculates MD5 hash of the file. File is streamed by chunks of hash_buffer_size bytes, so memory usage doesn't
+    depend on file size.
+    """
+    h = hashlib.md5()
+    with open(file_name, 'rb') as f:
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        if hash_use_mmap and size > 0:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as m:
+                m.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(m) as mv:
+                    for offset in range(0, size, hash_buffer_size):
+                        h.update(mv[offset:offset + hash_buffer_size])
+        else:
+            buffer = bytearray(hash_buffer_size)
+            with memoryview(buffer) as mv:
+                while n := f.readinto(buffer):
+                    h.update(mv[:n])
+
     return h.hexdigest()
 
 
+class HashPrefetcher:
+    """
+    Hashes upcoming files in a thread pool ahead of their processing (hashlib releases GIL while hashing).
+    Files are hashed in the order they are scheduled, files scheduled later are hashed first (files of the nested
+    archive are scanned before the rest of the parent archive).
+    """
+    def __init__(self, workers: int, depth: int, predicate: Callable[[str], bool] = None):
+        """
+        Args:
+            workers: Number of hashing threads. If zero, files are hashed on request only.
+            depth: Maximum number of files being hashed ahead. Also maximum number of queued files checked by the
+                   predicate at once, so lookahead is bounded even if predicate rejects most of the files.
+            predicate: Callback to be called for every scheduled file before it is hashed, file is skipped if it
+                       returns False.
+        """
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                              thread_name_prefix='HashPrefetcher') if workers > 0 else None
+        self.depth = depth
+        self.predicate = predicate
+        self.queued = collections.deque()
+        self.queued_names = set()   # Files in the queue, names removed from this set are skipped once popped.
+        self.futures = dict()       # Files hashed (or being hashed) ahead, until scan requests or passes them.
+        self.running = 0            # Hashing jobs not done yet, decremented by on_job_done().
+        self.running_lock = threading.Lock()
+        self.current = None         # File being scanned (see advance()).
+
+    def schedule(self, file_names: list[str]):
+        if self.executor is None:
+            return
+        file_names = [fn for fn in file_names if fn not in self.queued_names and fn not in self.futures]
+        self.queued_names.update(file_names)
+        self.queued.extendleft(reversed(file_names))
+        self.fill()
+
+    def fill(self):
+        checked = 0
+        while self.queued and self.running < self.depth and checked < self.depth:
+            fn = self.queued.popleft()
+            if fn not in self.queued_names:
+                continue
+            self.queued_names.discard(fn)
+            checked += 1
+            if fn in self.futures or (self.predicate is not None and not self.predicate(fn)):
+                continue
+            with self.running_lock:
+                self.running += 1
+            self.futures[fn] = self.executor.submit(get_file_hash, fn)
+            self.futures[fn].add_done_callback(self.on_job_done)
+
+    def on_job_done(self, future: concurrent.futures.Future):
+        # Called by hashing thread once job is done or cancelled (or by the caller if it is done already).
+        with self.running_lock:
+            self.running -= 1
+
+    def advance(self, file_name: str):
+        """
+        Called once file is going to be scanned: it is not hashed ahead anymore, lookahead moves on. Scan has passed the
+        previous file, so its hash is forgotten if it was not requested (i.e. file is known to be bad).
+        """
+        if self.executor is None:
+            return
+        if self.current is not None:
+            future = self.futures.pop(self.current, None)
+            if future is not None:
+                future.cancel()
+        self.current = file_name
+        self.queued_names.discard(file_name)
+        self.fill()
+
+    def get_file_hash(self, file_name: str) -> str:
+        future = self.futures.pop(file_name, None)
+        if future is None:
+            self.queued_names.discard(file_name)
+            file_hash = get_file_hash(file_name)
+        else:
+            file_hash = future.result()
+
+        if self.executor is not None:
+            self.fill()
+        return file_hash
+
+    def discard(self, path: str):
+        """
+        Forgets all files located in the path (for example, extracted files which are going to be removed).
+        """
+        prefix = os.path.join(path, '')
+        self.queued = collections.deque(filter(lambda fn: not fn.startswith(prefix), self.queued))
+        self.queued_names = set(filter(lambda fn: not fn.startswith(prefix), self.queued_names))
+        for fn in list(filter(lambda fn: fn.startswith(prefix), self.futures.keys())):
+            self.futures.pop(fn).cancel()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.queued.clear()
+        self.queued_names.clear()
+        self.futures.clear()
+        self.current = None
+
+
 def read_text_file(fn: str, n = -1) -> str:
     with open(fn) as f:
         return f.read(n)
@@ -256,6 +522,42 @@ def select_text(s:str, sel_span: tuple[int, int]):
     s = s[:sel_span[0]] + mark_open + s[sel_span[0]: sel_span[1]] + mark_close + s[sel_span[1]:]
     return s
 
+def make_text_snippet(s: str, spans: list[tuple[int, int]], context: int = 300, max_spans: int = 100):
+    """
+    Cuts text around the matches, so large text (i.e. full text of the book) is not kept and displayed as a whole.
+    Args:
+        s: Text.
+        spans: Sorted matches (begin, end) in the text.
+        context: Number of characters kept before and after every match.
+        max_spans: Number of the first matches kept.
+    Returns: tuple (snippet, spans of the matches in the snippet).
+    """
+    spans = spans[:max_spans]
+    if not spans:
+        return s[:2 * context], list()
+
+    windows = list()
+    for b, e in spans:
+        wb, we = max(0, b - context), min(len(s), e + context)
+        if windows and wb <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], we)
+        else:
+            windows.append([wb, we])
+
+    separator = ' … '
+    snippet = ''
+    snippet_spans = list()
+    i = 0
+    for wb, we in windows:
+        if snippet:
+            snippet += separator
+        shift = len(snippet) - wb
+        snippet += s[wb:we]
+        while i < len(spans) and spans[i][1] <= we:
+            snippet_spans.append((spans[i][0] + shift, spans[i][1] + shift))
+            i += 1
+    return snippet, snippet_spans
+
 def wrap_text(s:str, calculated_width: float, window_width: float) -> str:
     char_per_line = int(len(s) * window_width / calculated_width)
     src_len = len(s)